@@ -0,0 +1,106 @@
+"""
+Compares the ChromiumBookmarkLoader used by 'bookworm sync' (native) against langchain's JSONLoader with a jq schema (jq, the previous loader).
+
+Generates a synthetic Chromium Bookmarks file with nested folders, then reports the time and peak (Python) memory taken
+by each loader to produce every document. Both loaders are checked to produce the same page content.
+
+    python benchmarks/chromium_loader.py --bookmarks 200000 --repeat 3
+
+The jq loader requires the 'jq' package.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Iterator
+
+from langchain_core.documents import Document
+from rich.console import Console
+from rich.table import Table
+
+from bookworm_genai.loaders import ChromiumBookmarkLoader
+
+from corpora import chromium_bookmarks
+
+CHROMIUM_JQ_COMMAND = """
+  [.roots.bookmark_bar.children, .roots.other.children] |
+  flatten |
+  .. |
+  objects |
+  select(.type == "url")
+"""
+
+
+def _jq_loader(path: str) -> Iterator[Document]:
+    from langchain_community.document_loaders import JSONLoader
+
+    return JSONLoader(file_path=path, jq_schema=CHROMIUM_JQ_COMMAND, text_content=False).lazy_load()
+
+
+def _native_loader(path: str) -> Iterator[Document]:
+    return ChromiumBookmarkLoader(file_path=path).lazy_load()
+
+
+def _measure(load: Callable[[str], Iterator[Document]], path: str, trace_memory: bool) -> tuple[float, int, str]:
+    # documents are consumed lazily (as sync does) and only a digest of them is kept to compare the loaders
+    digest = hashlib.sha256()
+
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    for doc in load(path):
+        digest.update(doc.page_content.encode("utf-8"))
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return elapsed, peak, digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookmarks", type=int, default=200_000)
+    parser.add_argument("--folder-size", type=int, default=50, help="maximum number of children per folder")
+    parser.add_argument("--max-depth", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    console = Console()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "Bookmarks")
+
+        with open(path, "w") as f:
+            json.dump(chromium_bookmarks(random.Random(args.seed), args.bookmarks, args.folder_size, args.max_depth), f)
+
+        console.print(f"generated {args.bookmarks} bookmarks ({os.path.getsize(path) / 1_000_000:.1f} MB)")
+
+        table = Table("loader", "median time (s)", "peak memory (MB)")
+        digests = set()
+
+        for name, load in [("jq", _jq_loader), ("native", _native_loader)]:
+            # tracing memory slows everything down, so time and memory are measured in separate runs
+            timings = [_measure(load, path, trace_memory=False)[0] for _ in range(args.repeat)]
+            _, peak, digest = _measure(load, path, trace_memory=True)
+
+            digests.add(digest)
+            table.add_row(name, f"{statistics.median(timings):.3f}", f"{peak / 1_000_000:.1f}")
+
+        console.print(table)
+
+        assert len(digests) == 1, "loaders produced different documents"
+
+
+if __name__ == "__main__":
+    main()
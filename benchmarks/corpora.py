@@ -0,0 +1,108 @@
+"""
+Synthetic bookmark fixtures for the benchmarks: a Chromium 'Bookmarks' JSON file and a Firefox 'places.sqlite' database.
+
+Bookmarks are named after a few words of a small vocabulary (so that keyword and vector searches have something to match)
+and point at URLs spread over a thousand domains. The Firefox bookmarks share a tenth of their URLs with the Chromium ones,
+as the same sites are usually bookmarked in more than one browser.
+"""
+
+import json
+import random
+import sqlite3
+from typing import Iterator
+
+from bookworm_genai.utils import chunked
+
+# the share of the Firefox bookmarks which point at a URL also bookmarked in Chromium
+FIREFOX_OVERLAP = 0.1
+
+WORDS = [
+    "python", "pandas", "duckdb", "sqlite", "rust", "docker", "kubernetes", "linux", "git", "github", "vim", "emacs", "recipe",
+    "travel", "japan", "osaka", "tokyo", "music", "guitar", "piano", "finance", "budget", "taxes", "news", "science", "space",
+    "climate", "design", "typography", "photo", "camera", "running", "cycling", "football", "chess", "history", "books", "poetry",
+]  # fmt: skip
+
+# Chromium stores times as microseconds since 1601, Firefox as microseconds since 1970
+CHROMIUM_DATE = 13_300_000_000_000_000
+FIREFOX_DATE = 1_700_000_000_000_000
+
+
+def bookmark_title(rng: random.Random, index: int) -> str:
+    return f"{' '.join(rng.sample(WORDS, 3))} {index}"
+
+
+def bookmark_url(index: int) -> str:
+    return f"https://example{index % 1000}.com/page/{index}"
+
+
+def chromium_bookmarks(rng: random.Random, count: int, folder_size: int = 50, max_depth: int = 4) -> dict:
+    """
+    The content of a Chromium 'Bookmarks' file holding count bookmarks in nested folders.
+    """
+
+    def _folder(name: str, depth: int, remaining: list[int]) -> dict:
+        children = []
+
+        while remaining[0] > 0 and len(children) < folder_size:
+            if depth < max_depth and rng.random() < 0.1:
+                children.append(_folder(f"folder {remaining[0]}", depth + 1, remaining))
+                continue
+
+            remaining[0] -= 1
+            children.append(
+                {
+                    "date_added": str(CHROMIUM_DATE + remaining[0]),
+                    "guid": f"{remaining[0]:032x}",
+                    "id": str(remaining[0]),
+                    "name": bookmark_title(rng, remaining[0]),
+                    "type": "url",
+                    "url": bookmark_url(remaining[0]),
+                }
+            )
+
+        return {"children": children, "name": name, "type": "folder"}
+
+    remaining = [count]
+    bar = _folder("Bookmarks bar", 0, remaining)
+
+    other = {"children": [], "name": "Other bookmarks", "type": "folder"}
+    while remaining[0] > 0:
+        other["children"].append(_folder(f"folder {remaining[0]}", 1, remaining))
+
+    return {"roots": {"bookmark_bar": bar, "other": other, "synced": {"children": [], "name": "Mobile bookmarks", "type": "folder"}}, "version": 1}
+
+
+def write_chromium(path: str, count: int, seed: int = 42):
+    with open(path, "w") as f:
+        json.dump(chromium_bookmarks(random.Random(seed), count), f)
+
+
+def write_firefox(path: str, count: int, seed: int = 42, batch_size: int = 10_000):
+    """
+    Writes a Firefox 'places.sqlite' database (the tables and columns read by FirefoxBookmarkLoader) holding count bookmarks.
+    """
+    rng = random.Random(seed + 1)
+    first = count - int(count * FIREFOX_OVERLAP)
+
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE moz_places (id INTEGER PRIMARY KEY, url TEXT, title TEXT)")
+        conn.execute(
+            "CREATE TABLE moz_bookmarks (id INTEGER PRIMARY KEY, type INTEGER, fk INTEGER, parent INTEGER, title TEXT, dateAdded INTEGER, lastModified INTEGER)"
+        )
+
+        # the root folder, every bookmark is placed directly under it
+        conn.execute("INSERT INTO moz_bookmarks VALUES (1, 2, NULL, 0, 'menu', ?, ?)", [FIREFOX_DATE, FIREFOX_DATE])
+
+        for rows in chunked(_firefox_rows(rng, first, count), batch_size):
+            conn.executemany("INSERT INTO moz_places VALUES (?, ?, ?)", [(place_id, url, title) for place_id, url, title, _ in rows])
+            conn.executemany(
+                "INSERT INTO moz_bookmarks (type, fk, parent, title, dateAdded, lastModified) VALUES (1, ?, 1, ?, ?, ?)",
+                [(place_id, title, date, date) for place_id, _, title, date in rows],
+            )
+
+
+def _firefox_rows(rng: random.Random, first: int, count: int) -> Iterator[tuple[int, str, str, int]]:
+    for place_id in range(1, count + 1):
+        index = first + place_id
+
+        yield place_id, bookmark_url(index), bookmark_title(rng, index), FIREFOX_DATE + place_id
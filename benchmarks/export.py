@@ -0,0 +1,128 @@
+"""
+Compares 'bookworm export' (DuckDB streaming the typed columns into the file with COPY) against the previous export, which read
+the whole table (embeddings included) into a pandas DataFrame, parsed the JSON columns row by row and wrote it with to_csv.
+
+Builds a synthetic bookmark database, then reports the time, peak memory (resident set size) and output size of each export.
+Every export runs in a fresh process so that its peak memory is not inflated by the previous one.
+
+    python benchmarks/export.py --rows 200000 --dimensions 1536 --repeat 3
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+import duckdb
+import pandas as pd
+from rich.console import Console
+from rich.table import Table
+
+from bookworm_genai import schema
+from bookworm_genai.commands.export import EXPORT_FORMATS, export
+
+
+def _create_store(path: str, rows: int, dimensions: int):
+    columns = ", ".join(schema.BOOKMARK_COLUMNS)
+    expressions = ", ".join(expression for _, expression in schema.BOOKMARK_COLUMNS.values())
+
+    with duckdb.connect(path) as conn:
+        schema.ensure_table(conn)
+        conn.execute(
+            f"""
+            INSERT INTO {schema.TABLE_NAME} (id, text, embedding, metadata, {columns})
+            SELECT id, text, embedding, metadata, {expressions}
+            FROM (
+                SELECT
+                    i::VARCHAR AS id,
+                    json_object('name', 'bookmark ' || i, 'url', 'https://example' || (i % 1000) || '.com/page/' || i)::VARCHAR AS text,
+                    list_transform(range({dimensions}), d -> random()::FLOAT) AS embedding,
+                    json_object('browser', 'chrome', 'source', '/chrome/Bookmarks')::VARCHAR AS metadata
+                FROM range({rows}) AS t(i)
+            )
+            """
+        )
+
+
+def _pandas_export(store: str, output: str):
+    # the export before it was pushed into DuckDB
+    with duckdb.connect(store, read_only=True) as duck:
+        df = duck.execute("select * from embeddings").df()
+
+    browser_col = df["metadata"].apply(json.loads).apply(lambda x: x["browser"]).rename(index="browser")
+    source_col = df["metadata"].apply(json.loads).apply(lambda x: x["source"]).rename(index="source")
+    name_col = df["text"].apply(json.loads).apply(lambda x: x["name"]).rename(index="name")
+    url_col = df["text"].apply(json.loads).apply(lambda x: x["url"]).rename(index="url")
+
+    bookmarks = pd.concat([name_col, url_col, browser_col, source_col], axis=1)
+    bookmarks.to_csv(output, index=False)
+
+
+def _duckdb_export(store: str, output: str, format: str):
+    with patch("bookworm_genai.commands.export._get_local_store", return_value=store):
+        export(output, format=format)
+
+
+def _run(queue: multiprocessing.Queue, name: str, store: str, output: str):
+    start = time.perf_counter()
+
+    if name == "pandas (previous)":
+        _pandas_export(store, output)
+    else:
+        _duckdb_export(store, output, name)
+
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1_000))
+
+
+def _measure(name: str, store: str, output: str) -> tuple[float, int]:
+    queue = multiprocessing.Queue()
+
+    process = multiprocessing.Process(target=_run, args=(queue, name, store, output))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    console = Console()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = os.path.join(directory, "bookmarks.duckdb")
+        _create_store(store, args.rows, args.dimensions)
+
+        console.print(f"generated {args.rows} bookmarks ({os.path.getsize(store) / 1_000_000:.1f} MB)")
+
+        table = Table("export", "median time (s)", "peak memory (MB)", "output size (MB)")
+
+        for name in ["pandas (previous)", *EXPORT_FORMATS]:
+            output = os.path.join(directory, f"bookmarks.{name.split()[0]}")
+            runs = [_measure(name, store, output) for _ in range(args.repeat)]
+
+            table.add_row(
+                name,
+                f"{statistics.median(elapsed for elapsed, _ in runs):.3f}",
+                f"{max(peak for _, peak in runs) / 1_000_000:.1f}",
+                f"{os.path.getsize(output) / 1_000_000:.1f}",
+            )
+
+        console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Reports how long the modules behind each 'bookworm' command take to import, using python's -X importtime.
+
+The CLI entry point (bookworm_genai.__main__) only imports what is needed to parse the arguments, each command then imports
+its own dependencies when it runs. Every module is imported in a fresh interpreter so that nothing is already cached,
+the slowest (cumulative) imports beneath each one are listed to show where the time goes.
+
+    python benchmarks/import_time.py --repeat 5 --top 10
+
+tests/test_importtime.py enforces a budget on the import time of the entry point.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+from rich.console import Console
+from rich.table import Table
+
+MODULES = {
+    "bookworm (--help, --version)": "bookworm_genai.__main__",
+    "bookworm sync": "bookworm_genai.commands.sync",
+    "bookworm ask": "bookworm_genai.commands.ask",
+    "bookworm export": "bookworm_genai.commands.export",
+}
+
+
+def _import_times(module: str) -> dict[str, int]:
+    """
+    Imports the module in a fresh interpreter and returns the cumulative import time (in microseconds) of every module imported.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="number of the slowest imports to list for each command")
+    args = parser.parse_args()
+
+    console = Console()
+
+    summary = Table("command", "module", "median import time (ms)")
+
+    for command, module in MODULES.items():
+        runs = [_import_times(module) for _ in range(args.repeat)]
+        summary.add_row(command, module, f"{statistics.median(run[module] for run in runs) / 1_000:.1f}")
+
+        # nested imports are listed too, a package is slow when its own cumulative time is large
+        breakdown = Table("imported module", "cumulative time (ms)", title=f"{command} - slowest imports")
+        slowest = sorted(((name, time) for name, time in runs[-1].items() if name != module), key=lambda item: item[1], reverse=True)
+
+        for name, time in slowest[: args.top]:
+            breakdown.add_row(name, f"{time / 1_000:.1f}")
+
+        console.print(breakdown)
+
+    console.print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Compares the int8 embedding storage (BOOKWORM_EMBEDDING_STORAGE=int8) against the default float32 storage.
+
+Builds two bookmark databases from the same embeddings, one per storage mode, each with its HNSW index. Reports the size
+of each database file and the recall@k (against an exact float32 search) and latency of the searches run by 'bookworm ask'
+for each storage mode. The int8 searches are run with several rescore multipliers (the number of candidates rescored
+against the float32 embeddings for every result).
+
+    python benchmarks/quantization.py --rows 100000 --dimensions 1536 --queries 100 -k 10 --multipliers 1 4 8 16
+
+The int8 database keeps the float32 embeddings to rescore with, so its file is larger than the float32 one. What shrinks
+is what the searches scan: the int8 embeddings for an exact search, and the first --candidate-dimensions of each embedding
+for the index (which DuckDB holds in memory).
+
+By default the embeddings are synthetic (clustered random vectors, see search_recall.py), which spread their information
+evenly across every dimension. Only the embeddings of models trained for it (OpenAI's text-embedding-3) can be truncated to
+their first dimensions (see quantization.py), measure those with real embeddings saved as a NumPy array of one row per
+bookmark, e.g for text-embedding-ada-002 (which is never truncated) and text-embedding-3-small:
+
+    python benchmarks/quantization.py --embeddings ada-002.npy --candidate-dimensions 0
+    python benchmarks/quantization.py --embeddings 3-small.npy --candidate-dimensions 256
+
+The queries are then rows held out of the bookmarks.
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, Optional
+
+import duckdb
+import numpy as np
+from langchain_core.documents import Document
+from rich.console import Console
+from rich.table import Table
+
+from bookworm_genai import schema
+from bookworm_genai.quantization import CANDIDATE_DIMENSIONS, quantize
+from bookworm_genai.search import create_index, load_vss, quantized_search, similarity_search
+
+CHUNK_SIZE = 10_000
+
+
+def _vectors(rng: np.random.Generator, centers: np.ndarray, rows: int) -> np.ndarray:
+    assignments = rng.integers(0, len(centers), size=rows)
+
+    vectors = centers[assignments] + rng.normal(scale=0.5, size=(rows, centers.shape[1]))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _create_store(path: str, vectors: np.ndarray, quantized: bool, candidate_dimensions: Optional[int]) -> duckdb.DuckDBPyConnection:
+    conn = duckdb.connect(path)
+    schema.ensure_table(conn)
+
+    for start in range(0, len(vectors), CHUNK_SIZE):
+        chunk = vectors[start : start + CHUNK_SIZE]
+        ids = [str(index) for index in range(start, start + len(chunk))]
+
+        if quantized:
+            candidates, codes = quantize(chunk, candidate_dimensions)
+            schema.insert(conn, ids, ids, chunk, [{}] * len(chunk), codes, candidates)
+        else:
+            schema.insert(conn, ids, ids, chunk, [{}] * len(chunk))
+
+    create_index(conn)
+    return conn
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    return statistics.quantiles(values, n=100)[percentile - 1]
+
+
+def _run(search: Callable[[list[float]], list[Document]], queries: list[list[float]], expected: list[set[str]], k: int) -> tuple[float, list[float]]:
+    latencies: list[float] = []
+    recalls: list[float] = []
+
+    for query, relevant in zip(queries, expected):
+        start = time.perf_counter()
+        docs = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        recalls.append(len({doc.page_content for doc in docs} & relevant) / k)
+
+    return statistics.mean(recalls), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--multipliers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--candidate-dimensions", type=int, default=CANDIDATE_DIMENSIONS, help="0 to build the int8 index over the full embeddings")
+    parser.add_argument("--embeddings", help="a .npy file of real embeddings (one row per bookmark) to use instead of synthetic ones")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    candidate_dimensions = args.candidate_dimensions or None
+
+    console = Console()
+    rng = np.random.default_rng(args.seed)
+
+    if not load_vss(duckdb.connect(":memory:")):
+        raise SystemExit("DuckDB vss extension is not available")
+
+    if args.embeddings:
+        # rows held out of the bookmarks stand in for the queries, real queries are short texts embedded by the same model
+        rows = np.load(args.embeddings).astype(np.float32)
+        rng.shuffle(rows)
+
+        queries = rows[: args.queries].tolist()
+        vectors = rows[args.queries :]
+    else:
+        with console.status(f"generating {args.rows} x {args.dimensions} embeddings"):
+            # the queries are drawn around the same clusters as the bookmarks, like a query about the topic of some bookmarks
+            centers = rng.normal(size=(args.clusters, args.dimensions))
+            vectors = _vectors(rng, centers, args.rows)
+            queries = _vectors(rng, centers, args.queries).tolist()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {"float32": os.path.join(directory, "float32.duckdb"), "int8": os.path.join(directory, "int8.duckdb")}
+
+        with console.status("building the float32 and int8 databases"):
+            float32 = _create_store(paths["float32"], vectors, quantized=False, candidate_dimensions=None)
+            int8 = _create_store(paths["int8"], vectors, quantized=True, candidate_dimensions=candidate_dimensions)
+
+        # the bytes of the vectors each mode compares every row against in an exact search, and builds its index over
+        dimensions = vectors.shape[1]
+        scanned = {"float32": dimensions * 4, "int8": dimensions}
+        indexed = {"float32": dimensions * 4, "int8": (candidate_dimensions or dimensions) * 4}
+
+        sizes = Table("storage", "file size (MB)", "vs float32", "exact scan (MB)", "index vectors (MB)")
+        for name, path in paths.items():
+            size = os.path.getsize(path)
+            sizes.add_row(
+                name,
+                f"{size / 1_000_000:.1f}",
+                f"{size / os.path.getsize(paths['float32']):.2f}x",
+                f"{len(vectors) * scanned[name] / 1_000_000:.1f}",
+                f"{len(vectors) * indexed[name] / 1_000_000:.1f}",
+            )
+
+        console.print(sizes)
+
+        with console.status(f"running {args.queries} exact float32 queries"):
+            baseline = [{doc.page_content for doc in similarity_search(float32, query, k=args.k, use_index=False)} for query in queries]
+
+        searches = {
+            "float32 exact": lambda query: similarity_search(float32, query, k=args.k, use_index=False),
+            "float32 hnsw": lambda query: similarity_search(float32, query, k=args.k, use_index=True),
+            "int8 exact": lambda query: quantized_search(int8, query, k=args.k, use_index=False),
+        }
+        for multiplier in args.multipliers:
+            searches[f"int8 hnsw (rescore x{multiplier})"] = lambda query, multiplier=multiplier: quantized_search(
+                int8, query, k=args.k, use_index=True, multiplier=multiplier, candidate_dimensions=candidate_dimensions
+            )
+
+        table = Table(title=f"{len(vectors)} rows, {vectors.shape[1]} dimensions, k={args.k}")
+        table.add_column("search")
+        table.add_column(f"recall@{args.k}", justify="right")
+        table.add_column("p50 (ms)", justify="right")
+        table.add_column("p95 (ms)", justify="right")
+
+        for name, search in searches.items():
+            with console.status(f"running {args.queries} queries ({name})"):
+                recall, latencies = _run(search, queries, baseline, args.k)
+
+            table.add_row(name, f"{recall:.3f}", f"{_percentile(latencies, 50):.2f}", f"{_percentile(latencies, 95):.2f}")
+
+        console.print(table)
+
+        float32.close()
+        int8.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compares the HNSW vector index used by 'bookworm ask' against an exact (brute force) search.
+
+Builds a synthetic embeddings table (clustered random vectors, which behave more like real embeddings than uniform noise),
+then reports the recall@k of the index against the exact search along with the latency of both.
+The index can be evaluated at several values of hnsw_ef_search (BOOKWORM_HNSW_EF_SEARCH), higher values trade latency for recall.
+
+    python benchmarks/search_recall.py --rows 100000 --dimensions 1536 --queries 100 -k 10 --ef-search 64 128 256 512
+"""
+
+import argparse
+import statistics
+import time
+
+import duckdb
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+from bookworm_genai import schema
+from bookworm_genai.search import HNSW_DEFAULT_EF_SEARCH, create_index, load_vss, set_ef_search, similarity_search
+
+
+def _vectors(rng: np.random.Generator, rows: int, dimensions: int, clusters: int) -> np.ndarray:
+    centers = rng.normal(size=(clusters, dimensions))
+    assignments = rng.integers(0, clusters, size=rows)
+
+    vectors = centers[assignments] + rng.normal(scale=0.5, size=(rows, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    return statistics.quantiles(values, n=100)[percentile - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[HNSW_DEFAULT_EF_SEARCH])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    console = Console()
+    rng = np.random.default_rng(args.seed)
+
+    conn = duckdb.connect(":memory:")
+    if not load_vss(conn):
+        raise SystemExit("DuckDB vss extension is not available")
+
+    with console.status(f"generating {args.rows} x {args.dimensions} embeddings"):
+        vectors = _vectors(rng, args.rows, args.dimensions, args.clusters)
+        ids = np.arange(args.rows).astype(str).tolist()
+
+        schema.ensure_table(conn)
+        schema.insert(conn, ids, ids, vectors, [{}] * args.rows)
+
+    with console.status("building HNSW index"):
+        start = time.perf_counter()
+        create_index(conn)
+        build_seconds = time.perf_counter() - start
+
+    queries = _vectors(rng, args.queries, args.dimensions, args.clusters).tolist()
+
+    exact_results: list[set[str]] = []
+    exact_latencies: list[float] = []
+
+    with console.status(f"running {args.queries} exact queries"):
+        for query in queries:
+            start = time.perf_counter()
+            docs = similarity_search(conn, query, k=args.k, use_index=False)
+            exact_latencies.append((time.perf_counter() - start) * 1000)
+
+            exact_results.append({doc.page_content for doc in docs})
+
+    table = Table(title=f"{args.rows} rows, {args.dimensions} dimensions, k={args.k}, index built in {build_seconds:.1f}s")
+    table.add_column("search")
+    table.add_column(f"recall@{args.k}", justify="right")
+    table.add_column("p50 (ms)", justify="right")
+    table.add_column("p95 (ms)", justify="right")
+
+    table.add_row("exact", "1.000", f"{_percentile(exact_latencies, 50):.2f}", f"{_percentile(exact_latencies, 95):.2f}")
+
+    for ef_search in args.ef_search:
+        set_ef_search(conn, ef_search)
+
+        latencies: list[float] = []
+        recalls: list[float] = []
+
+        with console.status(f"running {args.queries} indexed queries (ef_search={ef_search})"):
+            for query, expected in zip(queries, exact_results):
+                start = time.perf_counter()
+                docs = similarity_search(conn, query, k=args.k, use_index=True)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+                recalls.append(len({doc.page_content for doc in docs} & expected) / args.k)
+
+        table.add_row(
+            f"hnsw (ef_search={ef_search})",
+            f"{statistics.mean(recalls):.3f}",
+            f"{_percentile(latencies, 50):.2f}",
+            f"{_percentile(latencies, 95):.2f}",
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+"""
+Measures every stage of bookworm against synthetic bookmark corpora, so that performance regressions show up between commits.
+
+For every size a Chromium 'Bookmarks' file and a Firefox 'places.sqlite' database each holding that many bookmarks are
+generated (see corpora.py), then each stage runs in a fresh process and reports its time, throughput and peak memory
+(resident set size):
+
+- load: reads every bookmark of both browsers with their loaders
+- load-locked: reads every Firefox bookmark while the database is locked, as it is while Firefox runs, with its latest writes
+  in the write-ahead log and ten places of history for every bookmark
+- embed: embeds every bookmark through ConcurrentEmbeddings
+- sync: 'bookworm sync' of both browsers into an empty database (load, deduplicate, embed, store and build the indexes)
+- search: 'bookworm ask --no-llm' queries, with the latency of each query
+- ask: 'bookworm ask' queries through the LLM chain, with the latency of each query
+- export: 'bookworm export' into a CSV file
+
+The embeddings and the chat model are deterministic fakes so that no network (or API key) is needed and runs stay comparable,
+the round trip of each embeddings request can be simulated with --embedding-latency. The results are written as JSON along
+with the commit they were measured at, and a previous run can be compared against:
+
+    python benchmarks/suite.py --sizes 1000 10000 100000 1000000 --output results.json
+    python benchmarks/suite.py --sizes 1000 10000 --compare results.json --output new.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import ExitStack, closing, contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from queue import Empty
+from typing import Callable, Iterator, Optional
+from unittest.mock import patch
+
+import duckdb
+import numpy as np
+from langchain_core.embeddings.embeddings import Embeddings
+from langchain_core.runnables import RunnableLambda
+from rich.console import Console
+from rich.table import Table
+
+from bookworm_genai import __version__
+from bookworm_genai.browser import Browser
+from bookworm_genai.embeddings import ConcurrentEmbeddings
+from bookworm_genai.loaders import ChromiumBookmarkLoader, FirefoxBookmarkLoader
+from bookworm_genai.storage import DEFAULT_CHUNK_SIZE, EmbeddingStorage
+from bookworm_genai.utils import chunked
+
+from corpora import WORDS, write_chromium, write_firefox
+
+# how often a stage which has not reported its result yet is checked on
+RESULT_POLL_SECONDS = 1.0
+
+CHROMIUM_FILE = "Bookmarks"
+FIREFOX_FILE = "places.sqlite"
+
+_WORD = re.compile(r"[a-z]+")
+_VOCABULARY = frozenset(WORDS)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Embeds every text into the (normalized) sum of a random vector for each of its words and a little noise seeded by the
+    checksum of the text, after waiting for the given latency. Texts sharing words end up close together, like real embeddings.
+    """
+
+    model = "benchmark-fake"
+
+    def __init__(self, dimensions: int, latency: float = 0.0):
+        self.dimensions = dimensions
+        self._latency = latency
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self._latency)
+        return self._embed(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self._latency)
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        vectors = np.stack([self._embed_text(text) for text in texts])
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).tolist()
+
+    def _embed_text(self, text: str) -> np.ndarray:
+        noise = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dimensions, dtype=np.float32)
+        return sum((self._word_vector(word) for word in _WORD.findall(text.lower()) if word in _VOCABULARY), noise * 0.5)
+
+    @lru_cache(maxsize=None)
+    def _word_vector(self, word: str) -> np.ndarray:
+        return np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(self.dimensions, dtype=np.float32)
+
+
+class FakeChatModel:
+    """
+    Selects no bookmarks for every question, so that 'ask' measures the chain (retrieval and the prompt) and not a model.
+    """
+
+    def with_structured_output(self, schema):
+        return RunnableLambda(lambda prompt: schema(indices=[]))
+
+
+def _loaders(directory: str) -> list:
+    return [ChromiumBookmarkLoader(os.path.join(directory, CHROMIUM_FILE)), FirefoxBookmarkLoader(os.path.join(directory, FIREFOX_FILE))]
+
+
+def _queries(count: int, seed: int) -> list[str]:
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, size=2, replace=False)) for _ in range(count)]
+
+
+def _load(directory: str, args: argparse.Namespace) -> dict:
+    start = time.perf_counter()
+    items = sum(1 for loader in _loaders(directory) for _ in loader.lazy_load())
+
+    return {"items": items, "seconds": time.perf_counter() - start}
+
+
+def _load_locked(directory: str, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory() as locked:
+        path = os.path.join(locked, FIREFOX_FILE)
+        shutil.copyfile(os.path.join(directory, FIREFOX_FILE), path)
+
+        with closing(sqlite3.connect(path)) as firefox:
+            # the history makes up most of a real places.sqlite, it is never read but a copy of the database pays for it
+            (places,) = firefox.execute("SELECT max(id) FROM moz_places").fetchone()
+            firefox.execute(
+                """
+                WITH RECURSIVE history(id) AS (SELECT ? UNION ALL SELECT id + 1 FROM history WHERE id < ?)
+                INSERT INTO moz_places SELECT id, 'https://history.example.com/' || id, 'visited page ' || id FROM history
+                """,
+                [places + 1, places * 11],
+            )
+            firefox.commit()
+
+            firefox.execute("PRAGMA locking_mode = EXCLUSIVE")
+            firefox.execute("PRAGMA journal_mode = WAL")
+            firefox.execute("PRAGMA wal_autocheckpoint = 0")
+            firefox.execute("UPDATE moz_bookmarks SET lastModified = lastModified + 1 WHERE id % 10 = 0")
+            firefox.commit()
+
+            start = time.perf_counter()
+            items = sum(1 for _ in FirefoxBookmarkLoader(path).lazy_load())
+
+            return {"items": items, "seconds": time.perf_counter() - start}
+
+
+def _embed(directory: str, args: argparse.Namespace) -> dict:
+    texts = [doc.page_content for loader in _loaders(directory) for doc in loader.lazy_load()]
+
+    # embedded one chunk at a time, as sync does
+    embeddings = ConcurrentEmbeddings(FakeEmbeddings(args.dimensions, args.embedding_latency / 1_000), show_progress=False)
+
+    start = time.perf_counter()
+    for chunk in chunked(texts, DEFAULT_CHUNK_SIZE):
+        embeddings.embed_documents(chunk)
+
+    return {"items": len(texts), "seconds": time.perf_counter() - start}
+
+
+def _sync(directory: str, args: argparse.Namespace) -> dict:
+    from bookworm_genai.commands.sync import sync
+    from bookworm_genai.paths import _get_local_store
+
+    browsers = {
+        Browser.CHROME: {
+            sys.platform: {"bookmark_loader": ChromiumBookmarkLoader, "bookmark_loader_kwargs": {"file_path": os.path.join(directory, CHROMIUM_FILE)}}
+        },
+        Browser.FIREFOX: {
+            sys.platform: {"bookmark_loader": FirefoxBookmarkLoader, "bookmark_loader_kwargs": {"file_path": os.path.join(directory, FIREFOX_FILE)}}
+        },
+    }
+
+    start = time.perf_counter()
+    sync(browsers)
+    seconds = time.perf_counter() - start
+
+    with duckdb.connect(_get_local_store(), read_only=True) as conn:
+        (items,) = conn.execute("SELECT count(*) FROM embeddings").fetchone()
+
+    return {"items": items, "seconds": seconds}
+
+
+def _search(directory: str, args: argparse.Namespace, use_llm: bool = False) -> dict:
+    from bookworm_genai.commands.ask import BookmarkChain
+
+    queries = _queries(args.queries, args.seed)
+    latencies: list[float] = []
+
+    start = time.perf_counter()
+    with BookmarkChain(vector_store_search_n=args.top_n, use_llm=use_llm) as chain:
+        setup = time.perf_counter() - start
+        search = chain.ask if use_llm else chain.search
+
+        for query in queries:
+            query_start = time.perf_counter()
+            search(query)
+            latencies.append((time.perf_counter() - query_start) * 1_000)
+
+    return {"items": len(queries), "seconds": sum(latencies) / 1_000, "setup_seconds": setup, "latencies_ms": latencies}
+
+
+def _export(directory: str, args: argparse.Namespace) -> dict:
+    from bookworm_genai.commands.export import export
+
+    start = time.perf_counter()
+    items = export(os.path.join(directory, "bookmarks.csv"))
+
+    return {"items": items, "seconds": time.perf_counter() - start}
+
+
+STAGES: dict[str, Callable[[str, argparse.Namespace], dict]] = {
+    "load": _load,
+    "load-locked": _load_locked,
+    "embed": _embed,
+    "sync": _sync,
+    "search": _search,
+    "ask": partial(_search, use_llm=True),
+    "export": _export,
+}
+
+# stages which read the database written by the sync stage
+SYNCED_STAGES = ["search", "ask", "export"]
+
+
+@contextmanager
+def _environment(directory: str, args: argparse.Namespace) -> Iterator[None]:
+    # the database (and caches) are kept in the directory of the corpus and the embeddings service and LLM are faked
+    with ExitStack() as stack:
+        stack.enter_context(
+            patch.dict(os.environ, {"OPENAI_API_KEY": "benchmark", "BOOKWORM_EMBEDDING_BACKEND": "openai", "BOOKWORM_EMBEDDING_STORAGE": args.storage})
+        )
+        stack.enter_context(patch("bookworm_genai.paths._get_data_path", lambda name: os.path.join(directory, name)))
+        stack.enter_context(patch("bookworm_genai.storage.OpenAIEmbeddings", partial(FakeEmbeddings, args.dimensions, args.embedding_latency / 1_000)))
+        stack.enter_context(patch("bookworm_genai.storage.ConcurrentEmbeddings", partial(ConcurrentEmbeddings, show_progress=False)))
+        stack.enter_context(patch("bookworm_genai.commands.ask._get_llm", FakeChatModel))
+
+        yield
+
+
+def _peak_rss() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1_024
+
+
+def _run(queue: multiprocessing.Queue, stage: str, directory: str, args: argparse.Namespace):
+    logging.getLogger("bookworm_genai").setLevel(logging.WARNING)
+
+    try:
+        with _environment(directory, args):
+            result = STAGES[stage](directory, args)
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+        return
+
+    queue.put({**result, "peak_rss_bytes": _peak_rss()})
+
+
+def _measure(stage: str, directory: str, args: argparse.Namespace) -> dict:
+    # every stage runs in a fresh process so that its peak memory is not inflated by the stages before it
+    queue = multiprocessing.Queue()
+
+    process = multiprocessing.Process(target=_run, args=(queue, stage, directory, args))
+    process.start()
+
+    result = _result(queue, process, args.stage_timeout)
+    process.join()
+
+    if result is None:
+        return {"error": f"the process exited with code {process.exitcode} without a result"}
+    if "error" not in result and process.exitcode != 0:
+        return {"error": f"the process exited with code {process.exitcode}"}
+    if "error" in result:
+        return result
+
+    latencies = result.pop("latencies_ms", None)
+    if latencies:
+        result["p50_ms"] = _percentile(latencies, 50)
+        result["p95_ms"] = _percentile(latencies, 95)
+
+    result["throughput"] = result["items"] / result["seconds"] if result["seconds"] else None
+    return result
+
+
+def _result(queue: multiprocessing.Queue, process: multiprocessing.Process, timeout: float) -> Optional[dict]:
+    """
+    Waits for the result of the stage, None when its process exited without one (e.g it crashed or was killed for running
+    out of memory). A stage which runs for longer than the timeout is killed and reported as failed.
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            return queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            pass
+
+        if not process.is_alive():
+            # the result can still be in flight from a process which put it just before exiting
+            try:
+                return queue.get(timeout=RESULT_POLL_SECONDS)
+            except Empty:
+                return None
+
+        if time.monotonic() > deadline:
+            process.kill()
+            return {"error": f"timed out after {timeout:g}s"}
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    if len(values) < 2:
+        return values[0]
+
+    return statistics.quantiles(values, n=100)[percentile - 1]
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _headline(result: dict) -> Optional[float]:
+    # the number compared between runs: the median query latency of the query stages and the total time of the others
+    return result.get("p50_ms", result.get("seconds"))
+
+
+def _baseline(path: Optional[str]) -> dict[tuple[int, str], dict]:
+    if path is None:
+        return {}
+
+    with open(path) as f:
+        run = json.load(f)
+
+    return {(result["size"], result["stage"]): result for result in run["results"] if "error" not in result}
+
+
+def _format(value: Optional[float], precision: int = 3) -> str:
+    return "" if value is None else f"{value:,.{precision}f}"
+
+
+def _table(results: list[dict], baseline: dict[tuple[int, str], dict]) -> Table:
+    table = Table()
+    for column in ["size", "stage", "items", "time (s)", "throughput (/s)", "p50 (ms)", "p95 (ms)", "peak RSS (MB)"]:
+        table.add_column(column, justify="left" if column == "stage" else "right")
+
+    if baseline:
+        table.add_column("vs baseline", justify="right")
+
+    for result in results:
+        if "error" in result:
+            table.add_row(f"{result['size']:,}", result["stage"], "[red]failed[/]")
+            continue
+
+        row = [
+            f"{result['size']:,}",
+            result["stage"],
+            f"{result['items']:,}",
+            _format(result["seconds"]),
+            _format(result["throughput"], 0),
+            _format(result.get("p50_ms"), 2),
+            _format(result.get("p95_ms"), 2),
+            _format(result["peak_rss_bytes"] / 1_000_000, 1),
+        ]
+
+        if baseline:
+            previous = baseline.get((result["size"], result["stage"]))
+            # above 1 the stage got slower than in the baseline
+            row.append(f"{_headline(result) / _headline(previous):.2f}x" if previous and _headline(previous) else "")
+
+        table.add_row(*row)
+
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000], help="bookmarks per browser, e.g 1000 10000 100000 1000000")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--storage", choices=EmbeddingStorage.list(), default=EmbeddingStorage.FLOAT32.value)
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="milliseconds taken by each (fake) embeddings request")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-n", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stage-timeout", type=float, default=3_600, help="seconds after which a stage is killed and reported as failed")
+    parser.add_argument("--output", default="benchmark.json", help="the JSON file the results are written to")
+    parser.add_argument("--compare", help="a JSON file written by a previous run to compare against")
+    args = parser.parse_args()
+
+    if "sync" not in args.stages and any(stage in SYNCED_STAGES for stage in args.stages):
+        parser.error(f"the {', '.join(SYNCED_STAGES)} stages need the sync stage to build their database")
+
+    console = Console()
+    baseline = _baseline(args.compare)
+    results: list[dict] = []
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            with console.status(f"generating {size:,} bookmarks per browser"):
+                write_chromium(os.path.join(directory, CHROMIUM_FILE), size, args.seed)
+                write_firefox(os.path.join(directory, FIREFOX_FILE), size, args.seed)
+
+            # the stages run in the order they are defined, the synced stages need the database written by sync
+            for stage in [stage for stage in STAGES if stage in args.stages]:
+                with console.status(f"running {stage} ({size:,} bookmarks per browser)"):
+                    results.append({"size": size, "stage": stage, **_measure(stage, directory, args)})
+
+    console.print(_table(results, baseline))
+
+    for result in results:
+        if "error" in result:
+            console.print(f"[red]{result['stage']} ({result['size']:,} bookmarks per browser) failed: {result['error']}[/]")
+
+    run = {
+        "version": __version__,
+        "commit": _commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "arguments": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "results": results,
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(run, f, indent=2)
+
+    console.print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
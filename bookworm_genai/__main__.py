@@ -1,12 +1,11 @@
 import sys
 import logging
 import argparse
+from contextlib import nullcontext
+from typing import Optional
 
-from bookworm_genai import __version__
-from bookworm_genai.integrations import browsers, Browser
-from bookworm_genai.commands.sync import sync
-from bookworm_genai.commands.ask import BookmarkChain
-from bookworm_genai.commands.export import export
+from bookworm_genai import __version__, profiling
+from bookworm_genai.browser import Browser
 
 logger = logging.getLogger(__name__)
 
@@ -14,20 +13,47 @@ logger = logging.getLogger(__name__)
 def main():
     arg_parser = argparse.ArgumentParser(description="LLM-powered bookmark search engine")
     arg_parser.add_argument("--version", action="version", version=__version__)
+    arg_parser.add_argument(
+        "--profile", action="store_true", default=False, help="Print the time, calls, tokens and memory of each stage of the command once it finishes"
+    )
+    arg_parser.add_argument("--profile-output", help="Also write the profile into this file (implies --profile)")
+    arg_parser.add_argument(
+        "--profile-format",
+        choices=profiling.PROFILE_FORMATS,
+        default=profiling.PROFILE_FORMATS[0],
+        help="The format of --profile-output, a Chrome trace of the stages or a cProfile / tracemalloc dump",
+    )
 
     sub_parsers = arg_parser.add_subparsers(dest="command", help="Available commands", required=True)
 
     sync_parser = sub_parsers.add_parser("sync", help="Sync the bookmark database with the latest changes")
     sync_parser.add_argument("--estimate-cost", action="store_true", default=False, help="Estimate the cost of syncing the bookmark database")
     sync_parser.add_argument("--browser-filter", default=[], help="Only sync a subset of browsers", choices=Browser.list())
+    sync_parser.add_argument(
+        "--force", action="store_true", default=False, help="Load every browser even if its bookmarks have not changed since the last sync"
+    )
 
     ask_parser = sub_parsers.add_parser("ask", help="Search for a bookmark")
     ask_parser.add_argument("-n", "--top-n", type=int, default=3, help="Number of bookmarks to return")
     ask_parser.add_argument("-q", "--query", help="The Search Query")
+    ask_parser.add_argument("--exact", action="store_true", default=False, help="Compare the query against every bookmark instead of using the vector index")
+    ask_parser.add_argument("--no-llm", action="store_true", default=False, help="Return the closest bookmarks directly without sending them through the LLM")
+    ask_parser.add_argument(
+        "--keyword", action="store_true", default=False, help="Only match the words of the query against bookmark titles and URLs, the query is not embedded"
+    )
+    ask_parser.add_argument("--no-server", action="store_true", default=False, help="Search locally even when 'bookworm serve' is running")
+    ask_parser.add_argument("--batch", help="Answer every query of this file (one per line, - for stdin) without prompting, see --output")
+    ask_parser.add_argument("--output", help="The file the answers of --batch are written into (JSON lines), defaults to results.jsonl")
+    ask_parser.add_argument("--concurrency", type=int, default=4, help="The number of queries of --batch which are sent through the LLM at once")
 
     export_parser = sub_parsers.add_parser("export", help="Export bookmarks")
-    export_parser.add_argument("--format", choices=["csv"], default="csv")
-    export_parser.add_argument("--output", default="bookmarks.csv")
+    export_parser.add_argument("--format", choices=["csv", "parquet", "jsonl"], default="csv")
+    export_parser.add_argument("--output", help="The file to export into, defaults to bookmarks.<format>")
+    export_parser.add_argument("--include-embeddings", action="store_true", default=False, help="Also export the embedding of every bookmark")
+
+    serve_parser = sub_parsers.add_parser("serve", help="Keep the bookmark database open to answer 'bookworm ask' faster")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="The loopback address to listen on, other addresses are rejected")
+    serve_parser.add_argument("--port", type=int, default=0, help="The port to listen on, any free port by default")
 
     args = arg_parser.parse_args(sys.argv[1:])
 
@@ -36,10 +62,8 @@ def main():
 
     logger.debug("Arguments: %s", args)
 
-    if args.command == "sync":
-        sync(browsers, estimate_cost=args.estimate_cost, browser_filter=args.browser_filter)
-
-    elif args.command == "ask":
+    query = None
+    if args.command == "ask" and not args.batch:
         if not args.query:
             logger.info("What would you like to search for?")
             query = input("> ")
@@ -48,48 +72,141 @@ def main():
 
         logger.debug("query: %s", query)
 
-        with BookmarkChain(vector_store_search_n=args.top_n) as bookmark_chain:
-            if not bookmark_chain.is_valid():
-                logger.debug("bookmark chain is not valid, exiting early.")
-                return
+    # the prompts waiting for the user are left out of the profile
+    with profiling.profile(args.profile_output, args.profile_format) if args.profile or args.profile_output else nullcontext():
+        bookmarks = _run(args, query)
+
+    if bookmarks is None:
+        return
+
+    logger.info("Press a number to open the bookmark:")
+    while True:
+        try:
+            raw_input = input("> ")
+            selected_index = int(raw_input)
+            bookmarks.bookmarks[selected_index].open()
+
+            break
+        except ValueError:
+            logger.warning(f"Invalid input: '{raw_input}'. Please enter a number.")
+        except IndexError:
+            logger.warning(f"Invalid index: '{selected_index}'. Please select a valid index.")
+
+
+def _run(args: argparse.Namespace, query: Optional[str]):
+    """
+    Runs the command, returning the bookmarks found by 'bookworm ask' for the user to pick from (None for other commands).
+    """
+    # each command imports what it needs when it runs, langchain and duckdb are slow to import
+    # and are not needed to parse the arguments (or print the help / version)
 
-            logger.info("Searching for bookmarks...")
-            bookmarks = bookmark_chain.ask(query)
+    if args.command == "sync":
+        from bookworm_genai.commands.sync import sync
+        from bookworm_genai.integrations import browsers
+
+        sync(browsers, estimate_cost=args.estimate_cost, browser_filter=args.browser_filter, force=args.force)
+
+    elif args.command == "ask" and args.batch:
+        from bookworm_genai.commands.ask import answer_queries
+
+        queries = _read_queries(args.batch)
+        output = args.output or "results.jsonl"
+
+        logger.info(f"[blue]Answering {len(queries)} queries into '{output}' [/]")
+        answered = answer_queries(queries, output, top_n=args.top_n, use_llm=not args.no_llm, keyword_only=args.keyword, max_concurrency=args.concurrency)
+
+        logger.info(f"✅ answered {answered} of {len(queries)} queries")
+
+    elif args.command == "ask":
+        bookmarks = None if args.no_server else _ask_server(query, args)
+
+        if bookmarks is None:
+            from bookworm_genai.client import paused_server
+            from bookworm_genai.commands.ask import BookmarkChain
+
+            # a running 'bookworm serve' (asked not to be used) holds the database open, which keeps this process from opening it
+            with paused_server(), BookmarkChain(
+                vector_store_search_n=args.top_n, exact_search=args.exact, use_llm=not args.no_llm, keyword_only=args.keyword
+            ) as bookmark_chain:
+                if not bookmark_chain.is_valid():
+                    logger.debug("bookmark chain is not valid, exiting early.")
+                    return None
+
+                logger.info("Searching for bookmarks...")
+                if args.no_llm:
+                    bookmarks = bookmark_chain.search(query)
+                else:
+                    bookmarks = bookmark_chain.ask(query)
 
         if not bookmarks.bookmarks:
             logger.info("""
             No bookmarks found for the query 🙁. Please ensure you have performed a "bookworm sync" to update the database
             and the query is relevant to the bookmarks stored.
             """)
-            return
+            return None
 
         for index, bookmark in enumerate(bookmarks.bookmarks):
+            # without the LLM the results are ranked by the score of the search which found them: their cosine similarity, their
+            # keyword (BM25) score with --keyword or, by default, their fused rank. The scores of each are not comparable so
+            # the search is shown along with the score
+            score = f" [dim]{bookmark.score_type or 'score'} {bookmark.score:.3f}[/]" if args.no_llm and bookmark.score is not None else ""
+
             if logger.isEnabledFor(logging.DEBUG):
                 # also shows the source of the bookmark
                 logger.info(
-                    f"[green][{index}] [/] {bookmark.title} - [link={bookmark.url}]{bookmark.url}[/link] ([green]{bookmark.source}[/])"
+                    f"[green][{index}] [/] {bookmark.title} - [link={bookmark.url}]{bookmark.url}[/link] ([green]{bookmark.source}[/]){score}"
                 )  # pragma: no cover
             else:
-                logger.info(f"[green][{index}] [/] {bookmark.title} - [link={bookmark.url}]{bookmark.url}[/link] ([green]{bookmark.browser}[/])")
-
-        logger.info("Press a number to open the bookmark:")
-        while True:
-            try:
-                raw_input = input("> ")
-                selected_index = int(raw_input)
-                bookmarks.bookmarks[selected_index].open()
+                logger.info(f"[green][{index}] [/] {bookmark.title} - [link={bookmark.url}]{bookmark.url}[/link] ([green]{bookmark.browser}[/]){score}")
 
-                break
-            except ValueError:
-                logger.warning(f"Invalid input: '{raw_input}'. Please enter a number.")
-            except IndexError:
-                logger.warning(f"Invalid index: '{selected_index}'. Please select a valid index.")
+        return bookmarks
 
     elif args.command == "export":
-        bookmarks = export()
+        from bookworm_genai.commands.export import export
+
+        output = args.output or f"bookmarks.{args.format}"
+
+        logger.info(f"[blue]Exporting bookmarks to '{output}' [/]")
+        count = export(output, format=args.format, include_embeddings=args.include_embeddings)
+
+        logger.info(f"✅ exported {count} bookmarks")
+
+    elif args.command == "serve":
+        from bookworm_genai.commands.serve import serve
+
+        serve(host=args.host, port=args.port)
+
+    return None
+
+
+def _read_queries(path: str) -> list[str]:
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(path) as f:
+            lines = f.readlines()
+
+    return [line.strip() for line in lines if line.strip()]
+
+
+def _ask_server(query: str, args: argparse.Namespace):
+    """
+    Asks a running 'bookworm serve' (which already has everything open) instead of searching locally, None when none is running.
+    """
+    from bookworm_genai.client import ask
+
+    with profiling.span("ask server"):
+        bookmarks = ask(query, top_n=args.top_n, exact=args.exact, use_llm=not args.no_llm, keyword_only=args.keyword)
+
+    if bookmarks is None:
+        return None
+
+    logger.debug("answered by bookworm serve")
+
+    # the models import langchain, the daemon answered so nothing else of it is needed
+    from bookworm_genai.models import Bookmark, Bookmarks
 
-        logger.info(f"[blue]Exporting bookmarks to '{args.output}' [/]")
-        bookmarks.to_csv(args.output, index=False)
+    return Bookmarks(bookmarks=[Bookmark(**bookmark) for bookmark in bookmarks])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,11 @@
+from enum import Enum
+
+
+class Browser(str, Enum):
+    BRAVE = "brave"
+    CHROME = "chrome"
+    FIREFOX = "firefox"
+
+    @classmethod
+    def list(cls):
+        return list(map(lambda c: c.value, cls))
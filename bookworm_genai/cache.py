@@ -0,0 +1,409 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+from array import array
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import duckdb
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings.embeddings import Embeddings
+
+from bookworm_genai.embeddings import PartialEmbeddingsError
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_TABLE_NAME = "embedding_cache"
+EMBEDDING_CACHE_DEFAULT_SIZE = 100_000
+EMBEDDING_CACHE_ROWS_VIEW_NAME = "embeddings_to_cache"
+
+QUERY_CACHE_TABLE_NAME = "query_cache"
+QUERY_CACHE_DEFAULT_SIZE = 1_000
+QUERY_CACHE_DEFAULT_TTL = 30 * 24 * 60 * 60  # 30 days
+
+TOKEN_CACHE_TABLE_NAME = "token_cache"
+TOKEN_CACHE_DEFAULT_SIZE = 1_000_000
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings service with a persistent cache stored next to the vector store.
+
+    Vectors are keyed by the embedding model, its dimensions and a hash of the text so that a cache hit never reaches
+    the underlying service. The cache is capped at max_size entries and the least recently used entries are evicted first.
+    """
+
+    def __init__(self, embeddings: Embeddings, connection: duckdb.DuckDBPyConnection, max_size: Optional[int] = None):
+        self._embeddings = embeddings
+        self._connection = connection
+        self._max_size = max_size if max_size is not None else int(os.environ.get("BOOKWORM_EMBEDDING_CACHE_SIZE", EMBEDDING_CACHE_DEFAULT_SIZE))
+        self._model, self._dimensions = _embedding_model(embeddings)
+
+        self._ensure_table()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [_text_hash(text) for text in texts]
+
+        cached = self._lookup(hashes)
+
+        # the same text can appear more than once (e.g the same bookmark in two browsers), only embed it once
+        missing = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in cached}
+
+        logger.debug(f"embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses ({self._model})")
+
+        if missing:
+            try:
+                vectors = self._embeddings.embed_documents(list(missing.values()))
+            except PartialEmbeddingsError as e:
+                # the texts which were embedded are cached so that the next sync only embeds the others
+                embedded = {text_hash: vector for text_hash, vector in zip(missing.keys(), e.vectors) if vector is not None}
+                if embedded:
+                    self._store(embedded)
+                raise
+
+            computed = dict(zip(missing.keys(), vectors))
+
+            self._store(computed)
+            cached.update(computed)
+
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embeddings.embed_query(text)
+
+    def _ensure_table(self):
+        self._connection.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {EMBEDDING_CACHE_TABLE_NAME} (
+                model VARCHAR,
+                dimensions INTEGER,
+                text_hash VARCHAR,
+                embedding FLOAT[],
+                last_used TIMESTAMP,
+                PRIMARY KEY (model, dimensions, text_hash)
+            )
+            """
+        )
+
+    def _lookup(self, hashes: list[str]) -> dict[str, list[float]]:
+        if not hashes:
+            return {}
+
+        rows = self._connection.execute(
+            f"""
+            SELECT text_hash, embedding
+            FROM {EMBEDDING_CACHE_TABLE_NAME}
+            WHERE model = ? AND dimensions = ? AND text_hash IN (SELECT unnest(?::VARCHAR[]))
+            """,
+            [self._model, self._dimensions, hashes],
+        ).fetchall()
+
+        if rows:
+            self._connection.execute(
+                f"""
+                UPDATE {EMBEDDING_CACHE_TABLE_NAME}
+                SET last_used = current_timestamp
+                WHERE model = ? AND dimensions = ? AND text_hash IN (SELECT unnest(?::VARCHAR[]))
+                """,
+                [self._model, self._dimensions, [row[0] for row in rows]],
+            )
+
+        return {text_hash: embedding for text_hash, embedding in rows}
+
+    def _store(self, vectors: dict[str, list[float]]):
+        # a registered DataFrame is read by DuckDB without converting every value of the vectors into a python object
+        # first, which is many times faster than passing them as a (list) parameter
+        rows = pd.DataFrame({"text_hash": list(vectors.keys()), "embedding": list(np.asarray(list(vectors.values()), dtype=np.float32))})
+
+        self._connection.register(EMBEDDING_CACHE_ROWS_VIEW_NAME, rows)
+        try:
+            self._connection.execute(
+                f"""
+                INSERT OR REPLACE INTO {EMBEDDING_CACHE_TABLE_NAME}
+                SELECT ?, ?, text_hash, embedding, current_timestamp
+                FROM {EMBEDDING_CACHE_ROWS_VIEW_NAME}
+                """,
+                [self._model, self._dimensions],
+            )
+        finally:
+            self._connection.unregister(EMBEDDING_CACHE_ROWS_VIEW_NAME)
+
+        self._evict()
+
+    def _evict(self):
+        (size,) = self._connection.execute(f"SELECT COUNT(*) FROM {EMBEDDING_CACHE_TABLE_NAME}").fetchone()
+
+        overflow = size - self._max_size
+        if overflow <= 0:
+            return
+
+        logger.debug(f"embedding cache: evicting {overflow} least recently used entries")
+        self._connection.execute(
+            f"""
+            DELETE FROM {EMBEDDING_CACHE_TABLE_NAME}
+            WHERE rowid IN (SELECT rowid FROM {EMBEDDING_CACHE_TABLE_NAME} ORDER BY last_used ASC LIMIT ?)
+            """,
+            [overflow],
+        )
+
+
+def cached_text_hashes(connection: duckdb.DuckDBPyConnection, embeddings: Embeddings, hashes: list[str]) -> set[str]:
+    """
+    The hashes (see _text_hash) of the texts whose embedding by the given service is cached, the cache is left untouched
+    so this can be used through a read only connection.
+    """
+    model, dimensions = _embedding_model(embeddings)
+
+    (exists,) = connection.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [EMBEDDING_CACHE_TABLE_NAME]).fetchone()
+    if not exists or not hashes:
+        return set()
+
+    rows = connection.execute(
+        f"""
+        SELECT text_hash
+        FROM {EMBEDDING_CACHE_TABLE_NAME}
+        WHERE model = ? AND dimensions = ? AND text_hash IN (SELECT unnest(?::VARCHAR[]))
+        """,
+        [model, dimensions, hashes],
+    ).fetchall()
+
+    return {text_hash for (text_hash,) in rows}
+
+
+def _embedding_model(embeddings: Embeddings) -> tuple[str, int]:
+    # NOTE: .model and .dimensions are not part of the Embeddings contract (see OpenAIEmbeddings)
+    # so fall back to the class name and 0 (the default dimensions of the model) when they are not available
+    model = getattr(embeddings, "model", None) or type(embeddings).__name__
+    dimensions = getattr(embeddings, "dimensions", None) or 0
+
+    return model, dimensions
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embeddings service with a persistent cache of query embeddings stored in a SQLite file.
+
+    Queries are keyed by the embedding model and the normalized query text (case and whitespace insensitive), entries
+    expire after ttl_seconds and the cache is capped at max_size entries with the least recently used evicted first.
+    The cache is best effort, if it cannot be read or written the query is embedded as normal.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: str, ttl_seconds: Optional[int] = None, max_size: Optional[int] = None):
+        self._embeddings = embeddings
+        self._path = path
+        self._ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.environ.get("BOOKWORM_QUERY_CACHE_TTL", QUERY_CACHE_DEFAULT_TTL))
+        self._max_size = max_size if max_size is not None else int(os.environ.get("BOOKWORM_QUERY_CACHE_SIZE", QUERY_CACHE_DEFAULT_SIZE))
+        self._model, self._dimensions = _embedding_model(embeddings)
+        self._connection: Optional[sqlite3.Connection] = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = normalize_query(text)
+
+        embedding = self._lookup(key)
+        if embedding is not None:
+            self.hits += 1
+            logger.debug(f"query embedding cache hit ({self.hits} hits, {self.misses} misses)")
+            return embedding
+
+        self.misses += 1
+        logger.debug(f"query embedding cache miss ({self.hits} hits, {self.misses} misses)")
+
+        embedding = self._embeddings.embed_query(text)
+        self._store(key, embedding)
+
+        return embedding
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds many queries at once, the ones which are not cached are sent to the embeddings service in a single batch.
+        """
+        keys = [normalize_query(text) for text in texts]
+
+        embeddings: dict[str, list[float]] = {}
+        missing: dict[str, str] = {}
+
+        for key, text in zip(keys, texts):
+            if key in embeddings or key in missing:
+                continue
+
+            embedding = self._lookup(key)
+            if embedding is None:
+                missing[key] = text
+            else:
+                embeddings[key] = embedding
+
+        self.hits += len(embeddings)
+        self.misses += len(missing)
+        logger.debug(f"query embedding cache: {len(embeddings)} hits, {len(missing)} misses")
+
+        if missing:
+            # queries are embedded the same way as documents, embed_query only embeds a batch of one
+            for key, embedding in zip(missing, self._embeddings.embed_documents(list(missing.values()))):
+                self._store(key, embedding)
+                embeddings[key] = embedding
+
+        return [embeddings[key] for key in keys]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # the chain of 'bookworm ask' embeds the query on a worker thread, which is not the same thread for every query
+            # of a long running process (bookworm serve), queries never run concurrently so the connection can be shared
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {QUERY_CACHE_TABLE_NAME} (
+                    model TEXT,
+                    dimensions INTEGER,
+                    query TEXT,
+                    embedding BLOB,
+                    created_at REAL,
+                    last_used REAL,
+                    PRIMARY KEY (model, dimensions, query)
+                )
+                """
+            )
+
+        return self._connection
+
+    def _lookup(self, query: str) -> Optional[list[float]]:
+        try:
+            conn = self._connect()
+
+            with conn:
+                conn.execute(f"DELETE FROM {QUERY_CACHE_TABLE_NAME} WHERE created_at < ?", (time.time() - self._ttl_seconds,))
+
+                row = conn.execute(
+                    f"SELECT embedding FROM {QUERY_CACHE_TABLE_NAME} WHERE model = ? AND dimensions = ? AND query = ?",
+                    (self._model, self._dimensions, query),
+                ).fetchone()
+
+                if row is None:
+                    return None
+
+                conn.execute(
+                    f"UPDATE {QUERY_CACHE_TABLE_NAME} SET last_used = ? WHERE model = ? AND dimensions = ? AND query = ?",
+                    (time.time(), self._model, self._dimensions, query),
+                )
+
+        except sqlite3.Error as e:
+            logger.debug(f"query embedding cache could not be read: {e}")
+            return None
+
+        return array("f", row[0]).tolist()
+
+    def _store(self, query: str, embedding: list[float]):
+        now = time.time()
+
+        try:
+            conn = self._connect()
+
+            with conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {QUERY_CACHE_TABLE_NAME} VALUES (?, ?, ?, ?, ?, ?)",
+                    (self._model, self._dimensions, query, array("f", embedding).tobytes(), now, now),
+                )
+                conn.execute(
+                    f"""
+                    DELETE FROM {QUERY_CACHE_TABLE_NAME}
+                    WHERE rowid NOT IN (SELECT rowid FROM {QUERY_CACHE_TABLE_NAME} ORDER BY last_used DESC LIMIT ?)
+                    """,
+                    (self._max_size,),
+                )
+
+        except sqlite3.Error as e:
+            logger.debug(f"query embedding cache could not be written: {e}")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+class TokenCountCache:
+    """
+    A persistent cache of the number of tokens of each text stored in a SQLite file, so that estimating the cost of a sync
+    only encodes the texts which were not estimated before.
+
+    Counts are keyed by the encoding and a hash of the text and the cache is capped at max_size entries with the oldest
+    evicted first. The cache is best effort, if it cannot be read or written the texts are encoded as normal.
+    """
+
+    def __init__(self, path: str, max_size: int = TOKEN_CACHE_DEFAULT_SIZE):
+        self._path = path
+        self._max_size = max_size
+
+    def lookup(self, encoding: str, hashes: list[str]) -> dict[str, int]:
+        try:
+            with self._connect() as conn:
+                conn.execute("CREATE TEMP TABLE lookup (text_hash TEXT PRIMARY KEY)")
+                conn.executemany("INSERT OR IGNORE INTO lookup VALUES (?)", ((text_hash,) for text_hash in hashes))
+
+                rows = conn.execute(
+                    f"SELECT text_hash, tokens FROM {TOKEN_CACHE_TABLE_NAME} JOIN lookup USING (text_hash) WHERE encoding = ?", (encoding,)
+                ).fetchall()
+
+        except sqlite3.Error as e:
+            logger.debug(f"token cache could not be read: {e}")
+            return {}
+
+        logger.debug(f"token cache: {len(rows)} hits ({encoding})")
+        return dict(rows)
+
+    def store(self, encoding: str, counts: dict[str, int]):
+        now = time.time()
+
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {TOKEN_CACHE_TABLE_NAME} VALUES (?, ?, ?, ?)",
+                    ((encoding, text_hash, tokens, now) for text_hash, tokens in counts.items()),
+                )
+                conn.execute(
+                    f"""
+                    DELETE FROM {TOKEN_CACHE_TABLE_NAME}
+                    WHERE rowid NOT IN (SELECT rowid FROM {TOKEN_CACHE_TABLE_NAME} ORDER BY created_at DESC LIMIT ?)
+                    """,
+                    (self._max_size,),
+                )
+
+        except sqlite3.Error as e:
+            logger.debug(f"token cache could not be written: {e}")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self._path)
+
+        try:
+            with conn:
+                conn.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {TOKEN_CACHE_TABLE_NAME} (
+                        encoding TEXT,
+                        text_hash TEXT,
+                        tokens INTEGER,
+                        created_at REAL,
+                        PRIMARY KEY (encoding, text_hash)
+                    )
+                    """
+                )
+
+                yield conn
+        finally:
+            conn.close()
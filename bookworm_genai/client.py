@@ -0,0 +1,105 @@
+"""
+Talks to a running 'bookworm serve' daemon, see commands/serve.py.
+
+Only the standard library is imported here so that 'bookworm ask' can check for the daemon before it pays for importing
+langchain and DuckDB itself.
+"""
+
+import os
+import json
+import logging
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from bookworm_genai.paths import _get_server_file
+
+logger = logging.getLogger(__name__)
+
+# asking goes through the LLM so it can take a while, pausing waits for any query the daemon is answering
+ASK_TIMEOUT_SECONDS = 120
+PAUSE_TIMEOUT_SECONDS = 30
+CONTROL_TIMEOUT_SECONDS = 2
+
+
+def ask(query: str, top_n: int = 3, exact: bool = False, use_llm: bool = True, keyword_only: bool = False) -> Optional[list[dict]]:
+    """
+    Asks the running daemon for the bookmarks of the query, None when no daemon is running (or it can not be reached).
+    """
+    address = server_address()
+    if address is None:
+        return None
+
+    body = {"query": query, "top_n": top_n, "exact": exact, "use_llm": use_llm, "keyword_only": keyword_only}
+
+    try:
+        return _request(address, "/ask", body, timeout=ASK_TIMEOUT_SECONDS)["bookmarks"]
+    except urllib.error.HTTPError as e:
+        # errors of the search itself (e.g no keyword index) are raised the same as if it ran locally
+        raise ValueError(_error_message(e)) from None
+    except (OSError, ValueError, KeyError) as e:
+        logger.debug(f"bookworm serve at {address} could not be reached, searching locally: {e}")
+        return None
+
+
+@contextmanager
+def paused_server() -> Iterator[None]:
+    """
+    Has a running daemon close the bookmark database for the duration, DuckDB only lets a single process write to it.
+
+    The daemon opens the database again (and so loads whatever was committed meanwhile) once the block exits, or once this
+    process is gone if it never gets the chance to tell it.
+    """
+    address = server_address()
+    body = {"pid": os.getpid()}
+
+    paused = address is not None and _control(address, "/pause", body, timeout=PAUSE_TIMEOUT_SECONDS)
+    try:
+        yield
+    finally:
+        if paused:
+            _control(address, "/resume", body, timeout=CONTROL_TIMEOUT_SECONDS)
+
+
+def server_address() -> Optional[str]:
+    try:
+        with open(_get_server_file()) as f:
+            state = json.load(f)
+
+        return _url(state["host"], state["port"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _url(host: str, port: int) -> str:
+    # IPv6 addresses (e.g ::1) are bracketed so that their colons are not read as the port
+    if ":" in host:
+        return f"http://[{host}]:{port}"
+
+    return f"http://{host}:{port}"
+
+
+def _control(address: str, path: str, body: dict, timeout: float) -> bool:
+    try:
+        _request(address, path, body, timeout=timeout)
+    except (OSError, ValueError) as e:
+        logger.debug(f"bookworm serve at {address} did not answer {path}: {e}")
+        return False
+
+    logger.debug(f"bookworm serve at {address} answered {path}")
+    return True
+
+
+def _request(address: str, path: str, body: dict, timeout: float) -> dict:
+    request = urllib.request.Request(f"{address}{path}", data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}, method="POST")
+
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def _error_message(error: urllib.error.HTTPError) -> str:
+    try:
+        return json.loads(error.read())["error"]
+    except (ValueError, KeyError, TypeError):
+        return f"bookworm serve failed with status {error.code}"
@@ -1,51 +1,261 @@
 import os
+import json
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, Union
+from uuid import UUID
 
 import duckdb
-from langchain_community.vectorstores import DuckDB as DuckDBVectorStore
 from langchain_openai import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.outputs import LLMResult
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.language_models.chat_models import BaseChatModel
 
-from bookworm_genai.models import Bookmarks
-from bookworm_genai.storage import _get_local_store, _get_embedding_store
+from bookworm_genai import profiling
+from bookworm_genai.client import paused_server
+from bookworm_genai.context import format_context, get_context_tokens
+from bookworm_genai.metadata import Metadata
+from bookworm_genai.models import Bookmark, Bookmarks, BookmarkSelection
+from bookworm_genai.schema import exists, is_current
+from bookworm_genai.search import (
+    KEYWORD_ALIAS,
+    RRF_ALIAS,
+    SIMILARITY_ALIAS,
+    batch_similarity_search,
+    has_fts_index,
+    has_index,
+    keyword_search,
+    load_fts,
+    load_vss,
+    quantized_search,
+    reciprocal_rank_fusion,
+    set_ef_search,
+    similarity_search,
+    stored_candidate_dimensions,
+)
+from bookworm_genai.storage import _get_local_store, _get_query_embedding_store, _is_quantized
 
 logger = logging.getLogger(__name__)
 
+# the number of documents each search returns to be fused, more than are asked for so that documents which only one
+# of the searches ranks highly can still make it into the results
+HYBRID_SEARCH_CANDIDATES = 20
+
+# the number of queries of a batch which are sent through the LLM at once, see BookmarkChain.ask_batch
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# the search which gave each score, in the order they are looked for: cosine similarity, BM25 or reciprocal rank fusion
+SCORE_TYPES = {RRF_ALIAS: "fused", SIMILARITY_ALIAS: "similarity", KEYWORD_ALIAS: "keyword"}
+
 
 _system_message = """
 You have knowledge about all the browser bookmarks stored by an individual.
-When a user asks a question, you should be able to search the bookmarks and return the most relevant bookmark title and URL.
+When a user asks a question, you should be able to search the bookmarks and return the indices of the most relevant bookmarks.
 It could be multiple bookmarks.
 If you don't have anything in the context then return empty list
 
+Each line of the context is a bookmark: its index in square brackets, then its title, URL and domain separated by |
 The bookmarks available are from the context:
 {context}
 """
 
 
 class BookmarkChain:
-    def __init__(self, vector_store_search_n: int = 3):
+    def __init__(
+        self,
+        vector_store_search_n: int = 3,
+        exact_search: bool = False,
+        use_llm: bool = True,
+        keyword_only: bool = False,
+        context_tokens: Optional[int] = None,
+    ):
         full_database_path = _get_local_store()
         logger.debug("Connecting to vector database at: %s", full_database_path)
-        self._duckdb_connection = duckdb.connect(full_database_path, read_only=False)
-        self.vector_store = DuckDBVectorStore(connection=self._duckdb_connection, embedding=_get_embedding_store())
+        with profiling.span("open database"):
+            self._duckdb_connection = duckdb.connect(full_database_path, read_only=False)
+        self._search_n = vector_store_search_n
+
+        if not exists(self._duckdb_connection):
+            self._duckdb_connection.close()
+            raise ValueError("No bookmarks have been stored yet. Please run 'bookworm sync' before asking questions")
+
+        if not is_current(self._duckdb_connection):
+            self._duckdb_connection.close()
+            raise ValueError("The bookmark database was created by an older version. Please run 'bookworm sync' to upgrade it before asking questions")
+
+        # the keyword index is built by 'bookworm sync', when it exists the query is also matched against the words
+        # of each bookmark's title and url and the results of both searches are fused
+        self._use_keywords = has_fts_index(self._duckdb_connection) and load_fts(self._duckdb_connection)
+        self._keyword_only = keyword_only
+
+        if keyword_only and not self._use_keywords:
+            self._duckdb_connection.close()
+            raise ValueError("The keyword index is not available. Please ensure you run 'bookworm sync' (which builds it) before asking questions")
+
+        # keyword only searches do not need the query to be embedded
+        self._embeddings = None if keyword_only else _get_query_embedding_store(self._duckdb_connection)
 
-        llm = _get_llm()
-        llm = llm.with_structured_output(Bookmarks)
+        # the vector index is built by 'bookworm sync', without it (or when asked to) every bookmark is compared to the query
+        self._use_index = not exact_search and has_index(self._duckdb_connection) and load_vss(self._duckdb_connection)
+        if self._use_index:
+            set_ef_search(self._duckdb_connection)
 
-        prompt = ChatPromptTemplate.from_messages([("system", _system_message), ("human", "{query}")])
+        # embeddings stored as int8 are searched by their candidates and then rescored, see quantization.py
+        self._quantized = not keyword_only and _is_quantized(self._duckdb_connection)
+        self._candidate_dimensions = stored_candidate_dimensions(self._duckdb_connection) if self._quantized else None
+        logger.debug(
+            "Using %s search%s%s",
+            "indexed" if self._use_index else "exact",
+            " with keywords" if self._use_keywords else "",
+            " over quantized embeddings" if self._quantized else "",
+        )
+
+        # the retrieved bookmarks are sent to the LLM as one compact line each, as many as fit into the budget, see context.py
+        self._context_tokens = context_tokens if context_tokens is not None else get_context_tokens()
 
-        search_kwargs = {"k": vector_store_search_n}
+        self.chain = None
+        if use_llm:
+            llm = _get_llm()
+            llm = llm.with_structured_output(BookmarkSelection)
 
-        self.chain = {"context": self.vector_store.as_retriever(search_kwargs=search_kwargs), "query": RunnablePassthrough()} | prompt | llm
+            prompt = ChatPromptTemplate.from_messages([("system", _system_message), ("human", "{query}")])
+            self._select = prompt | llm
+
+            # answering is also run on its own when the documents of many queries were retrieved at once
+            self._answer = RunnableLambda(self._answer_query)
+            self.chain = {"context": RunnableLambda(self.retrieve), "query": RunnablePassthrough()} | self._answer
 
     def ask(self, query: str) -> Bookmarks:
         logger.debug("Searching for bookmarks with query: %s", query)
 
+        if self.chain is None:
+            raise ValueError("BookmarkChain was created without an LLM, use search() instead")
+
+        if profiling.is_enabled():
+            return self.chain.invoke(query, config={"callbacks": [_LLMSpanCallback()]})
+
         return self.chain.invoke(query)
 
+    def _answer_query(self, inputs: dict) -> Bookmarks:
+        """
+        Has the LLM select the bookmarks (by their index in the context) which answer the query, the selected documents are
+        returned so that the LLM never needs to write out (or can get wrong) a title or URL.
+        """
+        docs: list[Document] = inputs["context"]
+        context, count = format_context(docs, self._context_tokens)
+
+        selection: BookmarkSelection = self._select.invoke({"context": context, "query": inputs["query"]})
+
+        # indices the LLM made up (outside of the context) are dropped along with repeated ones
+        indices = list(dict.fromkeys(index for index in selection.indices if 0 <= index < count))
+        if len(indices) != len(selection.indices):
+            logger.debug(f"dropped invalid indices from the selection {selection.indices}")
+
+        return Bookmarks(bookmarks=[_document_to_bookmark(docs[index]) for index in indices])
+
+    def search(self, query: str) -> Bookmarks:
+        """
+        Returns the bookmarks most similar to the query straight from the vector store, without sending them through the LLM.
+        """
+        logger.debug("Searching for bookmarks (without LLM) with query: %s", query)
+
+        return Bookmarks(bookmarks=[_document_to_bookmark(doc) for doc in self.retrieve(query)])
+
+    def ask_batch(self, queries: list[str], max_concurrency: int = DEFAULT_BATCH_CONCURRENCY) -> list[Union[Bookmarks, Exception]]:
+        """
+        Answers every query, the documents of all the queries are retrieved at once (see retrieve_batch) and then sent through
+        the LLM at most max_concurrency queries at a time. A query which the LLM failed to answer has its error in its place.
+        """
+        logger.debug("Searching for bookmarks with %d queries", len(queries))
+
+        if self.chain is None:
+            raise ValueError("BookmarkChain was created without an LLM, use search_batch() instead")
+
+        inputs = [{"context": docs, "query": query} for query, docs in zip(queries, self.retrieve_batch(queries))]
+
+        config = {"max_concurrency": max_concurrency}
+        if profiling.is_enabled():
+            config["callbacks"] = [_LLMSpanCallback()]
+
+        return self._answer.batch(inputs, config=config, return_exceptions=True)
+
+    def search_batch(self, queries: list[str]) -> list[Bookmarks]:
+        """
+        Returns the bookmarks most similar to each query without sending them through the LLM, see retrieve_batch.
+        """
+        return [Bookmarks(bookmarks=[_document_to_bookmark(doc) for doc in docs]) for docs in self.retrieve_batch(queries)]
+
+    def retrieve_batch(self, queries: list[str]) -> list[list[Document]]:
+        """
+        Retrieves the documents of every query, see retrieve. The queries are embedded in a single request and compared
+        against the stored embeddings in a single (exact) search.
+        """
+        if self._keyword_only:
+            with profiling.span("keyword search"):
+                return [keyword_search(self._duckdb_connection, query, k=self._search_n) for query in queries]
+
+        k = max(self._search_n, HYBRID_SEARCH_CANDIDATES) if self._use_keywords else self._search_n
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # as in retrieve, the keyword searches run while the queries are embedded
+            keyword_docs = executor.submit(lambda: [self._keyword_search(query, k) for query in queries]) if self._use_keywords else None
+
+            with profiling.span("embed queries"):
+                embeddings = self._embeddings.embed_queries(queries)
+
+            with profiling.span("vector search"):
+                similar_docs = batch_similarity_search(self._duckdb_connection, embeddings, k=k, quantized=self._quantized)
+
+            if keyword_docs is None:
+                return similar_docs
+
+            keyword_docs = keyword_docs.result()
+
+        with profiling.span("fuse"):
+            return [reciprocal_rank_fusion([similar, keyword], k=self._search_n) for similar, keyword in zip(similar_docs, keyword_docs)]
+
+    def retrieve(self, query: str) -> list[Document]:
+        if self._keyword_only:
+            with profiling.span("keyword search"):
+                return keyword_search(self._duckdb_connection, query, k=self._search_n)
+
+        if not self._use_keywords:
+            embedding = self._embed_query(query)
+            return self._similarity_search(embedding, self._search_n)
+
+        candidates = max(self._search_n, HYBRID_SEARCH_CANDIDATES)
+
+        # the keyword search runs while the query is embedded (which usually means a round trip to the embeddings service)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            keyword_docs = executor.submit(self._keyword_search, query, candidates)
+
+            embedding = self._embed_query(query)
+            similar_docs = self._similarity_search(embedding, candidates)
+            keyword_docs = keyword_docs.result()
+
+            with profiling.span("fuse"):
+                return reciprocal_rank_fusion([similar_docs, keyword_docs], k=self._search_n)
+
+    def _embed_query(self, query: str) -> list[float]:
+        with profiling.span("embed query"):
+            return self._embeddings.embed_query(query)
+
+    def _similarity_search(self, embedding: list[float], k: int) -> list[Document]:
+        with profiling.span("vector search"):
+            if self._quantized:
+                return quantized_search(self._duckdb_connection, embedding, k=k, use_index=self._use_index, candidate_dimensions=self._candidate_dimensions)
+
+            return similarity_search(self._duckdb_connection, embedding, k=k, use_index=self._use_index)
+
+    def _keyword_search(self, query: str, k: int) -> list[Document]:
+        # a DuckDB connection must not be used by two threads at once, a cursor is a separate connection to the same database
+        with profiling.span("keyword search"), self._duckdb_connection.cursor() as cursor:
+            return keyword_search(cursor, query, k=k)
+
     def is_valid(self) -> bool:
         res = self._duckdb_connection.execute("SELECT COUNT(*) FROM embeddings").fetchall()
 
@@ -72,6 +282,85 @@ class BookmarkChain:
 
         self._duckdb_connection.close()
 
+        if self._embeddings is not None:
+            self._embeddings.close()
+
+
+def answer_queries(
+    queries: list[str],
+    output: str,
+    top_n: int = 3,
+    use_llm: bool = True,
+    keyword_only: bool = False,
+    max_concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+) -> int:
+    """
+    Answers every query into the output file, one JSON object per line holding the query and its bookmarks (or the error
+    it failed with) in the order of the queries. Returns the number of queries answered.
+    """
+    # a running 'bookworm serve' holds the database open, which keeps this process from opening it
+    with paused_server(), BookmarkChain(vector_store_search_n=top_n, use_llm=use_llm, keyword_only=keyword_only) as chain:
+        if not chain.is_valid():
+            return 0
+
+        results = chain.ask_batch(queries, max_concurrency=max_concurrency) if use_llm else chain.search_batch(queries)
+
+    answered = 0
+    with open(output, "w") as f:
+        for query, result in zip(queries, results):
+            if isinstance(result, Exception):
+                logger.warning(f"failed to answer '{query}': {result}")
+                line = {"query": query, "error": str(result)}
+            else:
+                answered += 1
+                line = {"query": query, "bookmarks": [bookmark.dict() for bookmark in result.bookmarks]}
+
+            f.write(json.dumps(line) + "\n")
+
+    return answered
+
+
+class _LLMSpanCallback(BaseCallbackHandler):
+    """
+    Records the calls to the LLM (and the tokens they used) as spans of 'bookworm --profile'.
+    """
+
+    def __init__(self):
+        self._starts: dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized: dict[str, Any], messages: list, *, run_id: UUID, **kwargs: Any):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        start = self._starts.pop(run_id, None)
+        if start is None:
+            return
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        profiling.record("llm", start, time.perf_counter(), tokens=usage.get("total_tokens") or 0)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._starts.pop(run_id, None)
+
+
+def _document_to_bookmark(doc: Document) -> Bookmark:
+    return Bookmark(
+        title=doc.metadata.get(Metadata.Title.value) or "",
+        url=doc.metadata.get(Metadata.URL.value) or "",
+        source=doc.metadata.get("source") or "",
+        browser=doc.metadata.get(Metadata.Browser.value) or "",
+        **_score(doc),
+    )
+
+
+def _score(doc: Document) -> dict:
+    # the score of the search which ranked the document, a fused (hybrid) result also keeps the scores of both searches
+    for alias, score_type in SCORE_TYPES.items():
+        if f"_{alias}" in doc.metadata:
+            return {"score": doc.metadata[f"_{alias}"], "score_type": score_type}
+
+    return {}
+
 
 def _get_llm() -> BaseChatModel:
     kwargs = {
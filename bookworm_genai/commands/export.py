@@ -1,29 +1,54 @@
-import json
 import logging
 
-import pandas as pd
 import duckdb
 
-from bookworm_genai.storage import _get_local_store
+from bookworm_genai import profiling, schema
+from bookworm_genai.client import paused_server
+from bookworm_genai.paths import _get_local_store
 
 logger = logging.getLogger(__name__)
 
+# the options of DuckDB's COPY statement for each format, https://duckdb.org/docs/sql/statements/copy.html
+EXPORT_FORMATS = {
+    "csv": "FORMAT csv, HEADER",
+    "parquet": "FORMAT parquet, COMPRESSION zstd",
+    # newline delimited JSON, one bookmark per line
+    "jsonl": "FORMAT json",
+}
+
+EXPORT_COLUMNS = ["title AS name", "url", "browser", "source"]
+
+
+def export(output: str, format: str = "csv", include_embeddings: bool = False) -> int:
+    """
+    Exports every bookmark into the output file and returns the number of bookmarks exported.
+
+    DuckDB streams the typed columns of the bookmark table straight into the file, so nothing is loaded into Python and
+    memory use does not grow with the number of bookmarks. The embeddings make up most of the table and are only
+    exported when asked for.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{format}', expected one of {list(EXPORT_FORMATS)}")
 
-def export() -> pd.DataFrame:
     store = _get_local_store()
+    columns = EXPORT_COLUMNS + (["embedding"] if include_embeddings else [])
 
     logger.debug(f"reading from vector store {store}")
-    with duckdb.connect(store, read_only=True) as duck:
-        df = duck.execute("select * from embeddings").df()
+    # a running 'bookworm serve' holds the database open, which keeps any other process from opening it
+    with paused_server(), duckdb.connect(store, read_only=True) as duck:
+        if not schema.exists(duck):
+            raise ValueError("No bookmarks have been stored yet. Please run 'bookworm sync' before exporting")
+
+        if not schema.is_current(duck):
+            raise ValueError("The bookmark database was created by an older version. Please run 'bookworm sync' to upgrade it before exporting")
+
+        logger.debug(f"copying bookmarks into '{output}' as {format}")
+        with profiling.span("export"):
+            (count,) = duck.execute(f"COPY (SELECT {', '.join(columns)} FROM {schema.TABLE_NAME}) TO '{_quote(output)}' ({EXPORT_FORMATS[format]})").fetchone()
 
-    logger.debug("extracting useful information from structured columns")
-    browser_col = df["metadata"].apply(json.loads).apply(lambda x: x["browser"]).rename(index="browser")
-    source_col = df["metadata"].apply(json.loads).apply(lambda x: x["source"]).rename(index="source")
-    name_col = df["text"].apply(json.loads).apply(lambda x: x["name"]).rename(index="name")
-    url_col = df["text"].apply(json.loads).apply(lambda x: x["url"]).rename(index="url")
+    return count
 
-    logger.debug("dropping unnecessary columns")
-    cleaned_df = df.drop(columns=["id", "metadata", "text", "embedding"])
 
-    bookmark_summary_df = pd.concat([cleaned_df, name_col, url_col, browser_col, source_col], axis=1)
-    return bookmark_summary_df
+def _quote(path: str) -> str:
+    # COPY does not accept the path as a parameter
+    return path.replace("'", "''")
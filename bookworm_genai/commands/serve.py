@@ -0,0 +1,255 @@
+import os
+import json
+import socket
+import logging
+import ipaddress
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Optional
+
+from bookworm_genai import __version__
+from bookworm_genai.client import _url
+from bookworm_genai.commands.ask import BookmarkChain
+from bookworm_genai.paths import _get_server_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+
+# the configuration of the chain opened when the daemon starts, the one used by a plain 'bookworm ask'
+DEFAULT_CHAIN = (3, False, True, False)
+
+# the chains kept open at once, the least recently asked is closed to make room for another configuration
+MAX_CHAINS = 4
+
+
+class BookmarkService:
+    """
+    Keeps a BookmarkChain (its DuckDB connection and loaded indexes, its embeddings and LLM clients) open for the
+    configurations it was last asked with, so that queries after the first do not pay to set them up again.
+    """
+
+    def __init__(self):
+        self._chains: OrderedDict[tuple[int, bool, bool, bool], BookmarkChain] = OrderedDict()
+        self._paused_by: Optional[int] = None
+
+    def ask(self, query: str, top_n: int = 3, exact: bool = False, use_llm: bool = True, keyword_only: bool = False) -> list[dict]:
+        if isinstance(top_n, bool) or not isinstance(top_n, int) or top_n < 1:
+            raise ValueError(f"top_n must be a positive number of bookmarks, got {top_n!r}")
+
+        chain = self._chain((top_n, exact, use_llm, keyword_only))
+
+        if not chain.is_valid():
+            return []
+
+        bookmarks = chain.ask(query) if use_llm else chain.search(query)
+        return [bookmark.dict() for bookmark in bookmarks.bookmarks]
+
+    def warm(self):
+        """
+        Opens the chain of a plain 'bookworm ask' ahead of its first query, when it can be opened.
+        """
+        try:
+            self._chain(DEFAULT_CHAIN)
+        except Exception as e:
+            logger.debug(f"could not open the bookmark database ahead of the first query: {e}")
+
+    def pause(self, pid: int):
+        """
+        Closes the bookmark database until resumed, while the process with the given pid uses it.
+        """
+        logger.info(f"🔄 closing the bookmark database while process {pid} uses it")
+
+        self._paused_by = pid
+        self.close()
+
+    def resume(self):
+        self._paused_by = None
+
+    def is_paused(self) -> bool:
+        if self._paused_by is not None and not _is_running(self._paused_by):
+            logger.warning(f"process {self._paused_by} exited without resuming, opening the bookmark database again")
+            self.resume()
+
+        return self._paused_by is not None
+
+    def close(self):
+        for chain in self._chains.values():
+            chain.__exit__(None, None, None)
+
+        self._chains.clear()
+
+    def _chain(self, config: tuple[int, bool, bool, bool]) -> BookmarkChain:
+        if config in self._chains:
+            self._chains.move_to_end(config)
+            return self._chains[config]
+
+        if len(self._chains) >= MAX_CHAINS:
+            _, chain = self._chains.popitem(last=False)
+            chain.__exit__(None, None, None)
+
+        top_n, exact, use_llm, keyword_only = config
+        self._chains[config] = BookmarkChain(vector_store_search_n=top_n, exact_search=exact, use_llm=use_llm, keyword_only=keyword_only)
+
+        return self._chains[config]
+
+
+class BookmarkServer(HTTPServer):
+    """
+    Answers one request at a time, a DuckDB connection must not be used by two threads at once.
+    """
+
+    def __init__(self, address: tuple[str, int], service: BookmarkService):
+        # HTTPServer only listens on IPv4 addresses unless told otherwise
+        if ":" in address[0]:
+            self.address_family = socket.AF_INET6
+
+        super().__init__(address, _Handler)
+        self.service = service
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: BookmarkServer
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._respond(HTTPStatus.OK, {"status": "ok", "version": __version__, "paused": self.server.service.is_paused()})
+        else:
+            self._respond(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self._respond(HTTPStatus.BAD_REQUEST, {"error": "the request body is not valid JSON"})
+            return
+
+        if self.path == "/ask":
+            if service.is_paused():
+                self._respond(
+                    HTTPStatus.SERVICE_UNAVAILABLE, {"error": "The bookmark database is being synced, please try again once 'bookworm sync' finishes"}
+                )
+                return
+
+            try:
+                bookmarks = service.ask(
+                    body["query"],
+                    top_n=body.get("top_n", 3),
+                    exact=body.get("exact", False),
+                    use_llm=body.get("use_llm", True),
+                    keyword_only=body.get("keyword_only", False),
+                )
+            except KeyError:
+                self._respond(HTTPStatus.BAD_REQUEST, {"error": "the request has no query"})
+            except ValueError as e:
+                self._respond(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            except Exception as e:
+                logger.exception("failed to answer query")
+                self._respond(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            else:
+                self._respond(HTTPStatus.OK, {"bookmarks": bookmarks})
+
+        elif self.path == "/pause":
+            pid = body.get("pid")
+            if not isinstance(pid, int):
+                self._respond(HTTPStatus.BAD_REQUEST, {"error": "the request has no pid"})
+                return
+
+            service.pause(pid)
+            self._respond(HTTPStatus.OK, {"paused": True})
+
+        elif self.path == "/resume":
+            service.resume()
+            self._respond(HTTPStatus.OK, {"paused": False})
+
+            # the sync has committed, the next query finds its bookmarks without waiting for the database to open
+            logger.info("🔄 reloading the bookmark database")
+            service.warm()
+
+        else:
+            self._respond(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+
+    def _respond(self, status: HTTPStatus, body: dict):
+        payload = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.wfile.flush()
+
+    def log_message(self, format: str, *args):
+        logger.debug(format, *args)
+
+
+def serve(host: str = DEFAULT_HOST, port: int = 0):
+    """
+    Answers 'bookworm ask' queries until interrupted, the address it listens on is written where 'bookworm ask' finds it.
+
+    Only loopback addresses are accepted, the server has no authentication and anyone reaching it could read the bookmarks
+    or pause the database.
+    """
+    if not _is_loopback(host):
+        raise ValueError(f"'{host}' is not a loopback address, 'bookworm serve' only listens on this machine (e.g {DEFAULT_HOST} or ::1)")
+
+    service = BookmarkService()
+    service.warm()
+
+    with BookmarkServer((host, port), service) as server:
+        host, port = server.server_address[:2]
+        _write_server_file(host, port)
+
+        logger.info(f"✅ serving bookmark searches on {_url(host, port)}, 'bookworm ask' uses it while it is running")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("stopping")
+        finally:
+            service.close()
+            _remove_server_file(port)
+
+
+def _write_server_file(host: str, port: int):
+    with open(_get_server_file(), "w") as f:
+        json.dump({"host": host, "port": port, "pid": os.getpid()}, f)
+
+
+def _remove_server_file(port: int):
+    path = _get_server_file()
+
+    # another daemon may have been started since, its file is left alone
+    try:
+        with open(path) as f:
+            if json.load(f).get("port") != port:
+                return
+
+        os.remove(path)
+    except (OSError, ValueError):
+        pass
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        return True
+
+    return True
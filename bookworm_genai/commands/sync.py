@@ -2,22 +2,109 @@ import os
 import sys
 import glob
 import logging
+import queue
 import shutil
-from typing import Optional, Union
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
 
-import tiktoken
 from langchain_core.documents import Document
 
+from bookworm_genai import profiling
+from bookworm_genai.client import paused_server
 from bookworm_genai.integrations import Browser, browsers, BrowserManifest
-from bookworm_genai.storage import store_documents, _get_embedding_store
+from bookworm_genai.storage import DEFAULT_CHUNK_SIZE, EmbeddingBackend, SyncSession, _get_embedding_backend, _get_embedding_store, unsent_documents
+from bookworm_genai.tokens import count_tokens
 from bookworm_genai.metadata import attach_metadata
+from bookworm_genai.dedup import deduplicate
+from bookworm_genai.loaders import BookmarkDelta
+from bookworm_genai.manifest import SourceFingerprint, fingerprint
+from bookworm_genai.utils import chunked
 
 
 logger = logging.getLogger(__name__)
 
 
-def sync(browsers: BrowserManifest = browsers, estimate_cost: bool = False, browser_filter: list[str] = []) -> Union[None, float]:
-    docs: list[Document] = []
+# number of chunks a browser can load ahead of the browser currently being stored
+LOAD_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+def sync(browsers: BrowserManifest = browsers, estimate_cost: bool = False, browser_filter: list[str] = [], force: bool = False) -> Union[None, float]:
+    supported = _supported_browsers(browsers, browser_filter)
+
+    if estimate_cost:
+        with _load_browsers([(browser, platform_config, None, None) for browser, platform_config in supported], DEFAULT_CHUNK_SIZE) as loads:
+            docs = list(deduplicate(doc for load in loads for doc in load))
+
+        return _estimate_cost(docs, browsers=[browser.value for browser, _ in supported])
+
+    if not supported:
+        logger.debug("no browsers loaded, nothing to sync")
+        return
+
+    # a running 'bookworm serve' closes the database while it is synced and opens it again (with the synced bookmarks) after
+    with paused_server(), SyncSession() as session:
+        pending: list[tuple[Browser, dict, Optional[SourceFingerprint], Optional[int]]] = []
+
+        for browser, platform_config in supported:
+            source = _fingerprint_source(platform_config)
+
+            if not force and source is not None and session.is_unchanged(browser.value, source):
+                logger.info(f"⏩ browser {browser.value} skipped as its bookmarks have not changed since the last sync")
+                continue
+
+            # browsers which support it only load the bookmarks which changed since the watermark of their last sync
+            since = None
+            if not force and source is not None and _supports_delta(platform_config):
+                since = session.watermark(browser.value)
+
+            pending.append((browser, platform_config, source, since))
+
+        if not pending:
+            session.build_indexes()
+
+            logger.info("✅ bookmarks are up to date")
+            return
+
+        # stored bookmarks of the browsers which are not fully loaded are kept as they are
+        session.scope([browser.value for browser, _, _, since in pending if since is None])
+
+        with _load_browsers(pending, DEFAULT_CHUNK_SIZE) as loads:
+            synced_browsers: list[str] = []
+            synced_sources: dict[str, SourceFingerprint] = {}
+            deltas: dict[str, BookmarkDelta] = {}
+
+            # bookmarks are streamed from each browser into the store one chunk at a time so memory stays bounded by the chunk size
+            # browsers are stored in the order of the manifest while the ones after it keep loading in the background
+            for load in loads:
+                for chunk in chunked(load, DEFAULT_CHUNK_SIZE):
+                    session.add(chunk)
+
+                # browsers which failed to load are left out so that their stored bookmarks are not removed
+                if load.error is not None:
+                    continue
+
+                if load.since is None:
+                    synced_browsers.append(load.browser.value)
+
+                if load.source is not None:
+                    synced_sources[load.browser.value] = load.source
+
+                if load.delta is not None:
+                    deltas[load.browser.value] = load.delta
+
+            # browsers which loaded successfully are passed through even without any docs
+            # so that bookmarks removed from that browser are also removed from the store
+            with profiling.span("finish"):
+                session.finish(browsers=synced_browsers, sources=synced_sources, deltas=deltas)
+
+
+def _supported_browsers(browsers: BrowserManifest, browser_filter: list[str]) -> list[tuple[Browser, dict]]:
+    supported: list[tuple[Browser, dict]] = []
 
     for browser, config in browsers.items():
         browser: Browser = browser
@@ -31,38 +118,144 @@ def sync(browsers: BrowserManifest = browsers, estimate_cost: bool = False, brow
         except KeyError:
             logger.warning(f"🔄 browser {browser.value} is not supported on {sys.platform} yet")
             continue
+
+        supported.append((browser, platform_config))
+
+    return supported
+
+
+def _fingerprint_source(platform_config: dict) -> Optional[SourceFingerprint]:
+    # only browsers which read straight from a bookmark file can be fingerprinted
+    if "copy" in platform_config:
+        return None
+
+    file_path = platform_config["bookmark_loader_kwargs"].get("file_path")
+    if not isinstance(file_path, str):
+        return None
+
+    return fingerprint(file_path)
+
+
+def _supports_delta(platform_config: dict) -> bool:
+    return getattr(platform_config["bookmark_loader"], "supports_delta", False) is True
+
+
+@contextmanager
+def _load_browsers(browsers: list[tuple[Browser, dict, Optional[SourceFingerprint], Optional[int]]], chunk_size: int) -> Iterator[list["_BrowserLoad"]]:
+    """
+    Starts loading every given browser concurrently, one thread per browser.
+    """
+    loads = [_BrowserLoad(browser, platform_config, chunk_size, source, since) for browser, platform_config, source, since in browsers]
+
+    if not loads:
+        yield loads
+        return
+
+    with ThreadPoolExecutor(max_workers=len(loads), thread_name_prefix="bookworm-load") as executor:
+        for load in loads:
+            executor.submit(load.run)
+
+        try:
+            yield loads
+        finally:
+            # unblocks any loader still waiting on its queue, e.g if storing failed
+            for load in loads:
+                load.cancel()
+
+
+class _BrowserLoad:
+    """
+    Loads the bookmarks of a single browser on a worker thread.
+
+    Bookmarks are handed over in chunks through a bounded queue so a browser never holds all of its bookmarks in memory
+    while it waits for its turn to be stored. Errors are recorded rather than raised so that a missing, locked or slow
+    profile does not affect the other browsers.
+    """
+
+    def __init__(self, browser: Browser, platform_config: dict, chunk_size: int, source: Optional[SourceFingerprint] = None, since: Optional[int] = None):
+        self.browser = browser
+        self.source = source
+        self.since = since
+        self.delta: Optional[BookmarkDelta] = None
+        self.error: Optional[Exception] = None
+        self.count = 0
+        self.elapsed = 0.0
+
+        self._platform_config = platform_config
+        self._chunk_size = chunk_size
+        self._queue: queue.Queue = queue.Queue(maxsize=LOAD_QUEUE_SIZE)
+        self._cancelled = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+
+        try:
+            if self.source is not None and not _supports_delta(self._platform_config):
+                # the source is hashed before it is read so that the manifest never records changes which were not loaded
+                with profiling.span("hash source"):
+                    self.source.compute_hash()
+
+            for chunk in profiling.iterate(f"load {self.browser.value}", chunked(self._load(), self._chunk_size)):
+                self.count += len(chunk)
+
+                if not self._put(chunk):
+                    return
+
+        except BrowserBookmarkFileNotFound as e:
+            self.error = e
+            logger.warning(f"🔄 browser {self.browser.value} skipped due to missing file '{e.file}'")
+
+        except FileNotFoundError as e:
+            self.error = e
+            logger.warning(f"🔄 browser {self.browser.value} skipped due to missing file '{e.filename}'")
+
+        except Exception as e:
+            self.error = e
+            logger.warning(f"🔄 browser {self.browser.value} skipped as it failed to load: {e}")
+            logger.debug(f"browser {self.browser.value} failed to load", exc_info=True)
+
         else:
-            if "copy" in platform_config:
-                try:
-                    _copy(platform_config["copy"])
-                except BrowserBookmarkFileNotFound as e:
-                    logger.warning(f"🔄 browser {browser.value} skipped due to missing file '{e.file}'")
-                    continue
+            self.elapsed = time.perf_counter() - start
+            logger.info(f"✅ browser {self.browser.value} bookmarks loaded! ({self.count} in {self.elapsed:.2f}s)")
 
-            _log_bookmark_source(browser, platform_config)
+        finally:
+            self._put(_DONE)
 
-            config = platform_config["bookmark_loader_kwargs"]
-            if "db" in config:
-                if callable(config["db"]):
-                    config["db"] = config["db"](None)
+    def cancel(self):
+        self._cancelled.set()
 
-            loader = platform_config["bookmark_loader"](**config)
+    def __iter__(self) -> Iterator[Document]:
+        while (chunk := self._queue.get()) is not _DONE:
+            yield from chunk
 
-            current_docs: list[Document] = list(loader.lazy_load())
+    def _load(self) -> Iterator[Document]:
+        if "copy" in self._platform_config:
+            _copy(self._platform_config["copy"])
 
-            for index, doc in enumerate(current_docs):
-                logger.debug(doc.page_content)
-                current_docs[index] = attach_metadata(current_docs[index], browser)
+        _log_bookmark_source(self.browser, self._platform_config)
 
-            docs.extend(current_docs)
+        config = self._platform_config["bookmark_loader_kwargs"]
+        if self.since is not None:
+            config = {**config, "since": self.since}
 
-    logger.debug(f"{len(docs)} Bookmarks loaded")
+        loader = self._platform_config["bookmark_loader"](**config)
 
-    if estimate_cost:
-        return _estimate_cost(docs)
+        for doc in loader.lazy_load():
+            logger.debug(doc.page_content)
+            yield attach_metadata(doc, self.browser)
+
+        if _supports_delta(self._platform_config):
+            self.delta = loader.delta
 
-    if docs:
-        store_documents(docs)
+    def _put(self, item) -> bool:
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
 
 
 def _copy(config: dict):
@@ -79,33 +272,23 @@ def _copy(config: dict):
     directory = os.path.dirname(config["to"])
     os.makedirs(directory, exist_ok=True)
 
-    shutil.copy(source, config["to"])
+    with profiling.span("copy"):
+        shutil.copy(source, config["to"])
 
 
 def _log_bookmark_source(browser: Browser, platform_config: dict):
-    logger.info(f"✅ browser {browser.value} bookmarks loaded!")
-
-    path = ""
-
-    try:
-        path = platform_config["bookmark_loader_kwargs"]["file_path"]
-    except KeyError:
-        pass
+    logger.debug("Loading %s bookmarks from %s", browser.value, platform_config["bookmark_loader_kwargs"].get("file_path", ""))
 
-    try:
-        path = platform_config["bookmark_loader_kwargs"]["db"]
-        if callable(path):
-            path = path(path)
-
-        path = path._engine.url
-
-    except KeyError:
-        pass
-
-    logger.debug("Loading bookmarks from %s", path)
 
+def _estimate_cost(docs: list[Document], cost_per_million: Optional[float] = None, browsers: Optional[list[str]] = None) -> float:
+    """
+    Estimates the cost of embedding the documents which a sync of the given browsers would send to the embeddings service,
+    documents which are stored already or whose embedding is cached are free.
+    """
+    if _get_embedding_backend() == EmbeddingBackend.LOCAL:
+        logger.info("Estimated cost: $0 (bookmarks are embedded locally)")
+        return 0.0
 
-def _estimate_cost(docs: list[Document], cost_per_million: Optional[float] = None) -> float:
     embedding = _get_embedding_store()
 
     # NOTE: using _get_embedding_store here means that it's more likely that the model we are using
@@ -113,13 +296,18 @@ def _estimate_cost(docs: list[Document], cost_per_million: Optional[float] = Non
     # however note that .model here is not part of the contract for Embeddings
     # so this is a bit of a hack
     # if we add more embeddings options in the future, we need to re-evaluate this.
-    encoding = tiktoken.encoding_for_model(embedding.model)
-
     logger.info(f"Estimating cost for {embedding.model}")
 
-    tokens: int = 0
-    for doc in docs:
-        tokens += len(encoding.encode(doc.page_content))
+    if browsers is not None:
+        # a running 'bookworm serve' holds the database open, which keeps this process from reading it
+        with paused_server():
+            total = len(docs)
+            docs = unsent_documents(docs, browsers, embedding)
+
+        logger.info(f"{len(docs)} of {total} bookmarks would be embedded, the others are stored or cached already")
+
+    with profiling.span("count tokens"):
+        tokens = count_tokens([doc.page_content for doc in docs], embedding.model)
 
     if not cost_per_million:
         # https://openai.com/api/pricing/
@@ -0,0 +1,71 @@
+"""
+Formats the bookmarks retrieved for a query into the context of the LLM prompt, see commands/ask.py.
+
+Each bookmark is sent as a single line holding its index, title, URL and domain rather than its whole stored row (the
+browser's ids, dates, folders and the metadata of the sync), and the LLM answers with the indices of the relevant ones
+which are then mapped back to the stored bookmarks. Titles and URLs are cut short, the full ones are read from the stored
+bookmark, and bookmarks are added until the token budget is spent.
+"""
+
+import os
+import logging
+from urllib.parse import urlsplit
+
+from langchain_core.documents import Document
+
+from bookworm_genai.embeddings import CHARS_PER_TOKEN
+from bookworm_genai.metadata import Metadata
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_DEFAULT_TOKENS = 2_000
+
+MAX_TITLE_CHARS = 100
+MAX_URL_CHARS = 120
+
+
+def format_context(docs: list[Document], max_tokens: int) -> tuple[str, int]:
+    """
+    Returns the context of the documents which fit into max_tokens (in the order given) and the number of documents in it,
+    the first of the documents has index 0 and so on.
+    """
+    lines: list[str] = []
+    tokens = 0
+
+    for index, doc in enumerate(docs):
+        line = _format_line(index, doc)
+
+        # tokens are estimated from the length of the line, which is enough to keep the prompt within its budget
+        line_tokens = len(line) // CHARS_PER_TOKEN + 1
+        if tokens + line_tokens > max_tokens:
+            logger.debug(f"context budget of {max_tokens} tokens spent, leaving out {len(docs) - index} of {len(docs)} bookmarks")
+            break
+
+        lines.append(line)
+        tokens += line_tokens
+
+    return "\n".join(lines), len(lines)
+
+
+def get_context_tokens() -> int:
+    return int(os.environ.get("BOOKWORM_CONTEXT_TOKENS", CONTEXT_DEFAULT_TOKENS))
+
+
+def _format_line(index: int, doc: Document) -> str:
+    # the title and url columns of the bookmark are returned along with it by the searches, see search.py
+    title = doc.metadata.get(Metadata.Title.value) or ""
+    url = doc.metadata.get(Metadata.URL.value) or ""
+
+    return f"[{index}] {_shorten(title, MAX_TITLE_CHARS)} | {_shorten(url, MAX_URL_CHARS)} | {_domain(url)}"
+
+
+def _domain(url: str) -> str:
+    try:
+        return urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+
+
+def _shorten(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[: max_chars - 1] + "…"
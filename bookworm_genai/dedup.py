@@ -0,0 +1,120 @@
+import json
+import logging
+from typing import Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from langchain_core.documents import Document
+
+from bookworm_genai.metadata import Metadata
+
+logger = logging.getLogger(__name__)
+
+# query parameters which only track where a visit came from and never change the page being bookmarked
+TRACKING_PARAMETERS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "ref_src"}
+TRACKING_PARAMETER_PREFIXES = ("utm_",)
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL so that the same page bookmarked in different ways maps to the same key.
+
+    - http and https are treated as the same scheme
+    - the host is lower cased and default ports are dropped
+    - trailing slashes on the path are dropped
+    - tracking parameters (utm_*, fbclid etc) are dropped and the remaining parameters are sorted
+    - fragments are dropped
+
+    URLs which are not http(s) (e.g javascript: or place:) are returned as is.
+    """
+    url = url.strip()
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        return url
+
+    host = (parts.hostname or "").lower()
+    if port and port != _DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    path = parts.path.rstrip("/")
+
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking_parameter(key)]
+    query.sort()
+
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+def deduplicate(docs: Iterable[Document]) -> list[Document]:
+    """
+    Collapses documents which point at the same (normalized) URL into a single representative document.
+
+    The first document seen for a URL is kept and every browser and source that held that URL is recorded as provenance
+    on its metadata. Documents whose URL cannot be determined are always kept.
+    """
+    representatives: dict[str, Document] = {}
+    unique: list[Document] = []
+    total = 0
+
+    for doc in docs:
+        total += 1
+        url = document_url(doc)
+
+        if url is None:
+            unique.append(doc)
+            continue
+
+        key = normalize_url(url)
+        representative = representatives.get(key)
+
+        if representative is None:
+            representatives[key] = doc
+            unique.append(doc)
+            representative = doc
+
+            representative.metadata[Metadata.Browsers.value] = []
+            representative.metadata[Metadata.Sources.value] = []
+
+        _add_provenance(representative, doc)
+
+    logger.debug(f"deduplicated {total} documents into {len(unique)} unique documents")
+
+    return unique
+
+
+def _add_provenance(representative: Document, doc: Document):
+    browsers = representative.metadata[Metadata.Browsers.value]
+    browser = doc.metadata.get(Metadata.Browser.value)
+    if browser is not None and browser not in browsers:
+        browsers.append(browser)
+
+    sources = representative.metadata[Metadata.Sources.value]
+    source = doc.metadata.get("source")
+    if source is not None and source not in sources:
+        sources.append(source)
+
+
+def document_url(doc: Document) -> Optional[str]:
+    # both the Chromium (JSON) and the Firefox (SQL) loaders produce a JSON object with a url key
+    try:
+        content = json.loads(doc.page_content)
+    except (TypeError, ValueError):
+        return None
+
+    if not isinstance(content, dict):
+        return None
+
+    url = content.get("url")
+    return url if isinstance(url, str) and url else None
+
+
+def _is_tracking_parameter(key: str) -> bool:
+    key = key.lower()
+    return key in TRACKING_PARAMETERS or key.startswith(TRACKING_PARAMETER_PREFIXES)
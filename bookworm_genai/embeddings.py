@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import random
+from typing import Optional
+
+import httpx
+import openai
+from langchain_core.embeddings.embeddings import Embeddings
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, ProgressColumn, Task, TaskID, TextColumn, TimeElapsedColumn
+from rich.text import Text
+
+from bookworm_genai import profiling
+
+logger = logging.getLogger(__name__)
+
+# rough number of characters per token for english text, only used to size batches so precision is not important
+CHARS_PER_TOKEN = 4
+
+# requests which never reached the embeddings service or timed out waiting for it, worth sending again
+CONNECTION_ERRORS = (openai.APIConnectionError, httpx.TransportError, ConnectionError, TimeoutError, asyncio.TimeoutError)
+
+
+class PartialEmbeddingsError(Exception):
+    """
+    Raised when some of the texts could not be embedded while others were, vectors holds the embeddings of the texts which
+    were (None for the others) so that they do not need to be embedded again.
+    """
+
+    def __init__(self, vectors: list[Optional[list[float]]], error: BaseException):
+        self.vectors = vectors
+        super().__init__(f"{sum(vector is None for vector in vectors)} of {len(vectors)} documents could not be embedded: {error}")
+
+
+class ConcurrentEmbeddings(Embeddings):
+    """
+    Wraps an embeddings service so that documents are embedded in token budgeted batches which are sent concurrently.
+
+    Concurrency adapts to the rate limit of the service: every rate limited (429) response halves the number of requests
+    in flight and pauses new requests for a backoff period, while successful responses slowly raise it back up.
+    Failed batches are retried on their own so that batches which already succeeded are never embedded again, and a batch
+    which cannot be embedded does not throw away the others (see PartialEmbeddingsError).
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_concurrency: int = 8,
+        max_tokens_per_batch: int = 20_000,
+        max_batch_size: int = 256,
+        max_retries: int = 6,
+        show_progress: bool = True,
+    ):
+        self._embeddings = embeddings
+        self._max_concurrency = max_concurrency
+        self._max_tokens_per_batch = max_tokens_per_batch
+        self._max_batch_size = max_batch_size
+        self._max_retries = max_retries
+        self._show_progress = show_progress
+
+        # the concurrency reached and a single progress bar are carried across calls (e.g one per chunk of a sync)
+        self._concurrency = max_concurrency
+        self._progress: Optional[Progress] = None
+        self._progress_task: Optional[TaskID] = None
+
+    def __getattr__(self, name: str):
+        # exposes details of the wrapped service such as .model and .dimensions
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        return getattr(self._embeddings, name)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+
+        return asyncio.run(self.aembed_documents(texts))
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        batches = _make_batches(texts, self._max_tokens_per_batch, self._max_batch_size)
+        vectors: list[Optional[list[float]]] = [None] * len(texts)
+
+        limiter = _AdaptiveLimiter(self._max_concurrency, limit=self._concurrency)
+
+        logger.debug(f"embedding {len(texts)} documents in {len(batches)} batches (max concurrency: {self._max_concurrency})")
+
+        progress, task = self._start_progress(len(texts))
+
+        async def embed_batch(start: int, end: int):
+            batch = texts[start:end]
+
+            for attempt in range(self._max_retries + 1):
+                async with limiter:
+                    try:
+                        with profiling.span("embed request") as span:
+                            # the embeddings service does not report the tokens it used, so they are estimated
+                            span.add_tokens(sum(len(text) for text in batch) // CHARS_PER_TOKEN)
+                            result = await self._embeddings.aembed_documents(batch)
+                    except Exception as e:
+                        if attempt == self._max_retries or not _is_retryable(e):
+                            raise
+
+                        delay = _backoff(attempt, e)
+
+                        if _is_rate_limit(e):
+                            logger.debug(f"rate limited, retrying batch [{start}:{end}] in {delay:.2f}s (attempt {attempt + 1})")
+                            limiter.decrease(delay)
+                        else:
+                            logger.debug(f"batch [{start}:{end}] failed with '{e}', retrying in {delay:.2f}s (attempt {attempt + 1})")
+
+                    else:
+                        limiter.increase()
+                        vectors[start:end] = result
+                        progress.advance(task, len(batch))
+                        return
+
+                await asyncio.sleep(delay)
+
+        try:
+            # every batch is given the chance to finish, the vectors of those which did are kept when another one failed
+            results = await asyncio.gather(*(embed_batch(start, end) for start, end in batches), return_exceptions=True)
+        finally:
+            self._concurrency = limiter.limit
+
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors and len(errors) < len(batches):
+            raise PartialEmbeddingsError(vectors, errors[0]) from errors[0]
+        elif errors:
+            raise errors[0]
+
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embeddings.embed_query(text)
+
+    def close(self):
+        if self._progress is not None:
+            self._progress.stop()
+            self._progress = None
+            self._progress_task = None
+
+    def _start_progress(self, total: int) -> tuple[Progress, TaskID]:
+        if self._progress is None:
+            self._progress = _create_progress(disable=not self._show_progress)
+            self._progress.start()
+            self._progress_task = self._progress.add_task("Embedding bookmarks", total=total)
+        else:
+            current_total = self._progress.tasks[0].total or 0
+            self._progress.update(self._progress_task, total=current_total + total)
+
+        return self._progress, self._progress_task
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self._embeddings.aembed_query(text)
+
+
+class _AdaptiveLimiter:
+    """
+    Limits the number of concurrent requests using additive increase / multiplicative decrease.
+    """
+
+    def __init__(self, max_concurrency: int, limit: Optional[int] = None):
+        self.max_concurrency = max_concurrency
+        self.limit = limit or max_concurrency
+        self.in_flight = 0
+
+        self._resume_at = 0.0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+        # wait out any backoff requested by a rate limited response
+        pause = self._resume_at - asyncio.get_running_loop().time()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def increase(self):
+        self._successes += 1
+
+        if self._successes >= self.limit and self.limit < self.max_concurrency:
+            self._successes = 0
+            self.limit += 1
+            logger.debug(f"raising embedding concurrency to {self.limit}")
+
+    def decrease(self, pause: float):
+        self._successes = 0
+        self.limit = max(1, self.limit // 2)
+        self._resume_at = max(self._resume_at, asyncio.get_running_loop().time() + pause)
+        logger.debug(f"lowering embedding concurrency to {self.limit}")
+
+
+class _RateColumn(ProgressColumn):
+    def render(self, task: Task) -> Text:
+        speed = task.finished_speed or task.speed
+        return Text(f"{speed or 0:.1f} docs/s", style="progress.data.speed")
+
+
+def _create_progress(disable: bool = False) -> Progress:
+    return Progress(
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        _RateColumn(),
+        TimeElapsedColumn(),
+        disable=disable,
+    )
+
+
+def _make_batches(texts: list[str], max_tokens: int, max_size: int) -> list[tuple[int, int]]:
+    """
+    Splits the texts into contiguous [start, end) ranges which stay within the token budget and maximum size.
+    A single text over the token budget is given a batch of its own.
+    """
+    batches: list[tuple[int, int]] = []
+
+    start = 0
+    tokens = 0
+
+    for index, text in enumerate(texts):
+        text_tokens = len(text) // CHARS_PER_TOKEN + 1
+
+        if index > start and (tokens + text_tokens > max_tokens or index - start >= max_size):
+            batches.append((start, index))
+            start = index
+            tokens = 0
+
+        tokens += text_tokens
+
+    if start < len(texts):
+        batches.append((start, len(texts)))
+
+    return batches
+
+
+def _is_rate_limit(e: Exception) -> bool:
+    # openai.RateLimitError (and most http client errors) expose the status code of the response
+    return getattr(e, "status_code", None) == 429
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, CONNECTION_ERRORS):
+        return True
+
+    # rate limits, timeouts and server errors are worth retrying but client errors such as an invalid api key (401), or
+    # errors which did not come from the service at all (e.g a bug), will not go away by trying again
+    status_code = getattr(e, "status_code", None)
+    return isinstance(status_code, int) and (status_code in (408, 429) or status_code >= 500)
+
+
+def _backoff(attempt: int, e: Exception, base: float = 1.0, cap: float = 60.0) -> float:
+    retry_after = _retry_after(e)
+    if retry_after is not None:
+        return min(retry_after, cap)
+
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+
+    try:
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
@@ -1,22 +1,10 @@
 import os
-from enum import Enum
 from typing import Any
 
-from langchain_community.document_loaders import JSONLoader
-from langchain_community.document_loaders.sql_database import SQLDatabaseLoader
-from langchain_community.utilities.sql_database import SQLDatabase
 
-from bookworm_genai.utils import CHROMIUM_JQ_COMMAND, sql_loader_page_content_mapper, sql_loader_firefox_copy_path, sql_loader_firefox_sql_query
-
-
-class Browser(str, Enum):
-    BRAVE = "brave"
-    CHROME = "chrome"
-    FIREFOX = "firefox"
-
-    @classmethod
-    def list(cls):
-        return list(map(lambda c: c.value, cls))
+from bookworm_genai.browser import Browser
+from bookworm_genai.loaders import ChromiumBookmarkLoader, FirefoxBookmarkLoader
+from bookworm_genai.utils import sql_loader_firefox_copy_path
 
 
 BrowserManifest = dict[Browser, dict[str, dict[str, Any]]]
@@ -30,67 +18,45 @@ BrowserManifest = dict[Browser, dict[str, dict[str, Any]]]
 browsers: BrowserManifest = {
     Browser.BRAVE: {
         "linux": {
-            "bookmark_loader": JSONLoader,
+            "bookmark_loader": ChromiumBookmarkLoader,
             "bookmark_loader_kwargs": {
                 "file_path": os.path.expanduser("~/.config/BraveSoftware/Brave-Browser/Default/Bookmarks"),
-                "jq_schema": CHROMIUM_JQ_COMMAND,
-                "text_content": False,
             },
         },
         "darwin": {
-            "bookmark_loader": JSONLoader,
+            "bookmark_loader": ChromiumBookmarkLoader,
             "bookmark_loader_kwargs": {
                 "file_path": os.path.expanduser("~/Library/Application Support/BraveSoftware/Brave-Browser/Default/Bookmarks"),
-                "jq_schema": CHROMIUM_JQ_COMMAND,
-                "text_content": False,
             },
         },
         # "win32": {},
     },
     Browser.CHROME: {
         "linux": {
-            "bookmark_loader": JSONLoader,
+            "bookmark_loader": ChromiumBookmarkLoader,
             "bookmark_loader_kwargs": {
                 "file_path": os.path.expanduser("~/.config/google-chrome/Default/Bookmarks"),
-                "jq_schema": CHROMIUM_JQ_COMMAND,
-                "text_content": False,
             },
         },
         "darwin": {
-            "bookmark_loader": JSONLoader,
+            "bookmark_loader": ChromiumBookmarkLoader,
             "bookmark_loader_kwargs": {
                 "file_path": os.path.expanduser("~/Library/Application Support/Google/Chrome/Default/Bookmarks"),
-                "jq_schema": CHROMIUM_JQ_COMMAND,
-                "text_content": False,
             },
         },
         # "win32": {},
     },
     Browser.FIREFOX: {
         "linux": {
-            "bookmark_loader": SQLDatabaseLoader,
+            "bookmark_loader": FirefoxBookmarkLoader,
             "bookmark_loader_kwargs": {
-                "db": lambda _: SQLDatabase.from_uri("sqlite:////tmp/bookworm/firefox.sqlite"),
-                "query": sql_loader_firefox_sql_query(),
-                "source_columns": ["source"],
-                "page_content_mapper": lambda row: sql_loader_page_content_mapper(row),
-            },
-            "copy": {
-                "from": sql_loader_firefox_copy_path(),
-                "to": "/tmp/bookworm/firefox.sqlite",
+                "file_path": sql_loader_firefox_copy_path(),
             },
         },
         "darwin": {
-            "bookmark_loader": SQLDatabaseLoader,
+            "bookmark_loader": FirefoxBookmarkLoader,
             "bookmark_loader_kwargs": {
-                "db": lambda _: SQLDatabase.from_uri("sqlite:////tmp/bookworm/firefox.sqlite"),
-                "query": sql_loader_firefox_sql_query(),
-                "source_columns": ["source"],
-                "page_content_mapper": lambda row: sql_loader_page_content_mapper(row),
-            },
-            "copy": {
-                "from": sql_loader_firefox_copy_path(),
-                "to": "/tmp/bookworm/firefox.sqlite",
+                "file_path": sql_loader_firefox_copy_path(),
             },
         },
         # "win32": {},
@@ -0,0 +1,207 @@
+import glob
+import errno
+import json
+import shutil
+import logging
+import sqlite3
+import tempfile
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Iterator, Optional, Union
+from pathlib import Path
+
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+
+from bookworm_genai.utils import sql_loader_firefox_sql_query, sql_loader_page_content_mapper
+
+logger = logging.getLogger(__name__)
+
+# the roots of a Chromium Bookmarks file which are synced, the 'synced' root holds mobile bookmarks and is not included
+CHROMIUM_ROOTS = ("bookmark_bar", "other")
+
+# how long to wait for a lock on places.sqlite to be released, Firefox holds one for as long as it runs so the database is
+# read through a snapshot (see _snapshot_places) rather than waiting any longer
+LOCK_TIMEOUT_SECONDS = 0.1
+
+# the SQLite VFS which reads a database without taking any lock, see _snapshot_places
+LOCK_FREE_VFS = "unix-none"
+
+# ids of the places which are bookmarked in Firefox, the same ids as the 'id' key of the page content
+FIREFOX_IDS_QUERY = "SELECT DISTINCT CAST(fk AS TEXT) FROM moz_bookmarks WHERE type = 1 AND title IS NOT NULL AND fk IS NOT NULL"
+
+
+@dataclass
+class BookmarkDelta:
+    """
+    Describes what a loader which supports deltas read from its source.
+
+    The watermark is passed back to the loader (as since) on the next sync so that it only reads what changed after it.
+    When only changes were read then ids holds the id (the 'id' key of the page content) of every bookmark which currently
+    exists and changed holds the ids of the bookmarks which were read, which is enough to find the bookmarks that were removed.
+    """
+
+    watermark: Optional[int]
+    ids: Optional[list[str]] = None
+    changed: Optional[list[str]] = None
+
+
+class ChromiumBookmarkLoader(BaseLoader):
+    """
+    Loads bookmarks from the Bookmarks file of a Chromium based browser (Chrome, Brave etc).
+
+    The bookmark tree is walked iteratively in a single pass and a Document is only built when it is consumed.
+    Each Document has the same page content and metadata that langchain's JSONLoader produced
+    (the bookmark node as JSON, the source file and a sequence number) so stored bookmarks keep their identity,
+    along with the path of folders the bookmark lives in.
+    """
+
+    def __init__(self, file_path: Union[str, Path]):
+        self.file_path = Path(file_path).resolve()
+
+    def lazy_load(self) -> Iterator[Document]:
+        with open(self.file_path, encoding="utf-8") as f:
+            roots = json.load(f).get("roots", {})
+
+        source = str(self.file_path)
+
+        for seq_num, (node, folder) in enumerate(_walk(roots), 1):
+            yield Document(page_content=json.dumps(node), metadata={"source": source, "seq_num": seq_num, "folder": folder})
+
+
+class FirefoxBookmarkLoader(BaseLoader):
+    """
+    Loads bookmarks from the places.sqlite database of a Firefox profile.
+
+    The live database is opened read only in place and rows are streamed from the cursor in batches. If Firefox holds a lock
+    on the database then it is copied instead (with its write-ahead log) and only the bookmarks and the places they point at
+    are backed up into memory from the copy and read from there.
+
+    Bookmarks carry a lastModified time which is used as the watermark of a delta, given since only the places which have a
+    bookmark modified since then are read.
+    """
+
+    supports_delta = True
+
+    def __init__(self, file_path: str, batch_size: int = 1_000, since: Optional[int] = None):
+        # file_path may be a glob expression as the profile folder name is random, it is kept as is for the source
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.since = since
+        self.delta: Optional[BookmarkDelta] = None
+
+    def lazy_load(self) -> Iterator[Document]:
+        paths = glob.glob(self.file_path)
+        if not paths:
+            raise FileNotFoundError(errno.ENOENT, "Firefox bookmarks database not found", self.file_path)
+
+        with closing(_connect_places(paths[0])) as conn:
+            (watermark,) = conn.execute("SELECT max(lastModified) FROM moz_bookmarks WHERE type = 1").fetchone()
+
+            query = sql_loader_firefox_sql_query()
+            parameters = [self.file_path]
+
+            if self.since is None:
+                delta = BookmarkDelta(watermark=watermark)
+            else:
+                ids = [item_id for (item_id,) in conn.execute(FIREFOX_IDS_QUERY)]
+                changed = [item_id for (item_id,) in conn.execute(f"{FIREFOX_IDS_QUERY} AND lastModified >= ?", [self.since])]
+
+                logger.debug(f"{len(changed)} of {len(ids)} Firefox bookmarks changed since {self.since}")
+
+                delta = BookmarkDelta(watermark=watermark or self.since, ids=ids, changed=changed)
+                query += " AND moz_bookmarks.fk IN (SELECT fk FROM moz_bookmarks WHERE type = 1 AND lastModified >= ?)"
+                parameters.append(self.since)
+
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(query, parameters)
+
+            while rows := cursor.fetchmany(self.batch_size):
+                for row in rows:
+                    yield Document(page_content=sql_loader_page_content_mapper(row), metadata={"source": row["source"]})
+
+        self.delta = delta
+
+
+def _connect_places(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, timeout=LOCK_TIMEOUT_SECONDS)
+
+    try:
+        conn.execute("SELECT 1 FROM moz_bookmarks LIMIT 1").fetchall()
+    except sqlite3.OperationalError as e:
+        conn.close()
+
+        if "locked" not in str(e):
+            raise
+
+        logger.debug(f"{path} is locked, reading a snapshot of the bookmarks instead")
+        return _snapshot_places(path)
+
+    return conn
+
+
+def _snapshot_places(path: str) -> sqlite3.Connection:
+    # the locked database is read in place through a VFS which takes no locks, along with its write-ahead log which holds
+    # what Firefox wrote since its last checkpoint (reading it with immutable=1 would skip the log). Nothing guards the read
+    # against Firefox checkpointing at the same time, a read which fails (or a platform without the VFS) falls back to a copy
+    try:
+        return _read_places(f"{Path(path).resolve().as_uri()}?mode=ro&vfs={LOCK_FREE_VFS}")
+    except sqlite3.DatabaseError as e:
+        logger.debug(f"could not read {path} in place, reading a copy of it instead: {e}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy = Path(directory) / Path(path).name
+        shutil.copyfile(path, copy)
+
+        wal = Path(f"{path}-wal")
+        if wal.exists():
+            shutil.copyfile(wal, f"{copy}-wal")
+
+        return _read_places(copy.as_uri())
+
+
+def _read_places(uri: str) -> sqlite3.Connection:
+    """
+    Reads the bookmarks and the places they point at into memory, so that the snapshot is not affected by Firefox writing
+    while the bookmarks are streamed.
+    """
+    conn = sqlite3.connect(":memory:", uri=True)
+
+    try:
+        # set before the database is attached so that its write-ahead log is indexed in memory rather than through the shared
+        # memory file, which the lock free VFS (and a read only connection) cannot use
+        conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        conn.execute("ATTACH DATABASE ? AS places", [uri])
+
+        conn.execute("CREATE TABLE moz_bookmarks AS SELECT fk, title, dateAdded, lastModified, type FROM places.moz_bookmarks WHERE type = 1")
+        conn.execute("CREATE TABLE moz_places AS SELECT id, url FROM places.moz_places WHERE id IN (SELECT fk FROM moz_bookmarks)")
+        conn.execute("DETACH DATABASE places")
+    except sqlite3.Error:
+        conn.close()
+        raise
+
+    return conn
+
+
+def _walk(roots: dict) -> Iterator[tuple[dict, str]]:
+    """
+    Yields every url node under the synced roots along with its folder path, in document order (depth first).
+    """
+    stack = []
+    for root in reversed(CHROMIUM_ROOTS):
+        node = roots.get(root)
+        if isinstance(node, dict):
+            stack.append((node, node.get("name", root)))
+
+    while stack:
+        node, folder = stack.pop()
+
+        if node.get("type") == "url":
+            yield node, folder
+            continue
+
+        children = node.get("children") or []
+        for child in reversed(children):
+            if isinstance(child, dict):
+                child_folder = f"{folder}/{child.get('name', '')}" if child.get("type") == "folder" else folder
+                stack.append((child, child_folder))
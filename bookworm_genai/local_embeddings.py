@@ -0,0 +1,106 @@
+import re
+import json
+import logging
+
+import numpy as np
+from langchain_core.embeddings.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+LOCAL_EMBEDDING_MODEL = "hashed-ngrams-v1"
+LOCAL_EMBEDDING_DIMENSIONS = 512
+
+# the fields of a bookmark (see loaders.py) which describe it, the rest (ids, dates, guids) would only add noise
+BOOKMARK_FIELDS = ("name", "url")
+
+# large odd constants used to hash the characters of an n-gram and to mix the hash (see _hash_ngrams)
+_MULTIPLIER = np.uint64(0x100000001B3)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeds text on the CPU without a network connection or a model file.
+
+    Text is lower cased, reduced to its words and split into character n-grams (with the spaces around words so that
+    n-grams at the start and end of a word are distinct). Every n-gram is hashed into one of the dimensions with a random
+    sign, the counts are dampened (log) so that repeated n-grams do not dominate and the vector is normalized.
+    Texts sharing words or parts of words (e.g 'panda' and 'pandas') end up close together.
+
+    Unlike TF-IDF the vectors do not depend on the other documents, so vectors embedded by different syncs stay comparable.
+    A batch of texts is hashed and counted in a handful of NumPy operations.
+    """
+
+    model = LOCAL_EMBEDDING_MODEL
+
+    def __init__(self, dimensions: int = LOCAL_EMBEDDING_DIMENSIONS, ngram_sizes: tuple[int, ...] = (3, 4, 5)):
+        if dimensions & (dimensions - 1):
+            raise ValueError(f"dimensions must be a power of 2, got {dimensions}")
+
+        self.dimensions = dimensions
+        self._ngram_sizes = ngram_sizes
+        self._bits = np.uint64(dimensions.bit_length() - 1)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+
+        return self._embed(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed([text])[0].tolist()
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        # texts are joined into a single buffer, separated by zero bytes so that no n-gram spans two texts
+        padding = b"\x00" * max(self._ngram_sizes)
+        encoded = [f" {_normalize(text)} ".encode("utf-8") for text in texts]
+
+        buffer = np.frombuffer(padding.join(encoded) + padding, dtype=np.uint8)
+        starts = np.cumsum([0] + [len(e) + len(padding) for e in encoded[:-1]])
+        rows = np.searchsorted(starts, np.arange(len(buffer)), side="right") - 1
+
+        # the number of separators up to each position, an n-gram is valid when it does not cover one
+        separators = np.concatenate([[0], np.cumsum(buffer == 0)])
+
+        cells, signs = [], []
+        for n in self._ngram_sizes:
+            windows = np.lib.stride_tricks.sliding_window_view(buffer, n)
+            valid = separators[n:] == separators[: len(windows)]
+
+            hashes = _hash_ngrams(windows[valid])
+            cells.append(rows[: len(windows)][valid] * self.dimensions + (hashes >> (np.uint64(64) - self._bits)).astype(np.int64))
+            signs.append(np.where(hashes & np.uint64(1), 1.0, -1.0))
+
+        counts = np.bincount(np.concatenate(cells), weights=np.concatenate(signs), minlength=len(texts) * self.dimensions)
+
+        vectors = counts.reshape(len(texts), self.dimensions).astype(np.float32)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def _normalize(text: str) -> str:
+    try:
+        content = json.loads(text)
+    except ValueError:
+        content = None
+
+    if isinstance(content, dict) and any(field in content for field in BOOKMARK_FIELDS):
+        text = " ".join(str(content.get(field) or "") for field in BOOKMARK_FIELDS)
+
+    return _NON_WORD.sub(" ", text.casefold()).strip()
+
+
+def _hash_ngrams(windows: np.ndarray) -> np.ndarray:
+    # FNV style hash of every n-gram at once, mixed so that the top bits (the bucket) and the lowest bit (the sign) are spread
+    # evenly. uint64 arithmetic wraps around on overflow
+    hashes = np.zeros(len(windows), dtype=np.uint64)
+
+    with np.errstate(over="ignore"):
+        for column in range(windows.shape[1]):
+            hashes = (hashes ^ windows[:, column].astype(np.uint64)) * _MULTIPLIER
+
+        return hashes * _MIX
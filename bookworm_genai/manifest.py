@@ -0,0 +1,136 @@
+import os
+import glob
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_TABLE_NAME = "sync_manifest"
+
+# files which hold changes that have not been written into the source yet, e.g SQLite's write ahead log
+SIDECAR_SUFFIXES = ("-wal",)
+
+
+@dataclass
+class SourceFingerprint:
+    """
+    Identifies the state of a browser's bookmark file (along with any sidecar files) at a point in time.
+
+    The size and modification time are cheap to read and are compared first, the content hash is only computed when they differ.
+    Sources which are loaded as deltas (see BookmarkDelta) are never hashed as only their changes are read.
+    """
+
+    path: str
+    mtime_ns: int
+    size: int
+    content_hash: Optional[str] = field(default=None, repr=False, compare=False)
+
+    def compute_hash(self) -> str:
+        if self.content_hash is None:
+            digest = hashlib.sha256()
+
+            for path in _source_files(self.path):
+                with open(path, "rb") as f:
+                    while block := f.read(1 << 20):
+                        digest.update(block)
+
+            self.content_hash = digest.hexdigest()
+
+        return self.content_hash
+
+
+def fingerprint(file_path: str) -> Optional[SourceFingerprint]:
+    """
+    Fingerprints the bookmark file at the given path (which may be a glob expression).
+    Returns None if the file does not exist.
+    """
+    paths = glob.glob(file_path)
+    if not paths:
+        return None
+
+    path = paths[0]
+
+    try:
+        stats = [os.stat(source) for source in _source_files(path)]
+    except OSError as e:
+        logger.debug(f"could not fingerprint {path}: {e}")
+        return None
+
+    return SourceFingerprint(path=path, mtime_ns=max(stat.st_mtime_ns for stat in stats), size=sum(stat.st_size for stat in stats))
+
+
+def ensure_table(conn: duckdb.DuckDBPyConnection):
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE_NAME} (
+            browser VARCHAR PRIMARY KEY,
+            path VARCHAR,
+            mtime_ns BIGINT,
+            size BIGINT,
+            content_hash VARCHAR,
+            synced_at TIMESTAMP,
+            watermark BIGINT
+        )
+        """
+    )
+
+    # manifests created before watermarks were tracked
+    conn.execute(f"ALTER TABLE {MANIFEST_TABLE_NAME} ADD COLUMN IF NOT EXISTS watermark BIGINT")
+
+
+def is_unchanged(conn: duckdb.DuckDBPyConnection, browser: str, source: SourceFingerprint) -> bool:
+    """
+    Checks whether the source of the browser is the same as it was on its last successful sync.
+    """
+    row = conn.execute(f"SELECT path, mtime_ns, size, content_hash FROM {MANIFEST_TABLE_NAME} WHERE browser = ?", [browser]).fetchone()
+    if row is None:
+        return False
+
+    path, mtime_ns, size, content_hash = row
+
+    if path != source.path or size != source.size:
+        return False
+
+    if mtime_ns == source.mtime_ns:
+        return True
+
+    if content_hash is None or source.compute_hash() != content_hash:
+        return False
+
+    # the file was touched without being changed, remember the new time so that it is not hashed again next time
+    conn.execute(f"UPDATE {MANIFEST_TABLE_NAME} SET mtime_ns = ? WHERE browser = ?", [source.mtime_ns, browser])
+    return True
+
+
+def record(conn: duckdb.DuckDBPyConnection, browser: str, source: SourceFingerprint, watermark: Optional[int] = None):
+    conn.execute(
+        f"INSERT OR REPLACE INTO {MANIFEST_TABLE_NAME} (browser, path, mtime_ns, size, content_hash, synced_at, watermark) VALUES (?, ?, ?, ?, ?, current_timestamp, ?)",
+        [browser, source.path, source.mtime_ns, source.size, source.content_hash, watermark],
+    )
+
+
+def watermark(conn: duckdb.DuckDBPyConnection, browser: str) -> Optional[int]:
+    row = conn.execute(f"SELECT watermark FROM {MANIFEST_TABLE_NAME} WHERE browser = ?", [browser]).fetchone()
+    return row[0] if row else None
+
+
+def invalidate(conn: duckdb.DuckDBPyConnection, browsers: list[str]):
+    """
+    Forgets the sources of the given browsers so that they are loaded on the next sync.
+    """
+    conn.execute(f"DELETE FROM {MANIFEST_TABLE_NAME} WHERE browser IN (SELECT unnest(?::VARCHAR[]))", [browsers])
+
+
+def clear(conn: duckdb.DuckDBPyConnection):
+    """
+    Forgets the sources of every browser so that they are all loaded on the next sync.
+    """
+    conn.execute(f"DELETE FROM {MANIFEST_TABLE_NAME}")
+
+
+def _source_files(path: str) -> list[str]:
+    return [path] + [path + suffix for suffix in SIDECAR_SUFFIXES if os.path.exists(path + suffix)]
@@ -8,6 +8,14 @@ from bookworm_genai.integrations import Browser
 class Metadata(str, enum.Enum):
     Browser = "browser"
     BookwormVersion = "bookworm_version"
+    Browsers = "browsers"
+    Sources = "sources"
+    NormalizedURL = "normalized_url"
+    EmbeddingBackend = "embedding_backend"
+    EmbeddingStorage = "embedding_storage"
+    # only set on the documents returned by a search, from the typed columns of the bookmark (see schema.py)
+    Title = "title"
+    URL = "url"
 
 
 def attach_metadata(doc: Document, browser: Browser) -> Document:
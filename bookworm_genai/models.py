@@ -1,6 +1,7 @@
 import sys
 import subprocess
 import logging
+from typing import Optional
 
 from langchain_core.pydantic_v1 import BaseModel, Field
 
@@ -16,6 +17,8 @@ class Bookmark(BaseModel):
     url: str = Field(description="The URL of the bookmark")
     source: str = Field(description="The source of the bookmark")
     browser: str = Field(description="The browser that the bookmark was saved from")
+    score: Optional[float] = Field(default=None, description="The score the bookmark was ranked by for the query, leave empty")
+    score_type: Optional[str] = Field(default=None, description="The search which gave the score (similarity, keyword or fused), leave empty")
 
     def open(self):
         if sys.platform == "win32":
@@ -35,3 +38,11 @@ class Bookmarks(BaseModel):
     """
 
     bookmarks: list[Bookmark] = Field(description="A list of bookmarks")
+
+
+class BookmarkSelection(BaseModel):
+    """
+    The bookmarks of the context which answer the query
+    """
+
+    indices: list[int] = Field(description="The indices of the relevant bookmarks in the context, the most relevant first")
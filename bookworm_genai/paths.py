@@ -0,0 +1,33 @@
+import os
+import logging
+
+from platformdirs import PlatformDirs
+
+logger = logging.getLogger(__name__)
+
+
+def _get_local_store() -> str:
+    return _get_data_path("bookmarks.duckdb")
+
+
+def _get_query_cache_store() -> str:
+    return _get_data_path("query_cache.sqlite")
+
+
+def _get_token_cache_store() -> str:
+    return _get_data_path("token_cache.sqlite")
+
+
+def _get_server_file() -> str:
+    # written by 'bookworm serve' with the address it listens on
+    return _get_data_path("server.json")
+
+
+def _get_data_path(name: str) -> str:
+    appdirs = PlatformDirs("bookworm", "bookworm")
+    full_path = os.path.join(appdirs.user_data_dir, name)
+
+    logger.debug(f"creating folder {appdirs.user_data_dir}")
+    os.makedirs(appdirs.user_data_dir, exist_ok=True)
+
+    return full_path
@@ -0,0 +1,235 @@
+"""
+Timing spans for 'bookworm --profile'.
+
+The stages of each command (loading a browser, embedding, inserting into DuckDB, building the indexes, searching, the LLM...)
+are wrapped in spans which cost nothing unless profiling was enabled. Once enabled every span records its wall time, the
+number of times it ran, the tokens it sent (where it sends any) and how much it raised the peak memory of the process, and
+every call is kept as an event of a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+
+Nothing heavier than rich (which the logs use already) is imported here, so that every module can use spans without slowing
+down the start up.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, TypeVar
+
+from rich.console import Console
+from rich.table import Table
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # not available on Windows, where memory is not reported
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# the formats the profile can be written in (--profile-output), a Chrome trace of the spans or a dump of the Python profilers
+PROFILE_FORMATS = ["chrome-trace", "cprofile", "tracemalloc"]
+
+# the depth of the stack recorded for every allocation traced by tracemalloc
+TRACEMALLOC_FRAMES = 25
+
+
+@dataclass
+class SpanStats:
+    calls: int = 0
+    seconds: float = 0.0
+    tokens: int = 0
+    # how much the spans raised the peak resident set size of the process
+    memory: int = 0
+
+
+class Span:
+    def __init__(self):
+        self.tokens = 0
+
+    def add_tokens(self, tokens: int):
+        self.tokens += tokens
+
+
+class Profiler:
+    """
+    Collects the spans of every thread, in the order they were first entered.
+    """
+
+    def __init__(self):
+        self.stats: dict[str, SpanStats] = {}
+        self.events: list[dict] = []
+
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def record(self, name: str, start: float, end: float, tokens: int = 0, memory: int = 0):
+        with self._lock:
+            stats = self.stats.setdefault(name, SpanStats())
+            stats.calls += 1
+            stats.seconds += end - start
+            stats.tokens += tokens
+            stats.memory += memory
+
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self._origin) * 1_000_000,
+                    "dur": (end - start) * 1_000_000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"tokens": tokens} if tokens else {},
+                }
+            )
+
+    def write_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+_profiler: Optional[Profiler] = None
+
+
+@contextmanager
+def profile(output: Optional[str] = None, output_format: str = PROFILE_FORMATS[0]) -> Iterator[Profiler]:
+    """
+    Profiles the block, then prints the time, calls, tokens and memory of each span and writes the profile into the output.
+    """
+    if output_format not in PROFILE_FORMATS:
+        raise ValueError(f"Unknown profile format '{output_format}', expected one of {PROFILE_FORMATS}")
+
+    profiler = enable()
+
+    python_profiler = None
+    if output is not None and output_format == "cprofile":
+        import cProfile
+
+        # NOTE: only the calls made by this thread are profiled, not those of the threads loading the browsers
+        python_profiler = cProfile.Profile()
+        python_profiler.enable()
+
+    if output is not None and output_format == "tracemalloc":
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    start = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        elapsed = time.perf_counter() - start
+        disable()
+
+        if python_profiler is not None:
+            python_profiler.disable()
+            python_profiler.dump_stats(output)
+
+        elif tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(output)
+            tracemalloc.stop()
+
+        elif output is not None:
+            profiler.write_chrome_trace(output)
+
+        Console(stderr=True).print(_table(profiler, elapsed))
+
+        if output is not None:
+            logger.info(f"profile written to '{output}' ({output_format})")
+
+
+def enable() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+@contextmanager
+def span(name: str) -> Iterator[Span]:
+    """
+    Records the time taken by the block under the given name, tokens sent by the block are added to the yielded span.
+    """
+    current = Span()
+
+    profiler = _profiler
+    if profiler is None:
+        yield current
+        return
+
+    memory = _peak_rss()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        profiler.record(name, start, time.perf_counter(), current.tokens, _peak_rss() - memory)
+
+
+def record(name: str, start: float, end: float, tokens: int = 0):
+    """
+    Records a span which was timed elsewhere (e.g by the callbacks of langchain), start and end are from time.perf_counter().
+    """
+    if _profiler is not None:
+        _profiler.record(name, start, end, tokens)
+
+
+def iterate(name: str, items: Iterable[T]) -> Iterator[T]:
+    """
+    Yields the items, recording the time taken to produce each of them (but not the time the consumer takes) as a span.
+    """
+    iterator = iter(items)
+
+    while True:
+        with span(name):
+            item = next(iterator, _DONE)
+
+        if item is _DONE:
+            return
+
+        yield item
+
+
+_DONE = object()
+
+
+def _table(profiler: Profiler, elapsed: float) -> Table:
+    # spans can be nested and run on several threads at once, so their shares of the command do not add up to 100%
+    table = Table(title=f"profile ({elapsed:.2f}s)", title_justify="left")
+    table.add_column("stage")
+    for column in ["calls", "wall time (s)", "share", "tokens", "peak memory +MB"]:
+        table.add_column(column, justify="right")
+
+    for name, stats in profiler.stats.items():
+        table.add_row(
+            name,
+            f"{stats.calls:,}",
+            f"{stats.seconds:.3f}",
+            f"{stats.seconds / elapsed:.0%}" if elapsed else "",
+            f"{stats.tokens:,}" if stats.tokens else "",
+            f"{stats.memory / 1_000_000:.1f}",
+        )
+
+    return table
+
+
+def _peak_rss() -> int:
+    if resource is None:  # pragma: no cover
+        return 0
+
+    # kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1_024
@@ -0,0 +1,60 @@
+from typing import Optional
+
+import numpy as np
+
+# the leading dimensions of every embedding which the (indexed) candidate search runs over, for the models which support it
+CANDIDATE_DIMENSIONS = 256
+
+# OpenAI's text-embedding-3 models are trained (Matryoshka representation learning) so that the start of an embedding is
+# itself a (less precise) embedding. The start of an embedding of other models (e.g text-embedding-ada-002) is not.
+TRUNCATABLE_MODEL_PREFIXES = ("text-embedding-3-",)
+
+# the number of candidates rescored against the full embedding for every result asked for
+RESCORE_MULTIPLIER = 8
+
+INT8_MAX = 127
+
+
+def candidate_dimensions(model: Optional[str]) -> Optional[int]:
+    """
+    The number of leading dimensions of the model's embeddings which the candidate search can run over, None when the
+    embeddings cannot be truncated and the candidate search needs every dimension.
+    """
+    if model and model.startswith(TRUNCATABLE_MODEL_PREFIXES):
+        return CANDIDATE_DIMENSIONS
+
+    return None
+
+
+def quantize(embeddings: list[list[float]], dimensions: Optional[int] = CANDIDATE_DIMENSIONS) -> tuple[Optional[np.ndarray], np.ndarray]:
+    """
+    The compact vectors which are stored alongside the full precision embeddings to find candidates with:
+
+    - the first dimensions of each embedding (normalized again), which the index is built over. None when dimensions is
+      None, i.e the model's embeddings cannot be truncated (see candidate_dimensions) and the index is built over the
+      full embeddings instead
+    - every dimension quantized to int8, which an exact search scans
+
+    Each embedding is scaled by its own largest value before it is rounded so that the whole int8 range is used, the scale
+    is not stored as it does not change the cosine similarity.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    candidates = reduce_dimensions(vectors, dimensions) if dimensions is not None else None
+
+    return candidates, _quantize_int8(vectors)
+
+
+def reduce_dimensions(vectors: np.ndarray, dimensions: int = CANDIDATE_DIMENSIONS) -> np.ndarray:
+    """
+    The first dimensions of each vector (a single vector or one per row), normalized again.
+    """
+    reduced = np.asarray(vectors, dtype=np.float32)[..., :dimensions]
+
+    norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+    return reduced / np.where(norms > 0, norms, 1.0)
+
+
+def _quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    scales = np.abs(vectors).max(axis=1, keepdims=True)
+
+    return np.round(vectors / np.where(scales > 0, scales, 1.0) * INT8_MAX).astype(np.int8)
@@ -0,0 +1,178 @@
+import json
+import logging
+from typing import Optional, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# NOTE: the same table name as langchain's DuckDBVectorStore, which created the bookmark databases of older versions
+TABLE_NAME = "embeddings"
+
+# the offset between the Chromium (1601-01-01) and Unix epochs, in microseconds
+CHROMIUM_EPOCH_OFFSET_US = 11_644_473_600_000_000
+
+# typed columns describing every bookmark, derived from its page content (the bookmark as loaded) and metadata when it is
+# stored so that they can be filtered, exported and deduplicated with plain SQL.
+# the expressions read the columns of the langchain layout (text and metadata) which every version stores
+BOOKMARK_COLUMNS = {
+    "url": ("VARCHAR", "CASE WHEN json_valid(text) THEN json_extract_string(text, '$.url') END"),
+    # anything which is not a bookmark (see loaders.py) is its own title
+    "title": ("VARCHAR", "CASE WHEN json_valid(text) THEN json_extract_string(text, '$.name') ELSE text END"),
+    "browser": ("VARCHAR", "json_extract_string(metadata, '$.browser')"),
+    "source": ("VARCHAR", "json_extract_string(metadata, '$.source')"),
+    "folder": ("VARCHAR", "json_extract_string(metadata, '$.folder')"),
+    "normalized_url": ("VARCHAR", "json_extract_string(metadata, '$.normalized_url')"),
+    # Chromium stores microseconds since 1601 (date_added) and Firefox microseconds since 1970 (dateAdded)
+    "date_added": (
+        "TIMESTAMP",
+        f"""CASE WHEN json_valid(text) THEN coalesce(
+            make_timestamp(TRY_CAST(json_extract_string(text, '$.date_added') AS BIGINT) - {CHROMIUM_EPOCH_OFFSET_US}),
+            make_timestamp(TRY_CAST(json_extract_string(text, '$.dateAdded') AS BIGINT))
+        ) END""",
+    ),
+    "content_hash": ("VARCHAR", "sha256(text)"),
+    # documents stored before the backend was recorded were all embedded by OpenAI
+    "embedding_backend": ("VARCHAR", "coalesce(json_extract_string(metadata, '$.embedding_backend'), 'openai')"),
+    # how the embedding is stored, see quantization.py
+    "embedding_storage": ("VARCHAR", "coalesce(json_extract_string(metadata, '$.embedding_storage'), 'float32')"),
+    # every browser and source which held the url of the bookmark, see SyncSession.finish
+    "browsers": ("VARCHAR[]", "coalesce(from_json(json_extract(metadata, '$.browsers'), '[\"VARCHAR\"]'), [])"),
+    "sources": ("VARCHAR[]", "coalesce(from_json(json_extract(metadata, '$.sources'), '[\"VARCHAR\"]'), [])"),
+}
+
+# columns holding a representation of the embedding, which are only set by some storage modes (see quantization.py)
+VECTOR_COLUMNS = {
+    "embedding_int8": "TINYINT[]",
+    "embedding_candidate": "FLOAT[]",
+}
+
+# tables which were replaced by columns of the bookmark table
+OBSOLETE_TABLES = ("bookmark_text",)
+
+STAGED_ROWS_VIEW_NAME = "bookmarks_to_insert"
+
+
+def ensure_table(conn: duckdb.DuckDBPyConnection):
+    """
+    Creates the bookmark table or migrates one created by an older version, which only had the langchain layout
+    (id, text, embedding and metadata), by adding the typed columns and deriving them from the stored bookmarks.
+
+    A table with a HNSW index cannot be altered, so the index must be dropped before a migration (see is_current).
+    """
+    column_types = _column_types()
+    columns = ",\n".join(f"{name} {column_type}" for name, column_type in column_types.items())
+
+    # the first columns mirror the layout created by langchain's DuckDBVectorStore
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+            id VARCHAR PRIMARY KEY,
+            text VARCHAR,
+            embedding FLOAT[],
+            metadata VARCHAR,
+            {columns}
+        )
+        """
+    )
+
+    missing = [name for name in column_types if name not in _columns(conn)]
+    if not missing:
+        return
+
+    logger.info(f"🔄 migrating the bookmark database (adding {', '.join(missing)})")
+
+    conn.begin()
+
+    for name in missing:
+        conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN {name} {column_types[name]}")
+
+    derived = [name for name in missing if name in BOOKMARK_COLUMNS]
+    if derived:
+        update_columns(conn, columns=derived)
+
+    for table in OBSOLETE_TABLES:
+        conn.execute(f"DROP SCHEMA IF EXISTS fts_main_{table} CASCADE")
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+    conn.commit()
+
+
+def insert(
+    conn: duckdb.DuckDBPyConnection,
+    ids: list[str],
+    texts: list[str],
+    embeddings: Union[list[list[float]], np.ndarray],
+    metadatas: list[dict],
+    embeddings_int8: Optional[np.ndarray] = None,
+    embeddings_candidate: Optional[np.ndarray] = None,
+):
+    """
+    Inserts bookmarks along with their typed columns, which are derived from the text and metadata by DuckDB.
+    The int8 and candidate embeddings are only given by the int8 storage mode, see quantization.py.
+    """
+    # DuckDB reads the rows of a registered DataFrame without converting every value into a python object first,
+    # which is many times faster than passing the embeddings as a (list) parameter
+    rows = pd.DataFrame(
+        {
+            "id": ids,
+            "text": texts,
+            "embedding": list(np.asarray(embeddings, dtype=np.float32)),
+            "metadata": [json.dumps(metadata) for metadata in metadatas],
+        }
+    )
+
+    vector_columns = []
+    for name, vectors in [("embedding_int8", embeddings_int8), ("embedding_candidate", embeddings_candidate)]:
+        if vectors is not None:
+            rows[name] = list(vectors)
+            vector_columns.append(name)
+
+    columns = ", ".join([*BOOKMARK_COLUMNS, *vector_columns])
+    expressions = ", ".join([*(expression for _, expression in BOOKMARK_COLUMNS.values()), *vector_columns])
+
+    conn.register(STAGED_ROWS_VIEW_NAME, rows)
+    try:
+        conn.execute(
+            f"""
+            INSERT INTO {TABLE_NAME} (id, text, embedding, metadata, {columns})
+            SELECT id, text, embedding, metadata, {expressions}
+            FROM {STAGED_ROWS_VIEW_NAME}
+            """
+        )
+    finally:
+        conn.unregister(STAGED_ROWS_VIEW_NAME)
+
+
+def update_columns(conn: duckdb.DuckDBPyConnection, where: str = "true", parameters: Optional[dict] = None, columns: Optional[list[str]] = None):
+    """
+    Derives the typed columns (all of them by default) again from the text and metadata of the bookmarks matching the filter.
+    """
+    assignments = ", ".join(f"{name} = {BOOKMARK_COLUMNS[name][1]}" for name in columns or BOOKMARK_COLUMNS)
+
+    conn.execute(f"UPDATE {TABLE_NAME} SET {assignments} WHERE {where}", parameters or {})
+
+
+def exists(conn: duckdb.DuckDBPyConnection) -> bool:
+    """
+    Whether the bookmark table exists, it is only created by the first 'bookworm sync'.
+    """
+    return bool(_columns(conn))
+
+
+def is_current(conn: duckdb.DuckDBPyConnection) -> bool:
+    """
+    Whether the bookmark table has every typed column, i.e it does not need to be migrated by ensure_table.
+    """
+    return set(_column_types()) <= _columns(conn)
+
+
+def _column_types() -> dict[str, str]:
+    return {**{name: column_type for name, (column_type, _) in BOOKMARK_COLUMNS.items()}, **VECTOR_COLUMNS}
+
+
+def _columns(conn: duckdb.DuckDBPyConnection) -> set[str]:
+    rows = conn.execute("SELECT column_name FROM information_schema.columns WHERE table_name = ?", [TABLE_NAME]).fetchall()
+    return {name for (name,) in rows}
@@ -0,0 +1,355 @@
+import os
+import json
+import logging
+from typing import Optional
+
+import duckdb
+from langchain_community.vectorstores.duckdb import SIMILARITY_ALIAS
+from langchain_core.documents import Document
+
+from bookworm_genai.metadata import Metadata
+from bookworm_genai.quantization import RESCORE_MULTIPLIER, reduce_dimensions
+from bookworm_genai.schema import TABLE_NAME
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "embeddings_hnsw_index"
+
+# how many candidates a search through the HNSW index explores, DuckDB's default of 64 only finds about 0.72 of the
+# exact top 10 on the clustered corpus of benchmarks/search_recall.py (20k x 256) while 512 finds 0.99, for ~2.5ms more
+HNSW_DEFAULT_EF_SEARCH = 512
+
+# the full text index is built over the title and url columns of the bookmark table (see schema.py)
+FTS_SCHEMA_NAME = f"fts_main_{TABLE_NAME}"
+KEYWORD_ALIAS = "keyword_score"
+
+# the default tokenizer drops digits, they are kept so that version numbers and ticket ids (e.g JIRA-1234) can be matched
+FTS_IGNORE = r"(\.|[^a-z0-9])+"
+
+# https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
+RRF_CONSTANT = 60
+RRF_ALIAS = "rrf_score"
+
+
+def load_vss(conn: duckdb.DuckDBPyConnection) -> bool:
+    """
+    Loads DuckDB's vss extension (which provides the HNSW index) into the connection, installing it if needed.
+    Returns False if the extension is not available, e.g the machine is offline and it was never installed.
+    """
+    return _load_extension(conn, "vss")
+
+
+def load_fts(conn: duckdb.DuckDBPyConnection) -> bool:
+    """
+    Loads DuckDB's fts extension (which provides the full text index) into the connection, see load_vss.
+    """
+    return _load_extension(conn, "fts")
+
+
+def _load_extension(conn: duckdb.DuckDBPyConnection, name: str) -> bool:
+    try:
+        conn.execute(f"LOAD {name}")
+    except duckdb.Error:
+        try:
+            conn.execute(f"INSTALL {name}")
+            conn.execute(f"LOAD {name}")
+        except duckdb.Error as e:
+            logger.debug(f"{name} extension could not be loaded: {e}")
+            return False
+
+    return True
+
+
+def has_index(conn: duckdb.DuckDBPyConnection) -> bool:
+    rows = conn.execute("SELECT index_name FROM duckdb_indexes() WHERE index_name = ?", [INDEX_NAME]).fetchall()
+    return bool(rows)
+
+
+def drop_index(conn: duckdb.DuckDBPyConnection):
+    # NOTE: a table with a HNSW index can only be modified when the vss extension is loaded,
+    # so the index is dropped (which does not need the extension) before the embeddings are modified and built again after
+    logger.debug(f"dropping vector index '{INDEX_NAME}' if exists")
+    conn.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+def create_index(conn: duckdb.DuckDBPyConnection) -> bool:
+    """
+    (Re)builds the HNSW index over the embeddings so that similarity searches do not have to scan every row. When the
+    embeddings have candidate vectors (see quantization.py) the index is built over those instead.
+
+    The index requires a fixed size embedding column so the column is converted from FLOAT[] to FLOAT[N] if needed.
+    Returns False if the index could not be built, in which case searches fall back to an exact search.
+    """
+    drop_index(conn)
+
+    column = "embedding" if stored_candidate_dimensions(conn) is None else "embedding_candidate"
+
+    row = conn.execute(f"SELECT len({column}) FROM {TABLE_NAME} LIMIT 1").fetchone()
+    if not row:
+        logger.debug("no embeddings stored, skipping vector index")
+        return False
+
+    if not load_vss(conn):
+        logger.warning("vector index could not be built as the DuckDB vss extension is not available, falling back to exact search")
+        return False
+
+    (dimensions,) = row
+    (column_type,) = conn.execute(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = ? AND column_name = ?",
+        [TABLE_NAME, column],
+    ).fetchone()
+
+    if column_type != f"FLOAT[{dimensions}]":
+        logger.debug(f"converting {column} column from {column_type} to FLOAT[{dimensions}]")
+        conn.execute(f"ALTER TABLE {TABLE_NAME} ALTER {column} TYPE FLOAT[{dimensions}]")
+
+    logger.debug(f"building vector index '{INDEX_NAME}' over {column}")
+
+    # https://duckdb.org/docs/extensions/vss.html#persistence
+    conn.execute("SET hnsw_enable_experimental_persistence = true")
+    conn.execute(f"CREATE INDEX {INDEX_NAME} ON {TABLE_NAME} USING HNSW ({column}) WITH (metric = 'cosine')")
+    conn.execute("CHECKPOINT")
+
+    return True
+
+
+def get_ef_search() -> int:
+    return int(os.environ.get("BOOKWORM_HNSW_EF_SEARCH", HNSW_DEFAULT_EF_SEARCH))
+
+
+def set_ef_search(conn: duckdb.DuckDBPyConnection, ef_search: Optional[int] = None):
+    """
+    Sets how many candidates the searches of the connection explore through the HNSW index, higher values trade latency for recall.
+    """
+    ef_search = ef_search if ef_search is not None else get_ef_search()
+
+    logger.debug(f"searching the vector index with hnsw_ef_search={ef_search}")
+    conn.execute(f"SET hnsw_ef_search = {int(ef_search)}")
+
+
+def stored_candidate_dimensions(conn: duckdb.DuckDBPyConnection) -> Optional[int]:
+    """
+    The size of the stored candidate vectors (see quantization.py), None when there are none and the index is built over
+    the full embeddings.
+    """
+    # tables created before the int8 storage mode (and the tables of the tests) have no candidate column
+    column = conn.execute("SELECT 1 FROM information_schema.columns WHERE table_name = ? AND column_name = 'embedding_candidate'", [TABLE_NAME]).fetchone()
+    if not column:
+        return None
+
+    row = conn.execute(f"SELECT len(embedding_candidate) FROM {TABLE_NAME} WHERE embedding_candidate IS NOT NULL LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def has_fts_index(conn: duckdb.DuckDBPyConnection) -> bool:
+    rows = conn.execute("SELECT schema_name FROM duckdb_schemas() WHERE schema_name = ?", [FTS_SCHEMA_NAME]).fetchall()
+    return bool(rows)
+
+
+def create_fts_index(conn: duckdb.DuckDBPyConnection) -> bool:
+    """
+    (Re)builds the full text (BM25) index over the title and url of every bookmark, which finds the exact words
+    (e.g library names, ticket ids and domains) that a similarity search can miss.
+
+    The index is not updated as bookmarks change so it is built again whenever the embeddings are modified.
+    Returns False if the index could not be built, in which case only similarity searches are used.
+    """
+    if not load_fts(conn):
+        logger.warning("keyword index could not be built as the DuckDB fts extension is not available, falling back to similarity search only")
+        return False
+
+    logger.debug(f"building keyword index over '{TABLE_NAME}'")
+
+    conn.execute(
+        f"PRAGMA create_fts_index('{TABLE_NAME}', 'id', 'title', 'url', stemmer = 'porter', stopwords = 'english', ignore = '{FTS_IGNORE}', overwrite = 1)"
+    )
+
+    return True
+
+
+def similarity_search(conn: duckdb.DuckDBPyConnection, embedding: list[float], k: int, use_index: bool = True) -> list[Document]:
+    """
+    Returns the k documents most similar to the embedding, ordered by their cosine similarity.
+
+    When use_index is set the search goes through the HNSW index (approximate), otherwise every row is compared (exact).
+    """
+    dimensions = len(embedding)
+
+    if use_index:
+        # this exact shape (ORDER BY array_cosine_distance ... LIMIT) is what DuckDB rewrites into a HNSW index scan
+        query = f"""
+            SELECT text, metadata, title, url, array_cosine_similarity(embedding, $embedding::FLOAT[{dimensions}]) AS {SIMILARITY_ALIAS}
+            FROM {TABLE_NAME}
+            ORDER BY array_cosine_distance(embedding, $embedding::FLOAT[{dimensions}])
+            LIMIT {int(k)}
+        """
+    else:
+        query = f"""
+            SELECT text, metadata, title, url, list_cosine_similarity(embedding::FLOAT[], $embedding::FLOAT[]) AS {SIMILARITY_ALIAS}
+            FROM {TABLE_NAME}
+            ORDER BY {SIMILARITY_ALIAS} DESC
+            LIMIT {int(k)}
+        """
+
+    rows = conn.execute(query, {"embedding": embedding}).fetchall()
+
+    return [_to_document(text, metadata, title, url, SIMILARITY_ALIAS, score) for text, metadata, title, url, score in rows]
+
+
+def quantized_search(
+    conn: duckdb.DuckDBPyConnection,
+    embedding: list[float],
+    k: int,
+    use_index: bool = True,
+    multiplier: int = RESCORE_MULTIPLIER,
+    candidate_dimensions: Optional[int] = None,
+) -> list[Document]:
+    """
+    Returns the k documents most similar to the embedding when the embeddings are also stored as int8 (see quantization.py).
+
+    The candidates (k * multiplier) are found through the HNSW index when use_index is set, which is built over the first
+    candidate_dimensions of the embeddings (or over the full embeddings when None). Otherwise the embedding is compared
+    against every int8 embedding (exact). The candidates are then rescored against their float32 embeddings.
+    """
+    limit = int(k * multiplier)
+    parameters = {"embedding": embedding}
+
+    if use_index:
+        # only the candidates found through the index are read from the table, float32 embeddings included
+        if candidate_dimensions is not None:
+            parameters["candidate"] = reduce_dimensions(embedding, candidate_dimensions).tolist()
+            order = f"array_cosine_distance(embedding_candidate, $candidate::FLOAT[{len(parameters['candidate'])}])"
+        else:
+            order = f"array_cosine_distance(embedding, $embedding::FLOAT[{len(embedding)}])"
+
+        candidates = f"SELECT text, metadata, title, url, embedding FROM {TABLE_NAME} ORDER BY {order} LIMIT {limit}"
+    else:
+        # the scan only reads the ids and int8 embeddings of every row, the rest is read for the candidates
+        candidates = f"""
+            SELECT text, metadata, title, url, embedding FROM {TABLE_NAME}
+            WHERE id IN (SELECT id FROM {TABLE_NAME} ORDER BY list_cosine_similarity(embedding_int8::FLOAT[], $embedding::FLOAT[]) DESC LIMIT {limit})
+        """
+
+    rows = conn.execute(
+        f"""
+        SELECT text, metadata, title, url, list_cosine_similarity(embedding::FLOAT[], $embedding::FLOAT[]) AS {SIMILARITY_ALIAS}
+        FROM ({candidates})
+        ORDER BY {SIMILARITY_ALIAS} DESC
+        LIMIT {int(k)}
+        """,
+        parameters,
+    ).fetchall()
+
+    return [_to_document(text, metadata, title, url, SIMILARITY_ALIAS, score) for text, metadata, title, url, score in rows]
+
+
+def batch_similarity_search(
+    conn: duckdb.DuckDBPyConnection, embeddings: list[list[float]], k: int, quantized: bool = False, multiplier: int = RESCORE_MULTIPLIER
+) -> list[list[Document]]:
+    """
+    Returns the k documents most similar to each of the embeddings, see similarity_search.
+
+    Every row is compared (exact) against all of the embeddings in a single query, which scans the table once rather
+    than once per embedding. The HNSW index only serves a single embedding at a time so it is not used. When quantized
+    is set the candidates (k * multiplier) are found by comparing the embeddings against every int8 embedding and then
+    rescored against their float32 embeddings (see quantized_search).
+    """
+    if not embeddings:
+        return []
+
+    queries = "SELECT unnest(range(len($embeddings))) AS query_index, unnest($embeddings::FLOAT[][]) AS embedding"
+
+    if quantized:
+        scored = f"""
+            WITH queries AS ({queries}), candidates AS (
+                SELECT queries.query_index, {TABLE_NAME}.id
+                FROM {TABLE_NAME}, queries
+                QUALIFY row_number() OVER (
+                    PARTITION BY query_index ORDER BY list_cosine_similarity({TABLE_NAME}.embedding_int8::FLOAT[], queries.embedding) DESC
+                ) <= {int(k * multiplier)}
+            )
+            SELECT candidates.query_index, text, metadata, title, url, list_cosine_similarity({TABLE_NAME}.embedding::FLOAT[], queries.embedding) AS {SIMILARITY_ALIAS}
+            FROM candidates
+            JOIN {TABLE_NAME} ON {TABLE_NAME}.id = candidates.id
+            JOIN queries ON queries.query_index = candidates.query_index
+        """
+    else:
+        scored = f"""
+            SELECT queries.query_index, text, metadata, title, url, list_cosine_similarity({TABLE_NAME}.embedding::FLOAT[], queries.embedding) AS {SIMILARITY_ALIAS}
+            FROM {TABLE_NAME}, ({queries}) AS queries
+        """
+
+    rows = conn.execute(
+        f"""
+        SELECT query_index, text, metadata, title, url, {SIMILARITY_ALIAS}
+        FROM ({scored})
+        QUALIFY row_number() OVER (PARTITION BY query_index ORDER BY {SIMILARITY_ALIAS} DESC) <= {int(k)}
+        ORDER BY query_index, {SIMILARITY_ALIAS} DESC
+        """,
+        {"embeddings": embeddings},
+    ).fetchall()
+
+    results: list[list[Document]] = [[] for _ in embeddings]
+    for query_index, text, metadata, title, url, score in rows:
+        results[query_index].append(_to_document(text, metadata, title, url, SIMILARITY_ALIAS, score))
+
+    return results
+
+
+def keyword_search(conn: duckdb.DuckDBPyConnection, query: str, k: int) -> list[Document]:
+    """
+    Returns the k documents whose title and url best match the words of the query, ordered by their BM25 score.
+    Requires the index built by create_fts_index.
+    """
+    rows = conn.execute(
+        f"""
+        SELECT text, metadata, title, url, score
+        FROM (
+            SELECT text, metadata, title, url, {FTS_SCHEMA_NAME}.match_bm25(id, $query) AS score
+            FROM {TABLE_NAME}
+        )
+        WHERE score IS NOT NULL
+        ORDER BY score DESC
+        LIMIT {int(k)}
+        """,
+        {"query": query},
+    ).fetchall()
+
+    return [_to_document(text, metadata, title, url, KEYWORD_ALIAS, score) for text, metadata, title, url, score in rows]
+
+
+def reciprocal_rank_fusion(rankings: list[list[Document]], k: int, constant: int = RRF_CONSTANT) -> list[Document]:
+    """
+    Fuses the rankings of several searches into the k best documents.
+
+    Each document scores 1 / (constant + rank) for every ranking it appears in, so documents ranked highly by either
+    search (or found by both) come first without the scores of the searches (which are not comparable) being mixed.
+    A document found by both keeps the scores of each along with the fused score.
+    """
+    scores: dict[tuple[str, str], float] = {}
+    docs: dict[tuple[str, str], Document] = {}
+
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            key = (doc.page_content, doc.metadata.get(Metadata.Browser.value))
+            scores[key] = scores.get(key, 0.0) + 1 / (constant + rank)
+
+            if key in docs:
+                docs[key].metadata.update(doc.metadata)
+            else:
+                docs[key] = doc
+
+    fused = sorted(scores, key=scores.get, reverse=True)[:k]
+    for key in fused:
+        docs[key].metadata[f"_{RRF_ALIAS}"] = scores[key]
+
+    return [docs[key] for key in fused]
+
+
+def _to_document(text: str, metadata: str, title: Optional[str], url: Optional[str], alias: str, score: float) -> Document:
+    # mirrors the documents returned by langchain's DuckDBVectorStore.similarity_search, along with the title and url
+    # columns of the bookmark so that they do not have to be parsed from the text again
+    return Document(
+        page_content=text,
+        metadata={**(json.loads(metadata) if metadata else {}), Metadata.Title.value: title, Metadata.URL.value: url, f"_{alias}": score},
+    )
@@ -1,49 +1,807 @@
 import os
+import json
 import duckdb
+import hashlib
 import logging
+from enum import Enum
+from dataclasses import dataclass
+from typing import Iterable, Optional
 
-from platformdirs import PlatformDirs
-from langchain_community.vectorstores import DuckDB as DuckDBVectorStore
-from langchain_community.vectorstores.duckdb import DEFAULT_TABLE_NAME
 from langchain_core.documents import Document
 from langchain_core.embeddings.embeddings import Embeddings
 from langchain_openai.embeddings import OpenAIEmbeddings
 
+from bookworm_genai import manifest, profiling, schema
+from bookworm_genai.cache import CachedEmbeddings, CachedQueryEmbeddings, _text_hash, cached_text_hashes
+from bookworm_genai.embeddings import ConcurrentEmbeddings
+from bookworm_genai.loaders import BookmarkDelta
+from bookworm_genai.local_embeddings import HashingEmbeddings
+from bookworm_genai.dedup import document_url, normalize_url
+from bookworm_genai.manifest import SourceFingerprint
+from bookworm_genai.metadata import Metadata
+from bookworm_genai.paths import _get_local_store, _get_query_cache_store
+from bookworm_genai.quantization import candidate_dimensions, quantize
+from bookworm_genai.schema import TABLE_NAME
+from bookworm_genai.search import create_fts_index, create_index, drop_index, has_fts_index, has_index
+from bookworm_genai.utils import chunked
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_CHUNK_SIZE = 1_000
+STAGING_TABLE_NAME = "sync_staging"
+
+
+class EmbeddingBackend(str, Enum):
+    """
+    The services which can embed bookmarks, selected with the BOOKWORM_EMBEDDING_BACKEND environment variable.
+    """
+
+    OPENAI = "openai"
+    LOCAL = "local"
+
+    @classmethod
+    def list(cls):
+        return list(map(lambda c: c.value, cls))
+
+
+class EmbeddingStorage(str, Enum):
+    """
+    How the embeddings are stored, selected with the BOOKWORM_EMBEDDING_STORAGE environment variable.
+
+    float32 keeps every embedding as it was returned by the embeddings service. int8 also keeps every embedding quantized to
+    int8 (and its first dimensions, when the model allows it) to find candidates with, which are then rescored against the
+    float32 embeddings, see quantization.py.
+    """
+
+    FLOAT32 = "float32"
+    INT8 = "int8"
+
+    @classmethod
+    def list(cls):
+        return list(map(lambda c: c.value, cls))
+
+
+@dataclass
+class StoreResult:
+    """
+    Summary of the changes applied to the vector store by a single sync.
+
+    Rows are keyed by a hash of the browser and the bookmark content, so a bookmark that changed
+    in the browser is counted once as added (the new content) and once as removed (the stale content).
+    """
+
+    added: int = 0
+    removed: int = 0
+    unchanged: int = 0
+
+
+def store_documents(docs: Iterable[Document], browsers: Optional[list[str]] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> StoreResult:
+    """
+    Incrementally syncs the given documents into the vector store, see SyncSession.
+    """
+    with SyncSession() as session:
+        if browsers is not None:
+            session.scope(browsers)
+
+        for chunk in chunked(docs, chunk_size):
+            session.add(chunk)
+
+        return session.finish(browsers)
+
+
+class SyncSession:
+    """
+    Incrementally syncs documents into the vector store one chunk at a time.
+
+    Every chunk is staged (without its content) into a temporary table, which is used to deduplicate documents pointing
+    at the same URL and to track which documents were seen. Only the first document seen for a URL which is not already
+    stored is embedded and it is committed along with its chunk, so memory is bounded by the chunk size and the rows
+    are queryable as soon as the chunk commits.
+
+    Once every chunk has been added, finish() records the provenance (every browser and source which held the URL) on each
+    document, removes stored documents of the synced browsers which were not seen and rebuilds the vector and keyword indexes.
+    The provenance of browsers which were not fully loaded is kept as it was stored, and a document whose browser no longer
+    holds its URL is handed over to one of the other browsers which still do rather than removed.
+
+    The session also tracks the source file of each browser in a manifest so that browsers whose bookmarks have not changed
+    since their last sync do not need to be loaded at all.
+
+    Every document records the embedding backend which produced its vector and how the vector is stored. Vectors of different
+    backends (or storage modes) cannot be compared, so when either changes every stored document is removed and the manifest
+    is cleared so that all the bookmarks are embedded again (vectors of the same backend are then served by the embedding cache).
+    """
+
+    def __init__(self):
+        self.result = StoreResult()
+
+        self._path = _get_local_store()
+        self._backend = _get_embedding_backend()
+        self._storage = _get_embedding_storage()
+        if self._storage == EmbeddingStorage.INT8:
+            model = _get_embedding_model(self._backend)
+
+            # the index would be built over every float32 dimension and the int8 embeddings would only add to the database
+            if candidate_dimensions(model) is None:
+                logger.warning(
+                    f"⚠️ BOOKWORM_EMBEDDING_STORAGE=int8 only makes the database smaller for models whose embeddings can be truncated "
+                    f"(e.g text-embedding-3-small), the embeddings of {model} are stored as float32"
+                )
+                self._storage = EmbeddingStorage.FLOAT32
+
+        self._conn: Optional[duckdb.DuckDBPyConnection] = None
+        self._embeddings: Optional[Embeddings] = None
+        self._model: Optional[str] = None
+        self._concurrent_embeddings: Optional[ConcurrentEmbeddings] = None
+        self._browsers: list[str] = []
+        self._scope: Optional[list[str]] = None
+        self._seq = 0
+        self._modified = False
+
+    def __enter__(self):
+        logger.debug(f"storing into {self._path}")
+
+        self._conn = duckdb.connect(self._path)
+
+        if not schema.is_current(self._conn):
+            self._drop_index()
+
+        schema.ensure_table(self._conn)
+        manifest.ensure_table(self._conn)
+
+        stored = _stored_embedding_backends(self._conn)
+        if stored and stored != [self._backend]:
+            logger.warning(f"bookmarks were embedded with {', '.join(stored)}, embedding every bookmark again with {self._backend.value}")
+            self._clear()
+
+        stored = _stored_embedding_storages(self._conn)
+        if stored and stored != [self._storage]:
+            logger.warning(f"embeddings were stored as {', '.join(stored)}, storing every embedding again as {self._storage.value}")
+            self._clear()
+
+        self._conn.execute(
+            f"""
+            CREATE TEMP TABLE {STAGING_TABLE_NAME} (
+                seq BIGINT,
+                id VARCHAR,
+                key VARCHAR,
+                browser VARCHAR,
+                source VARCHAR,
+                metadata VARCHAR,
+                deferred BOOLEAN DEFAULT false
+            )
+            """
+        )
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._concurrent_embeddings is not None:
+            self._concurrent_embeddings.close()
+
+        self._conn.close()
+
+    def is_unchanged(self, browser: str, source: SourceFingerprint) -> bool:
+        """
+        Whether the source of the browser is unchanged since its last successful sync, in which case it does not need to be loaded.
+        """
+        return manifest.is_unchanged(self._conn, browser, source)
+
+    def watermark(self, browser: str) -> Optional[int]:
+        """
+        The watermark recorded by the last sync of the browser, see BookmarkDelta.
+        """
+        return manifest.watermark(self._conn, browser)
+
+    def scope(self, browsers: list[str]):
+        """
+        Scopes the session to the given browsers, the stored documents of every other browser are left as they are
+        (e.g they were filtered out, their source has not changed or only their changes are loaded). Documents pointing
+        at a URL which a document of another browser already holds are not stored again.
+        """
+        self._scope = list(browsers)
+
+        self._conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE {STAGING_TABLE_NAME}_kept AS
+            SELECT DISTINCT normalized_url AS key, browser
+            FROM {TABLE_NAME}
+            WHERE browser NOT IN (SELECT unnest($browsers::VARCHAR[]))
+            AND normalized_url IS NOT NULL
+            """,
+            {"browsers": self._scope},
+        )
+
+    def add(self, docs: list[Document]):
+        if not docs:
+            return
+
+        first_seq = self._seq
+        self._seq += len(docs)
+
+        ids = [_document_id(doc) for doc in docs]
+        keys = []
+
+        for doc, doc_id in zip(docs, ids):
+            doc.metadata[Metadata.EmbeddingBackend.value] = self._backend.value
+            doc.metadata[Metadata.EmbeddingStorage.value] = self._storage.value
+
+            browser = doc.metadata.get(Metadata.Browser.value)
+            if browser is not None and browser not in self._browsers:
+                self._browsers.append(browser)
+
+            # the provenance of a url held by a single browser, which finish() then does not need to rewrite
+            source = doc.metadata.get("source")
+            doc.metadata.setdefault(Metadata.Browsers.value, [browser] if browser is not None else [])
+            doc.metadata.setdefault(Metadata.Sources.value, [source] if source is not None else [])
+
+            url = document_url(doc)
+            if url:
+                key = normalize_url(url)
+                doc.metadata[Metadata.NormalizedURL.value] = key
+            else:
+                key = f"id:{doc_id}"
+
+            keys.append(key)
+
+        with profiling.span("deduplicate"):
+            new_seqs = self._stage(docs, ids, keys, first_seq)
+
+        new_docs = [docs[seq - first_seq] for seq in new_seqs]
+        new_ids = [ids[seq - first_seq] for seq in new_seqs]
+
+        if new_docs:
+            logger.debug(f"vectorizing and storing {len(new_docs)} new documents")
+
+            # embedded before the transaction begins so that a failure to embed does not hold it open
+            with profiling.span("embed"):
+                embeddings = self._get_embeddings().embed_documents([doc.page_content for doc in new_docs])
+
+            embeddings_int8 = embeddings_candidate = None
+            if self._storage == EmbeddingStorage.INT8:
+                with profiling.span("quantize"):
+                    embeddings_candidate, embeddings_int8 = quantize(embeddings, candidate_dimensions(self._model))
+
+            self._drop_index()
+
+            with profiling.span("insert"):
+                self._conn.begin()
+                schema.insert(
+                    self._conn,
+                    new_ids,
+                    [doc.page_content for doc in new_docs],
+                    embeddings,
+                    [doc.metadata for doc in new_docs],
+                    embeddings_int8,
+                    embeddings_candidate,
+                )
+                self._conn.commit()
+
+            self.result.added += len(new_docs)
+
+    def _stage(self, docs: list[Document], ids: list[str], keys: list[str], first_seq: int) -> list[int]:
+        """
+        Stages the chunk and returns the seq of each document which is the first to be seen for its key (url) and is not stored yet.
+        """
+        self._conn.execute(
+            f"""
+            INSERT INTO {STAGING_TABLE_NAME} (seq, id, key, browser, source, metadata)
+            SELECT unnest(?::BIGINT[]), unnest(?::VARCHAR[]), unnest(?::VARCHAR[]), unnest(?::VARCHAR[]), unnest(?::VARCHAR[]), unnest(?::VARCHAR[])
+            """,
+            [
+                list(range(first_seq, self._seq)),
+                ids,
+                keys,
+                [doc.metadata.get(Metadata.Browser.value) for doc in docs],
+                [doc.metadata.get("source") for doc in docs],
+                [json.dumps(doc.metadata) for doc in docs],
+            ],
+        )
+
+        if self._scope is not None:
+            # documents whose url is already held by a stored document of another browser which is kept
+            self._conn.execute(
+                f"""
+                UPDATE {STAGING_TABLE_NAME} SET deferred = true
+                WHERE seq >= $first_seq
+                AND EXISTS (
+                    SELECT 1 FROM {STAGING_TABLE_NAME}_kept AS kept
+                    WHERE kept.key = {STAGING_TABLE_NAME}.key AND kept.browser IS DISTINCT FROM {STAGING_TABLE_NAME}.browser
+                )
+                """,
+                {"first_seq": first_seq},
+            )
+
+        # documents that are the first to be seen for their key (url) and are not stored yet
+        rows = self._conn.execute(
+            f"""
+            SELECT first_seq FROM (
+                SELECT min(seq) AS first_seq
+                FROM {STAGING_TABLE_NAME}
+                WHERE key IN (SELECT key FROM {STAGING_TABLE_NAME} WHERE seq >= $first_seq)
+                AND NOT deferred
+                GROUP BY key
+            )
+            WHERE first_seq >= $first_seq
+            AND first_seq NOT IN (SELECT seq FROM {STAGING_TABLE_NAME} WHERE seq >= $first_seq AND id IN (SELECT id FROM {TABLE_NAME}))
+            ORDER BY first_seq
+            """,
+            {"first_seq": first_seq},
+        ).fetchall()
+
+        return [seq for (seq,) in rows]
+
+    def finish(
+        self,
+        browsers: Optional[list[str]] = None,
+        sources: Optional[dict[str, SourceFingerprint]] = None,
+        deltas: Optional[dict[str, BookmarkDelta]] = None,
+    ) -> StoreResult:
+        """
+        Completes the sync. Removal of documents which were not seen is scoped to the given browsers (or the browsers
+        found in the documents) so that syncing a subset of browsers does not wipe the bookmarks of the others.
+
+        Browsers which only loaded their changes pass a partial delta instead, their documents are removed if the bookmark
+        no longer exists or if it changed and was not seen. The given sources and deltas (keyed by browser) are recorded
+        into the manifest as synced.
+        """
+        if browsers is None:
+            browsers = self._browsers
+
+        deltas = deltas or {}
+        partial = {browser: delta for browser, delta in deltas.items() if delta.changed is not None}
+
+        self._conn.execute(f"CREATE OR REPLACE TEMP TABLE {STAGING_TABLE_NAME}_deltas (browser VARCHAR, item_id VARCHAR, changed BOOLEAN)")
+        for browser, delta in partial.items():
+            changed = set(delta.changed)
+            self._conn.execute(
+                f"INSERT INTO {STAGING_TABLE_NAME}_deltas SELECT $browser, unnest($ids::VARCHAR[]), unnest($changed::BOOLEAN[])",
+                {"browser": browser, "ids": delta.ids, "changed": [item_id in changed for item_id in delta.ids]},
+            )
+
+        # the provenance of every key: the browsers and sources which held it in this sync (in the order they were seen) and the
+        # stored ones of the browsers which were not fully loaded, which still hold it as far as this sync knows
+        self._conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE {STAGING_TABLE_NAME}_provenance AS
+            WITH staged_browsers AS (
+                SELECT key, list(browser ORDER BY seq) AS browsers
+                FROM (SELECT key, browser, min(seq) AS seq FROM {STAGING_TABLE_NAME} WHERE browser IS NOT NULL GROUP BY key, browser)
+                GROUP BY key
+            ),
+            staged_sources AS (
+                SELECT key, list(source ORDER BY seq) AS sources
+                FROM (SELECT key, source, min(seq) AS seq FROM {STAGING_TABLE_NAME} WHERE source IS NOT NULL GROUP BY key, source)
+                GROUP BY key
+            ),
+            stored AS (
+                SELECT coalesce(normalized_url, 'id:' || id) AS key, browsers, sources FROM {TABLE_NAME}
+            ),
+            stored_browsers AS (
+                SELECT key, list(browser ORDER BY position) AS browsers
+                FROM (
+                    SELECT key, browser, min(position) AS position
+                    FROM (SELECT key, unnest(browsers) AS browser, generate_subscripts(browsers, 1) AS position FROM stored)
+                    WHERE browser NOT IN (SELECT unnest($loaded::VARCHAR[]))
+                    GROUP BY key, browser
+                )
+                GROUP BY key
+            ),
+            loaded_sources AS (
+                SELECT source FROM {STAGING_TABLE_NAME} WHERE browser IN (SELECT unnest($loaded::VARCHAR[])) AND source IS NOT NULL
+                UNION SELECT source FROM {TABLE_NAME} WHERE browser IN (SELECT unnest($loaded::VARCHAR[])) AND source IS NOT NULL
+                UNION SELECT unnest($loaded_paths::VARCHAR[])
+            ),
+            stored_sources AS (
+                SELECT key, list(source ORDER BY position) AS sources
+                FROM (
+                    SELECT key, source, min(position) AS position
+                    FROM (SELECT key, unnest(sources) AS source, generate_subscripts(sources, 1) AS position FROM stored)
+                    WHERE source NOT IN (SELECT source FROM loaded_sources)
+                    GROUP BY key, source
+                )
+                GROUP BY key
+            )
+            SELECT
+                key,
+                coalesce(staged_browsers.browsers, []) AS staged_browsers,
+                coalesce(staged_sources.sources, []) AS staged_sources,
+                coalesce(stored_browsers.browsers, []) AS stored_browsers,
+                coalesce(stored_sources.sources, []) AS stored_sources
+            FROM staged_browsers
+            FULL JOIN staged_sources USING (key)
+            FULL JOIN stored_browsers USING (key)
+            FULL JOIN stored_sources USING (key)
+            """,
+            {"loaded": browsers, "loaded_paths": [source.path for browser, source in (sources or {}).items() if browser in browsers]},
+        )
+
+        # one row per key with the document that represents it and its provenance
+        self._conn.execute(
+            f"""
+            CREATE TEMP TABLE {STAGING_TABLE_NAME}_representatives AS
+            WITH representatives AS (
+                SELECT key, arg_min(id, seq) AS id, arg_min(metadata, seq) AS metadata
+                FROM {STAGING_TABLE_NAME}
+                WHERE NOT deferred
+                GROUP BY key
+            )
+            SELECT
+                representatives.key,
+                representatives.id,
+                {_provenance_patch("representatives.metadata", _merge_lists("staged_browsers", "stored_browsers"), _merge_lists("staged_sources", "stored_sources"))}
+                AS metadata
+            FROM representatives
+            JOIN {STAGING_TABLE_NAME}_provenance AS provenance USING (key)
+            """
+        )
 
-def store_documents(docs: list[Document]):
-    full_database_path = _get_local_store()
+        # documents deferred to a stored document of another browser count as unchanged
+        (total,) = self._conn.execute(f"SELECT COUNT(DISTINCT key) FROM {STAGING_TABLE_NAME}").fetchone()
+        self.result.unchanged = total - self.result.added
 
-    embeddings = _get_embedding_store()
+        # bookmarks of partially loaded browsers are matched on the id within their content (e.g the Firefox place id)
+        removed_filter = f"""
+            id NOT IN (SELECT id FROM {STAGING_TABLE_NAME}_representatives)
+            AND (
+                browser IN (SELECT unnest($browsers::VARCHAR[]))
+                OR (
+                    browser IN (SELECT unnest($partial::VARCHAR[]))
+                    AND NOT EXISTS (
+                        SELECT 1 FROM {STAGING_TABLE_NAME}_deltas AS deltas
+                        WHERE deltas.browser = {TABLE_NAME}.browser
+                        AND deltas.item_id = CASE WHEN json_valid(text) THEN json_extract_string(text, '$.id') END
+                        AND NOT deltas.changed
+                    )
+                )
+            )
+        """
+        parameters = {"browsers": browsers, "partial": list(partial)}
 
-    logger.info(f"vectorizing and storing {len(docs)} documents locally")
-    logger.debug(f"storing into {full_database_path}")
+        # a document which is removed can be the only stored copy of a URL which other browsers still hold (they were not loaded
+        # or their copy was deferred to it), it is handed over to the first of them rather than removed. Its content is still the
+        # one of the removed browser, so those browsers are loaded again on the next sync to store their own copy (see below)
+        self._conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE {STAGING_TABLE_NAME}_promoted AS
+            WITH removed AS (
+                SELECT id, coalesce(normalized_url, 'id:' || id) AS key, browser, source, metadata
+                FROM {TABLE_NAME} WHERE {removed_filter}
+            ),
+            candidates AS (
+                SELECT
+                    removed.id,
+                    removed.metadata,
+                    list_filter({_merge_lists("staged_browsers", "stored_browsers")}, item -> item IS DISTINCT FROM removed.browser) AS browsers,
+                    list_filter({_merge_lists("staged_sources", "stored_sources")}, item -> item IS DISTINCT FROM removed.source) AS sources
+                FROM removed
+                JOIN {STAGING_TABLE_NAME}_provenance AS provenance USING (key)
+                WHERE key NOT IN (SELECT key FROM {STAGING_TABLE_NAME}_representatives)
+                AND NOT EXISTS (
+                    SELECT 1 FROM {TABLE_NAME} AS kept
+                    WHERE coalesce(kept.normalized_url, 'id:' || kept.id) = removed.key
+                    AND kept.id NOT IN (SELECT id FROM removed)
+                )
+                QUALIFY row_number() OVER (PARTITION BY key ORDER BY removed.id) = 1
+            )
+            SELECT
+                id,
+                json_merge_patch(
+                    {_provenance_patch("metadata", "browsers", "sources")},
+                    json_object('{Metadata.Browser.value}', browsers[1], 'source', sources[1])
+                ) AS metadata
+            FROM candidates
+            WHERE len(browsers) > 0
+            """,
+            parameters,
+        )
 
-    with duckdb.connect(full_database_path) as conn:
-        logger.debug(f"dropping existing embeddings table '{DEFAULT_TABLE_NAME}' if exists")
-        conn.execute(f"DROP TABLE IF EXISTS {DEFAULT_TABLE_NAME}")
+        (promoted,) = self._conn.execute(f"SELECT COUNT(*) FROM {STAGING_TABLE_NAME}_promoted").fetchone()
 
-        logger.debug(f"loading {len(docs)} documents")
-        DuckDBVectorStore.from_documents(docs, embeddings, connection=conn)
+        removed_filter += f" AND id NOT IN (SELECT id FROM {STAGING_TABLE_NAME}_promoted)"
+        (removed,) = self._conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE {removed_filter}", parameters).fetchone()
 
+        # every other document keeps the provenance of the browsers which were not fully loaded, along with the loaded browsers
+        # which still hold its URL (e.g their copy was deferred to it)
+        self._conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE {STAGING_TABLE_NAME}_kept_provenance AS
+            SELECT id, {_provenance_patch("metadata", "new_browsers", "new_sources")} AS metadata
+            FROM (
+                SELECT
+                    id,
+                    metadata,
+                    browsers,
+                    sources,
+                    {_merge_lists("stored_browsers", "staged_browsers")} AS new_browsers,
+                    {_merge_lists("stored_sources", "staged_sources")} AS new_sources
+                FROM {TABLE_NAME}
+                JOIN {STAGING_TABLE_NAME}_provenance AS provenance ON provenance.key = coalesce(normalized_url, 'id:' || id)
+                WHERE id NOT IN (SELECT id FROM {STAGING_TABLE_NAME}_representatives)
+                AND id NOT IN (SELECT id FROM {STAGING_TABLE_NAME}_promoted)
+                AND NOT ({removed_filter})
+            )
+            WHERE browsers IS DISTINCT FROM new_browsers OR sources IS DISTINCT FROM new_sources
+            """,
+            parameters,
+        )
 
-def _get_local_store() -> str:
-    appdirs = PlatformDirs("bookworm", "bookworm")
-    database_name = "bookmarks.duckdb"
-    full_database_path = os.path.join(appdirs.user_data_dir, database_name)
+        (stale,) = self._conn.execute(
+            f"""
+            SELECT COUNT(*) FROM (
+                SELECT id, metadata FROM {STAGING_TABLE_NAME}_representatives
+                UNION ALL SELECT id, metadata FROM {STAGING_TABLE_NAME}_promoted
+                UNION ALL SELECT id, metadata FROM {STAGING_TABLE_NAME}_kept_provenance
+            ) AS updates
+            JOIN {TABLE_NAME} USING (id)
+            WHERE NOT {_same_metadata(f"{TABLE_NAME}.metadata", "updates.metadata")}
+            """
+        ).fetchone()
 
-    logger.debug(f"creating folder {appdirs.user_data_dir}")
-    os.makedirs(appdirs.user_data_dir, exist_ok=True)
+        if stale or removed:
+            self._drop_index()
 
-    return full_database_path
+        self._conn.begin()
 
+        if stale:
+            # unchanged documents can still have new provenance (e.g the same url was bookmarked in another browser)
+            # so refresh their metadata and the columns derived from it, this does not require them to be embedded again
+            logger.debug(f"updating metadata of {stale} documents in '{TABLE_NAME}'")
+            updated = self._conn.execute(
+                f"""
+                UPDATE {TABLE_NAME} SET metadata = updates.metadata
+                FROM (
+                    SELECT id, metadata FROM {STAGING_TABLE_NAME}_representatives
+                    UNION ALL SELECT id, metadata FROM {STAGING_TABLE_NAME}_promoted
+                    UNION ALL SELECT id, metadata FROM {STAGING_TABLE_NAME}_kept_provenance
+                ) AS updates
+                WHERE {TABLE_NAME}.id = updates.id
+                AND NOT {_same_metadata(f"{TABLE_NAME}.metadata", "updates.metadata")}
+                RETURNING {TABLE_NAME}.id
+                """
+            ).fetchall()
+            schema.update_columns(self._conn, "id IN (SELECT unnest($ids::VARCHAR[]))", {"ids": [doc_id for (doc_id,) in updated]})
+
+        if promoted:
+            # the browsers a document was handed over to hold it with content (and an id) of their own, which they store
+            # when they are loaded again
+            (orphaned,) = self._conn.execute(
+                f"SELECT list(DISTINCT browser) FROM {TABLE_NAME} WHERE id IN (SELECT id FROM {STAGING_TABLE_NAME}_promoted)"
+            ).fetchone()
+
+            logger.debug(f"{promoted} documents were handed over to browsers {orphaned}, which will be loaded again on the next sync")
+            manifest.invalidate(self._conn, orphaned)
+
+        if removed:
+            logger.debug(f"removing {removed} documents from '{TABLE_NAME}'")
+            self._conn.execute(f"DELETE FROM {TABLE_NAME} WHERE {removed_filter}", parameters)
+
+        for browser, source in (sources or {}).items():
+            delta = deltas.get(browser)
+            manifest.record(self._conn, browser, source, watermark=delta.watermark if delta else None)
+
+        self.result.removed = removed
+
+        for table in ("representatives", "deltas", "provenance", "promoted", "kept_provenance"):
+            self._conn.execute(f"DROP TABLE {STAGING_TABLE_NAME}_{table}")
+        self._conn.commit()
+
+        self.build_indexes()
+
+        logger.info(f"sync complete: {self.result.added} added, {self.result.removed} removed, {self.result.unchanged} unchanged")
+
+        return self.result
+
+    def build_indexes(self):
+        """
+        Builds the vector and keyword indexes if the embeddings were modified by the session or if they do not exist yet
+        (e.g the store was created by an older version).
+        """
+        if self._modified or not has_index(self._conn):
+            logger.debug("building vector index")
+            with profiling.span("vector index"):
+                create_index(self._conn)
+
+        if self._modified or not has_fts_index(self._conn):
+            logger.debug("building keyword index")
+            with profiling.span("keyword index"):
+                create_fts_index(self._conn)
+
+    def _get_embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            embeddings = _get_embedding_store(self._backend)
+            self._model = getattr(embeddings, "model", None)
+
+            if self._backend != EmbeddingBackend.LOCAL:
+                # cache misses are embedded concurrently, cache hits never reach the embeddings service
+                # local embeddings are computed faster than they could be looked up so they are neither cached nor batched
+                self._concurrent_embeddings = ConcurrentEmbeddings(embeddings)
+                embeddings = CachedEmbeddings(self._concurrent_embeddings, self._conn)
+
+            self._embeddings = embeddings
+
+        return self._embeddings
+
+    def _clear(self):
+        # the table is created again rather than emptied as the index fixes the size of the embedding column (see create_index)
+        # and the new embeddings can have a different size
+        self._drop_index()
+        self._conn.execute(f"DROP TABLE {TABLE_NAME}")
+        schema.ensure_table(self._conn)
+
+        manifest.clear(self._conn)
+
+    def _drop_index(self):
+        # NOTE: this must happen outside of a transaction, a table with a HNSW index cannot be modified without the vss
+        # extension until the drop has been committed
+        if not self._modified:
+            drop_index(self._conn)
+            self._modified = True
+
+
+def unsent_documents(docs: list[Document], browsers: list[str], embeddings: Embeddings) -> list[Document]:
+    """
+    The documents which a sync of the given browsers would send to the embeddings service, i.e those which are not stored
+    yet (nor point at a URL stored for a browser which is not synced) and whose embedding is not cached.
+
+    The store is only read, the documents are expected to be deduplicated already.
+    """
+    path = _get_local_store()
+    if not docs or not os.path.exists(path):
+        return docs
+
+    ids = [_document_id(doc) for doc in docs]
+    keys = [normalize_url(url) if (url := document_url(doc)) else None for doc in docs]
+    hashes = [_text_hash(doc.page_content) for doc in docs]
+
+    with duckdb.connect(path, read_only=True) as conn:
+        stored_ids: set[str] = set()
+        stored_keys: set[str] = set()
+
+        # stored documents are removed when the embedding backend changes (see SyncSession), only the cache is used then
+        if schema.is_current(conn) and _stored_embedding_backends(conn) == [_get_embedding_backend()]:
+            rows = conn.execute(f"SELECT id FROM {TABLE_NAME} WHERE id IN (SELECT unnest(?::VARCHAR[]))", [ids]).fetchall()
+            stored_ids = {doc_id for (doc_id,) in rows}
+
+            rows = conn.execute(
+                f"""
+                SELECT DISTINCT normalized_url FROM {TABLE_NAME}
+                WHERE normalized_url IN (SELECT unnest(?::VARCHAR[]))
+                AND browser NOT IN (SELECT unnest(?::VARCHAR[]))
+                """,
+                [[key for key in keys if key is not None], browsers],
+            ).fetchall()
+            stored_keys = {key for (key,) in rows}
+
+        stored = [doc_id in stored_ids or key in stored_keys for doc_id, key in zip(ids, keys)]
+        cached = cached_text_hashes(conn, embeddings, [text_hash for text_hash, is_stored in zip(hashes, stored) if not is_stored])
+
+    unsent = [doc for doc, text_hash, is_stored in zip(docs, hashes, stored) if not is_stored and text_hash not in cached]
+    logger.debug(f"{len(docs) - len(unsent)} of {len(docs)} documents are stored or cached already")
+
+    return unsent
+
+
+def _merge_lists(first: str, second: str) -> str:
+    # the items of the first list followed by the items of the second which are not in the first, in their order
+    return f"list_concat({first}, list_filter({second}, item -> NOT list_contains({first}, item)))"
+
+
+def _provenance_patch(metadata: str, browsers: str, sources: str) -> str:
+    return f"""json_merge_patch(
+        {metadata},
+        json_object('{Metadata.Browsers.value}', to_json({browsers}), '{Metadata.Sources.value}', to_json({sources}))
+    )"""
+
+
+def _same_metadata(first: str, second: str) -> str:
+    # metadata serialized by python and by DuckDB (e.g json_merge_patch) differs in the order of its keys and its whitespace
+    def items(metadata: str) -> str:
+        return f"""list_sort(list_transform(json_keys({metadata}), key -> key || '=' || json_extract({metadata}, '$."' || key || '"')::VARCHAR))"""
+
+    return f"{items(first)} IS NOT DISTINCT FROM {items(second)}"
+
+
+def _document_id(doc: Document) -> str:
+    """
+    Stable identifier for a document derived from the browser it came from, the name and url of the bookmark and the folder
+    it lives in. If any of them changes then the document is treated as a new one.
+
+    The rest of the content is left out as it changes without the bookmark changing, e.g Chromium records when a bookmark
+    was last opened (date_last_used, meta_info) in the same node, which would otherwise embed it again after every visit.
+    """
+    browser = doc.metadata.get(Metadata.Browser.value, "")
+
+    try:
+        content = json.loads(doc.page_content)
+    except ValueError:
+        content = None
+
+    if isinstance(content, dict):
+        parts = [content.get("name") or "", content.get("url") or "", doc.metadata.get("folder") or ""]
+    else:
+        parts = [doc.page_content]
+
+    digest = hashlib.sha256()
+    digest.update(browser.encode("utf-8"))
+
+    for part in parts:
+        digest.update(b"\x00")
+        digest.update(part.encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def _get_embedding_backend() -> EmbeddingBackend:
+    backend = os.environ.get("BOOKWORM_EMBEDDING_BACKEND", EmbeddingBackend.OPENAI.value)
+
+    try:
+        return EmbeddingBackend(backend.lower())
+    except ValueError:
+        raise ValueError(f"Unknown embedding backend '{backend}' in BOOKWORM_EMBEDDING_BACKEND, expected one of {EmbeddingBackend.list()}") from None
+
+
+def _stored_embedding_backends(conn: duckdb.DuckDBPyConnection) -> list[EmbeddingBackend]:
+    rows = conn.execute(f"SELECT DISTINCT embedding_backend FROM {TABLE_NAME}").fetchall()
+
+    return sorted(EmbeddingBackend(backend) for (backend,) in rows)
+
+
+def _get_embedding_storage() -> EmbeddingStorage:
+    storage = os.environ.get("BOOKWORM_EMBEDDING_STORAGE", EmbeddingStorage.FLOAT32.value)
+
+    try:
+        return EmbeddingStorage(storage.lower())
+    except ValueError:
+        raise ValueError(f"Unknown embedding storage '{storage}' in BOOKWORM_EMBEDDING_STORAGE, expected one of {EmbeddingStorage.list()}") from None
+
+
+def _stored_embedding_storages(conn: duckdb.DuckDBPyConnection) -> list[EmbeddingStorage]:
+    rows = conn.execute(f"SELECT DISTINCT embedding_storage FROM {TABLE_NAME}").fetchall()
+
+    return sorted(EmbeddingStorage(storage) for (storage,) in rows)
+
+
+def _is_quantized(conn: duckdb.DuckDBPyConnection) -> bool:
+    """
+    Whether the stored embeddings are quantized (see EmbeddingStorage), in which case they are searched with quantized_search.
+    """
+    return _stored_embedding_storages(conn) == [EmbeddingStorage.INT8]
+
+
+def _get_embedding_store(backend: Optional[EmbeddingBackend] = None) -> Embeddings:
+    backend = backend or _get_embedding_backend()
+
+    if backend == EmbeddingBackend.LOCAL:
+        logger.debug("Using local embeddings")
+        return HashingEmbeddings()
 
-def _get_embedding_store() -> Embeddings:
     if os.environ.get("OPENAI_API_KEY", None):
         logger.debug("Using OpenAI Embeddings")
         # https://api.python.langchain.com/en/latest/embeddings/langchain_openai.embeddings.base.OpenAIEmbeddings.html
         return OpenAIEmbeddings()
 
     else:
-        raise ValueError("Embeddings service could not be configured. Ensure you have OPENAI_API_KEY set.")
+        raise ValueError(
+            "Embeddings service could not be configured. Ensure you have OPENAI_API_KEY set or set BOOKWORM_EMBEDDING_BACKEND=local to embed offline."
+        )
+
+
+def _get_embedding_model(backend: EmbeddingBackend) -> Optional[str]:
+    try:
+        return getattr(_get_embedding_store(backend), "model", None)
+    except ValueError:
+        # the embeddings service is not configured, which is raised once something needs to be embedded
+        return None
+
+
+def _get_query_embedding_store(conn: Optional[duckdb.DuckDBPyConnection] = None) -> Embeddings:
+    """
+    Embeddings service for search queries, repeated queries are served from a persistent cache.
+
+    When given the connection to the vector store the query is embedded by the backend which embedded the stored documents,
+    otherwise (or if nothing is stored) by the configured backend.
+    """
+    stored = _stored_embedding_backends(conn) if conn is not None else []
+    backend = stored[0] if stored else None
+
+    return CachedQueryEmbeddings(_get_embedding_store(backend), _get_query_cache_store())
@@ -0,0 +1,88 @@
+"""
+Counts the tokens of the text sent to the embeddings service, see 'bookworm sync --estimate-cost'.
+
+tiktoken downloads the encoding of a model the first time it is used. It is kept in bookworm's data directory (rather
+than a temporary one) so that estimates keep working offline after the first one, a machine without network can be given
+the encoding by pointing TIKTOKEN_CACHE_DIR at a directory holding it. When the encoding is not available at all, tokens
+are estimated from the length of the texts.
+"""
+
+import os
+import logging
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import tiktoken
+
+from bookworm_genai.cache import TokenCountCache, _text_hash
+from bookworm_genai.embeddings import CHARS_PER_TOKEN
+from bookworm_genai.paths import _get_data_path, _get_token_cache_store
+
+logger = logging.getLogger(__name__)
+
+# the encoding of every OpenAI embeddings model, used for models tiktoken does not know about
+DEFAULT_ENCODING = "cl100k_base"
+
+ENCODING_CACHE_DIRECTORY = "tiktoken"
+
+
+def count_tokens(texts: list[str], model: str) -> int:
+    """
+    The number of tokens the model splits the texts into. Texts which were counted before are not encoded again.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        logger.warning(f"the encoding of {model} could not be loaded (is the network available?), estimating tokens from the length of the text")
+        return sum(len(text) // CHARS_PER_TOKEN + 1 for text in texts)
+
+    cache = TokenCountCache(_get_token_cache_store())
+
+    hashes = [_text_hash(text) for text in texts]
+    counts = cache.lookup(encoding.name, hashes)
+
+    # the same text can appear more than once, only encode it once
+    missing = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in counts}
+
+    if missing:
+        logger.debug(f"encoding {len(missing)} texts with {encoding.name}")
+
+        # encoded in batches on several threads, tiktoken releases the GIL while it encodes
+        # special tokens (e.g <|endoftext|> in a bookmark title) are encoded as plain text, as the embeddings service does
+        tokens = encoding.encode_ordinary_batch(list(missing.values()), num_threads=os.cpu_count() or 1)
+
+        computed = {text_hash: len(text_tokens) for text_hash, text_tokens in zip(missing, tokens)}
+        cache.store(encoding.name, computed)
+        counts.update(computed)
+
+    return sum(counts[text_hash] for text_hash in hashes)
+
+
+def _get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    try:
+        with _encoding_cache_dir():
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                logger.debug(f"tiktoken does not know {model}, using {DEFAULT_ENCODING}")
+                return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+    except (OSError, ValueError) as e:
+        logger.debug(f"could not load the encoding of {model}: {e}")
+        return None
+
+
+@contextmanager
+def _encoding_cache_dir() -> Iterator[None]:
+    """
+    Points tiktoken at bookworm's data directory while an encoding is loaded, unless TIKTOKEN_CACHE_DIR is already set.
+    tiktoken only reads the directory from the environment, which is restored afterwards.
+    """
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        yield
+        return
+
+    os.environ["TIKTOKEN_CACHE_DIR"] = _get_data_path(ENCODING_CACHE_DIRECTORY)
+    try:
+        yield
+    finally:
+        os.environ.pop("TIKTOKEN_CACHE_DIR", None)
@@ -1,28 +1,21 @@
 import json
 import sys
 import os
-from sqlalchemy import RowMapping
+from itertools import islice
+from typing import Iterable, Iterator, Mapping, TypeVar
 from functools import cache
 
+T = TypeVar("T")
 
-## CHROMIUM
-
-CHROMIUM_JQ_COMMAND = """
-  [.roots.bookmark_bar.children, .roots.other.children] |
-  flatten |
-  .. |
-  objects |
-  select(.type == "url")
-"""
 
 ## SQL LOADER
 
 
-def sql_loader_page_content_mapper(row: RowMapping) -> str:
+def sql_loader_page_content_mapper(row: Mapping) -> str:
     """
-    Dictates how a SQL Loader row maps into page content stored into the vector database.
+    Dictates how a Firefox bookmark row maps into page content stored into the vector database.
 
-    This is required because the langchain SQLLoader and JSONLoader output different formats so this function is inplace
+    This is required because the Firefox and Chromium loaders read different formats so this function is inplace
     to ensure that the output is consistent.
     """
     row = dict(row)
@@ -35,7 +28,7 @@ def sql_loader_page_content_mapper(row: RowMapping) -> str:
 @cache
 def sql_loader_firefox_copy_path() -> str:
     """
-    Returns the path to the Firefox database file for the SQL Loader.
+    Returns the path (a glob expression) to the Firefox database file for the SQL Loader.
     """
     if sys.platform == "linux":
         return os.path.expanduser("~/.mozilla/firefox/*.default-release/places.sqlite")
@@ -49,17 +42,17 @@ def sql_loader_firefox_copy_path() -> str:
 def sql_loader_firefox_sql_query() -> str:
     """
     Generates the SQL query for the SQL Loader to extract the bookmarks from the Firefox database.
-    This query also embeds a literal column called 'source' which is the path to the database file. This is needed in the query so
-    that when the SQL Loader runs we can tell it to put this source into the metadata.
+    This query also selects a column called 'source' from its single parameter, which is the path to the database file.
+    This is needed in the query so that the source ends up in both the page content and the metadata.
     """
-    return f"""
+    return """
         SELECT
             CAST(moz_places.id AS TEXT) AS id,
             moz_bookmarks.title,
             moz_places.url,
             CAST(moz_bookmarks.dateAdded AS TEXT) AS dateAdded,
             CAST(moz_bookmarks.lastModified AS TEXT) AS lastModified,
-            '{sql_loader_firefox_copy_path()}' as source
+            ? AS source
         FROM
             moz_bookmarks
         LEFT JOIN
@@ -71,3 +64,16 @@ def sql_loader_firefox_sql_query() -> str:
         AND
             moz_bookmarks.title IS NOT NULL
     """
+
+
+## MISC
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """
+    Lazily splits an iterable into lists of (at most) size items.
+    """
+    iterator = iter(iterable)
+
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -1,24 +1,56 @@
+import json
 import os
-from unittest.mock import patch, Mock
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, Mock, call
 
 import pytest
+from uuid import uuid4
 
-from bookworm_genai.commands.ask import BookmarkChain, _system_message, _get_llm
-from bookworm_genai.models import Bookmarks
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import RunnableLambda
+
+from bookworm_genai import profiling
+from bookworm_genai.cache import CachedQueryEmbeddings
+from bookworm_genai.commands.ask import BookmarkChain, _LLMSpanCallback, _document_to_bookmark, _system_message, _get_llm, answer_queries
+from bookworm_genai.models import Bookmark, Bookmarks, BookmarkSelection
+
+
+@pytest.fixture(autouse=True)
+def mock_exists():
+    # the connection is mocked, so the bookmark table is assumed to exist unless a test says otherwise
+    with patch("bookworm_genai.commands.ask.exists", return_value=True) as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_is_current():
+    # the connection is mocked, so the bookmark table is assumed to be up to date unless a test says otherwise
+    with patch("bookworm_genai.commands.ask.is_current", return_value=True) as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_is_quantized():
+    with patch("bookworm_genai.commands.ask._is_quantized", return_value=False) as mock:
+        yield mock
 
 
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
 @patch("bookworm_genai.commands.ask.ChatPromptTemplate")
 @patch("bookworm_genai.commands.ask.ChatOpenAI")
-@patch("bookworm_genai.commands.ask.DuckDBVectorStore")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
 @patch("bookworm_genai.commands.ask.duckdb")
-@patch("bookworm_genai.commands.ask._get_embedding_store")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
 @patch("bookworm_genai.commands.ask._get_local_store")
 def test_bookmark_chain_ask(
     mock_local_store: Mock,
     mock_embedding_store: Mock,
     mock_duckdb: Mock,
-    mock_duckdb_vector: Mock,
+    mock_has_fts_index: Mock,
+    mock_similarity_search: Mock,
     mock_chatopenai: Mock,
     mock_chat_prompt_template: Mock,
 ):
@@ -27,68 +59,128 @@ def test_bookmark_chain_ask(
     mock_duckdb_connection = Mock()
     mock_duckdb.connect.return_value = mock_duckdb_connection
 
-    mock_embedding = Mock()
-    mock_embedding_store.return_value = mock_embedding
-
     mock_llm = Mock()
     mock_chatopenai.return_value = mock_llm
 
-    mock_chain = Mock(name="chain")
-    mock_chat_prompt_template.from_messages.return_value.__ror__.return_value.__or__.return_value = mock_chain
+    mock_similarity_search.return_value = [_document("pandas", "similarity_score", 0.9), _document("numpy", "similarity_score", 0.8)]
 
-    with BookmarkChain() as bc:
-        # If this checks fails then most likely the chain constructed in the BookmarkChain has changed
-        # review the mock_chain
-        assert mock_chain == bc.chain
+    # the prompt and the LLM, which select the bookmarks by their index in the context
+    mock_select = mock_chat_prompt_template.from_messages.return_value.__or__.return_value
+    mock_select.invoke.return_value = BookmarkSelection(indices=[1, 1, 7, 0])
 
-        bc.ask("test")
+    with BookmarkChain() as bc:
+        bookmarks = bc.ask("test")
 
     mock_duckdb.connect.assert_called_once_with("/test/bookmark.duckdb", read_only=False)
-    mock_duckdb_vector.assert_called_once_with(connection=mock_duckdb_connection, embedding=mock_embedding)
-    mock_duckdb_vector.return_value.as_retriever.assert_called_once_with(search_kwargs={"k": 3})
     assert mock_duckdb_connection.close.called
 
     mock_chatopenai.assert_called_once_with(temperature=0.0)
-    mock_llm.with_structured_output.assert_called_once_with(Bookmarks)
+    mock_llm.with_structured_output.assert_called_once_with(BookmarkSelection)
     mock_chat_prompt_template.from_messages.assert_called_once_with([("system", _system_message), ("human", "{query}")])
 
-    mock_chain.invoke.assert_called_once_with("test")
+    assert mock_select.invoke.call_args == call(
+        {"context": "[0] pandas | https://pandas.com | pandas.com\n[1] numpy | https://numpy.com | numpy.com", "query": "test"}
+    )
+
+    # the selected documents are returned, once each, and made up indices are dropped
+    assert bookmarks == Bookmarks(
+        bookmarks=[
+            Bookmark(title="numpy", url="https://numpy.com", source="", browser="chrome", score=0.8, score_type="similarity"),
+            Bookmark(title="pandas", url="https://pandas.com", source="", browser="chrome", score=0.9, score_type="similarity"),
+        ]
+    )
+
+
+@patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+@patch("bookworm_genai.commands.ask.ChatPromptTemplate")
+@patch("bookworm_genai.commands.ask.ChatOpenAI")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_ask_context_budget(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_similarity_search: Mock,
+    mock_chatopenai: Mock,
+    mock_chat_prompt_template: Mock,
+):
+    mock_similarity_search.return_value = [_document("pandas", "similarity_score", 0.9), _document("numpy", "similarity_score", 0.8)]
+
+    mock_select = mock_chat_prompt_template.from_messages.return_value.__or__.return_value
+    mock_select.invoke.return_value = BookmarkSelection(indices=[0, 1])
+
+    # only the first bookmark fits into the budget, so the LLM can not select the second
+    with BookmarkChain(context_tokens=15) as bc:
+        bookmarks = bc.ask("test")
+
+    ((inputs,), _) = mock_select.invoke.call_args
+    assert inputs["context"] == "[0] pandas | https://pandas.com | pandas.com"
+    assert [bookmark.title for bookmark in bookmarks.bookmarks] == ["pandas"]
+
+
+def test_llm_span_callback():
+    profiler = profiling.enable()
+
+    try:
+        callback = _LLMSpanCallback()
+
+        run_id = uuid4()
+        callback.on_chat_model_start({}, [], run_id=run_id)
+        callback.on_llm_end(LLMResult(generations=[], llm_output={"token_usage": {"total_tokens": 120}}), run_id=run_id)
+
+        failed_run_id = uuid4()
+        callback.on_chat_model_start({}, [], run_id=failed_run_id)
+        callback.on_llm_error(ValueError("failed"), run_id=failed_run_id)
+        callback.on_llm_end(LLMResult(generations=[]), run_id=failed_run_id)
+    finally:
+        profiling.disable()
+
+    assert profiler.stats["llm"].calls == 1
+    assert profiler.stats["llm"].tokens == 120
 
 
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
 @patch("bookworm_genai.commands.ask.ChatPromptTemplate")
 @patch("bookworm_genai.commands.ask.ChatOpenAI")
-@patch("bookworm_genai.commands.ask.DuckDBVectorStore")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
 @patch("bookworm_genai.commands.ask.duckdb")
-@patch("bookworm_genai.commands.ask._get_embedding_store")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
 @patch("bookworm_genai.commands.ask._get_local_store")
 def test_bookmark_chain_ask_n_parameter(
     mock_local_store: Mock,
     mock_embedding_store: Mock,
     mock_duckdb: Mock,
-    mock_duckdb_vector: Mock,
+    mock_has_fts_index: Mock,
+    mock_similarity_search: Mock,
     mock_chatopenai: Mock,
     mock_chat_prompt_template: Mock,
 ):
     n = 15
-    with BookmarkChain(vector_store_search_n=n):
-        pass
+    with BookmarkChain(vector_store_search_n=n) as bc:
+        bc.retrieve("test")
 
-    mock_duckdb_vector.return_value.as_retriever.assert_called_once_with(search_kwargs={"k": n})
+    assert mock_similarity_search.call_args_list == [
+        call(mock_duckdb.connect.return_value, mock_embedding_store.return_value.embed_query.return_value, k=n, use_index=True)
+    ]
 
 
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
 @patch("bookworm_genai.commands.ask.ChatPromptTemplate")
 @patch("bookworm_genai.commands.ask.ChatOpenAI")
-@patch("bookworm_genai.commands.ask.DuckDBVectorStore")
+@patch("bookworm_genai.commands.ask.similarity_search")
 @patch("bookworm_genai.commands.ask.duckdb")
-@patch("bookworm_genai.commands.ask._get_embedding_store")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
 @patch("bookworm_genai.commands.ask._get_local_store")
 def test_bookmark_chain_is_valid(
     mock_local_store: Mock,
     mock_embedding_store: Mock,
     mock_duckdb: Mock,
-    mock_duckdb_vector: Mock,
+    mock_similarity_search: Mock,
     mock_chatopenai: Mock,
     mock_chat_prompt_template: Mock,
 ):
@@ -100,21 +192,21 @@ def test_bookmark_chain_is_valid(
     with BookmarkChain() as bc:
         assert bc.is_valid()
 
-    mock_duckdb_connection.execute.assert_called_once_with("SELECT COUNT(*) FROM embeddings")
+    assert mock_duckdb_connection.execute.call_args == call("SELECT COUNT(*) FROM embeddings")
 
 
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
 @patch("bookworm_genai.commands.ask.ChatPromptTemplate")
 @patch("bookworm_genai.commands.ask.ChatOpenAI")
-@patch("bookworm_genai.commands.ask.DuckDBVectorStore")
+@patch("bookworm_genai.commands.ask.similarity_search")
 @patch("bookworm_genai.commands.ask.duckdb")
-@patch("bookworm_genai.commands.ask._get_embedding_store")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
 @patch("bookworm_genai.commands.ask._get_local_store")
 def test_bookmark_chain_is_valid_zero_count(
     mock_local_store: Mock,
     mock_embedding_store: Mock,
     mock_duckdb: Mock,
-    mock_duckdb_vector: Mock,
+    mock_similarity_search: Mock,
     mock_chatopenai: Mock,
     mock_chat_prompt_template: Mock,
 ):
@@ -130,9 +222,9 @@ def test_bookmark_chain_is_valid_zero_count(
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
 @patch("bookworm_genai.commands.ask.ChatPromptTemplate")
 @patch("bookworm_genai.commands.ask.ChatOpenAI")
-@patch("bookworm_genai.commands.ask.DuckDBVectorStore")
+@patch("bookworm_genai.commands.ask.similarity_search")
 @patch("bookworm_genai.commands.ask.duckdb")
-@patch("bookworm_genai.commands.ask._get_embedding_store")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
 @patch("bookworm_genai.commands.ask._get_local_store")
 @pytest.mark.parametrize(
     "duckdb_response",
@@ -142,7 +234,7 @@ def test_bookmark_chain_is_valid_invalid_response(
     mock_local_store: Mock,
     mock_embedding_store: Mock,
     mock_duckdb: Mock,
-    mock_duckdb_vector: Mock,
+    mock_similarity_search: Mock,
     mock_chatopenai: Mock,
     mock_chat_prompt_template: Mock,
     duckdb_response,
@@ -160,3 +252,450 @@ def test_bookmark_chain_is_valid_invalid_response(
 def test_get_llm_no_env():
     with pytest.raises(ValueError, match="LLM service could not be configured"):
         _get_llm()
+
+
+@patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+@patch("bookworm_genai.commands.ask.ChatPromptTemplate")
+@patch("bookworm_genai.commands.ask.ChatOpenAI")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.has_index")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+@pytest.mark.parametrize(
+    "exact_search, index_exists, expected_use_index",
+    [
+        pytest.param(False, True, True, id="indexed"),
+        pytest.param(True, True, False, id="exact_requested"),
+        pytest.param(False, False, False, id="no_index"),
+    ],
+)
+def test_bookmark_chain_retrieve_index(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_has_index: Mock,
+    mock_similarity_search: Mock,
+    mock_chatopenai: Mock,
+    mock_chat_prompt_template: Mock,
+    exact_search: bool,
+    index_exists: bool,
+    expected_use_index: bool,
+):
+    mock_has_index.return_value = index_exists
+
+    with BookmarkChain(exact_search=exact_search) as bc:
+        bc.retrieve("test")
+
+    _, kwargs = mock_similarity_search.call_args
+    assert kwargs == {"k": 3, "use_index": expected_use_index}
+
+    # searches through the index explore more candidates than DuckDB's default so that they are close to exact
+    ef_search_set = call("SET hnsw_ef_search = 512") in mock_duckdb.connect.return_value.execute.call_args_list
+    assert ef_search_set == expected_use_index
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.ChatOpenAI")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_search_without_llm(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_similarity_search: Mock,
+    mock_chatopenai: Mock,
+):
+    mock_similarity_search.return_value = [
+        Document(
+            page_content='{"name": "bookworm", "url": "https://github.com/kiran94/bookworm"}',
+            metadata={
+                "browser": "chrome",
+                "source": "/chrome/Bookmarks",
+                "title": "bookworm",
+                "url": "https://github.com/kiran94/bookworm",
+                "_similarity_score": 0.9,
+            },
+        ),
+        Document(page_content="not a bookmark", metadata={"browser": "firefox", "_similarity_score": 0.5}),
+    ]
+
+    with BookmarkChain(use_llm=False) as bc:
+        bookmarks = bc.search("bookworm")
+
+        with pytest.raises(ValueError, match="without an LLM"):
+            bc.ask("bookworm")
+
+    # no OPENAI_API_KEY is set so this would raise if the LLM was configured
+    assert not mock_chatopenai.called
+    assert bc.chain is None
+
+    assert bookmarks == Bookmarks(
+        bookmarks=[
+            Bookmark(
+                title="bookworm", url="https://github.com/kiran94/bookworm", source="/chrome/Bookmarks", browser="chrome", score=0.9, score_type="similarity"
+            ),
+            Bookmark(title="", url="", source="", browser="firefox", score=0.5, score_type="similarity"),
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    "scores, expected, score_type",
+    [
+        pytest.param({"_similarity_score": 0.9}, 0.9, "similarity", id="similarity"),
+        pytest.param({"_keyword_score": 4.2}, 4.2, "keyword", id="keyword"),
+        pytest.param({"_similarity_score": 0.9, "_keyword_score": 4.2, "_rrf_score": 0.032}, 0.032, "fused", id="hybrid"),
+        pytest.param({}, None, None, id="none"),
+    ],
+)
+def test_document_to_bookmark_score(scores: dict, expected: float, score_type: str):
+    doc = Document(page_content='{"name": "bookworm", "url": "https://github.com/kiran94/bookworm"}', metadata={"browser": "chrome", **scores})
+
+    bookmark = _document_to_bookmark(doc)
+
+    assert bookmark.score == expected
+    assert bookmark.score_type == score_type
+
+
+@patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+@patch("bookworm_genai.commands.ask.ChatOpenAI")
+@patch("bookworm_genai.commands.ask.similarity_search", return_value=[])
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_ask_from_threads(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_similarity_search: Mock,
+    mock_chatopenai: Mock,
+    tmp_path,
+):
+    service = Mock(wraps=DeterministicFakeEmbedding(size=4))
+    mock_embedding_store.return_value = CachedQueryEmbeddings(service, str(tmp_path / "query_cache.sqlite"))
+
+    mock_chatopenai.return_value.with_structured_output.return_value = RunnableLambda(lambda _: BookmarkSelection(indices=[]))
+
+    # a long running process (bookworm serve) asks through the same chain from whichever thread serves the request,
+    # and the chain embeds each query on a worker thread of its own
+    with BookmarkChain() as bc:
+        for _ in range(2):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                assert executor.submit(bc.ask, "pandas").result() == Bookmarks(bookmarks=[])
+
+    # the second query was served by the query cache opened on the thread of the first
+    assert service.embed_query.call_count == 1
+    assert mock_similarity_search.call_count == 2
+
+
+def _document(name: str, score_alias: str, score: float) -> Document:
+    return Document(
+        page_content=f'{{"name": "{name}", "url": "https://{name}.com"}}',
+        metadata={"browser": "chrome", "title": name, "url": f"https://{name}.com", f"_{score_alias}": score},
+    )
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.keyword_search")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.load_fts", return_value=True)
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=True)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_retrieve_hybrid(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_load_fts: Mock,
+    mock_similarity_search: Mock,
+    mock_keyword_search: Mock,
+):
+    mock_similarity_search.return_value = [_document("pandas", "similarity_score", 0.9), _document("numpy", "similarity_score", 0.8)]
+    mock_keyword_search.return_value = [_document("jira", "keyword_score", 4.2), _document("numpy", "keyword_score", 1.1)]
+
+    with BookmarkChain(vector_store_search_n=2, use_llm=False) as bc:
+        docs = bc.retrieve("numpy JIRA-1234")
+
+    # both searches return more candidates than asked for, which are then fused
+    _, kwargs = mock_similarity_search.call_args
+    assert kwargs == {"k": 20, "use_index": True}
+
+    (cursor, query), kwargs = mock_keyword_search.call_args
+    assert cursor == mock_duckdb.connect.return_value.cursor.return_value.__enter__.return_value
+    assert (query, kwargs) == ("numpy JIRA-1234", {"k": 20})
+
+    # numpy is found by both searches so it ranks first
+    assert [json.loads(doc.page_content)["name"] for doc in docs] == ["numpy", "pandas"]
+    assert docs[0].metadata["_similarity_score"] == 0.8
+    assert docs[0].metadata["_keyword_score"] == 1.1
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.batch_similarity_search")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_search_batch(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_batch_similarity_search: Mock,
+):
+    mock_batch_similarity_search.return_value = [[_document("pandas", "similarity_score", 0.9)], []]
+
+    with BookmarkChain(vector_store_search_n=2, use_llm=False) as bc:
+        results = bc.search_batch(["pandas", "nothing"])
+
+    # the queries are embedded and searched all at once
+    embeddings = mock_embedding_store.return_value
+    assert embeddings.embed_queries.call_args == call(["pandas", "nothing"])
+    assert mock_batch_similarity_search.call_args == call(mock_duckdb.connect.return_value, embeddings.embed_queries.return_value, k=2, quantized=False)
+
+    assert results == [
+        Bookmarks(bookmarks=[Bookmark(title="pandas", url="https://pandas.com", source="", browser="chrome", score=0.9, score_type="similarity")]),
+        Bookmarks(bookmarks=[]),
+    ]
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.keyword_search")
+@patch("bookworm_genai.commands.ask.batch_similarity_search")
+@patch("bookworm_genai.commands.ask.load_fts", return_value=True)
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=True)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_retrieve_batch_hybrid(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_load_fts: Mock,
+    mock_batch_similarity_search: Mock,
+    mock_keyword_search: Mock,
+):
+    mock_batch_similarity_search.return_value = [[_document("pandas", "similarity_score", 0.9)], [_document("numpy", "similarity_score", 0.8)]]
+    mock_keyword_search.side_effect = [[_document("jira", "keyword_score", 4.2)], [_document("numpy", "keyword_score", 1.1)]]
+
+    with BookmarkChain(vector_store_search_n=2, use_llm=False) as bc:
+        results = bc.retrieve_batch(["pandas JIRA-1234", "numpy"])
+
+    _, kwargs = mock_batch_similarity_search.call_args
+    assert kwargs == {"k": 20, "quantized": False}
+
+    cursor = mock_duckdb.connect.return_value.cursor.return_value.__enter__.return_value
+    assert mock_keyword_search.call_args_list == [call(cursor, "pandas JIRA-1234", k=20), call(cursor, "numpy", k=20)]
+
+    assert [[json.loads(doc.page_content)["name"] for doc in docs] for docs in results] == [["pandas", "jira"], ["numpy"]]
+
+
+@patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+@patch("bookworm_genai.commands.ask.ChatPromptTemplate")
+@patch("bookworm_genai.commands.ask.ChatOpenAI")
+@patch("bookworm_genai.commands.ask.batch_similarity_search")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_ask_batch(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_batch_similarity_search: Mock,
+    mock_chatopenai: Mock,
+    mock_chat_prompt_template: Mock,
+):
+    pandas, numpy = _document("pandas", "similarity_score", 0.9), _document("numpy", "similarity_score", 0.8)
+    mock_batch_similarity_search.return_value = [[pandas], [numpy]]
+
+    mock_select = mock_chat_prompt_template.from_messages.return_value.__or__.return_value
+
+    def _select(inputs: dict) -> BookmarkSelection:
+        if inputs["query"] == "numpy":
+            raise ValueError("rate limited")
+
+        return BookmarkSelection(indices=[0])
+
+    mock_select.invoke.side_effect = _select
+
+    with BookmarkChain() as bc:
+        results = bc.ask_batch(["pandas", "numpy"], max_concurrency=2)
+
+    assert results[0] == Bookmarks(
+        bookmarks=[Bookmark(title="pandas", url="https://pandas.com", source="", browser="chrome", score=0.9, score_type="similarity")]
+    )
+
+    # a query the LLM failed to answer does not fail the others
+    assert isinstance(results[1], ValueError)
+
+    assert sorted(inputs["query"] for (inputs,), _ in mock_select.invoke.call_args_list) == ["numpy", "pandas"]
+
+
+@patch("bookworm_genai.commands.ask.paused_server")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+def test_answer_queries(mock_bookmark_chain: Mock, mock_paused_server: Mock, tmp_path):
+    output = str(tmp_path / "results.jsonl")
+
+    chain = mock_bookmark_chain.return_value.__enter__.return_value
+    chain.ask_batch.return_value = [
+        Bookmarks(bookmarks=[Bookmark(title="pandas", url="https://pandas.com", source="/chrome/Bookmarks", browser="chrome")]),
+        ValueError("rate limited"),
+    ]
+
+    assert answer_queries(["pandas", "numpy"], output, top_n=1, max_concurrency=2) == 1
+
+    assert mock_bookmark_chain.call_args == call(vector_store_search_n=1, use_llm=True, keyword_only=False)
+    assert chain.ask_batch.call_args == call(["pandas", "numpy"], max_concurrency=2)
+    assert mock_paused_server.called
+
+    with open(output) as f:
+        lines = [json.loads(line) for line in f]
+
+    assert lines == [
+        {
+            "query": "pandas",
+            "bookmarks": [
+                {"title": "pandas", "url": "https://pandas.com", "source": "/chrome/Bookmarks", "browser": "chrome", "score": None, "score_type": None}
+            ],
+        },
+        {"query": "numpy", "error": "rate limited"},
+    ]
+
+
+@patch("bookworm_genai.commands.ask.paused_server")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+def test_answer_queries_without_llm(mock_bookmark_chain: Mock, mock_paused_server: Mock, tmp_path):
+    output = str(tmp_path / "results.jsonl")
+
+    chain = mock_bookmark_chain.return_value.__enter__.return_value
+    chain.search_batch.return_value = [Bookmarks(bookmarks=[])]
+
+    assert answer_queries(["pandas"], output, use_llm=False) == 1
+    assert not chain.ask_batch.called
+
+    with open(output) as f:
+        assert json.loads(f.read()) == {"query": "pandas", "bookmarks": []}
+
+
+@patch("bookworm_genai.commands.ask.paused_server")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+def test_answer_queries_not_valid(mock_bookmark_chain: Mock, mock_paused_server: Mock, tmp_path):
+    output = tmp_path / "results.jsonl"
+    mock_bookmark_chain.return_value.__enter__.return_value.is_valid.return_value = False
+
+    assert answer_queries(["pandas"], str(output)) == 0
+    assert not output.exists()
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.keyword_search")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.load_fts", return_value=True)
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=True)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_retrieve_keyword_only(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_load_fts: Mock,
+    mock_similarity_search: Mock,
+    mock_keyword_search: Mock,
+):
+    with BookmarkChain(use_llm=False, keyword_only=True) as bc:
+        docs = bc.retrieve("JIRA-1234")
+
+    assert docs == mock_keyword_search.return_value
+    assert mock_keyword_search.call_args == call(mock_duckdb.connect.return_value, "JIRA-1234", k=3)
+
+    # the query is never embedded
+    assert not mock_embedding_store.called
+    assert not mock_similarity_search.called
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_keyword_only_no_index(mock_local_store: Mock, mock_embedding_store: Mock, mock_duckdb: Mock, mock_has_fts_index: Mock):
+    with pytest.raises(ValueError, match="keyword index is not available"):
+        BookmarkChain(use_llm=False, keyword_only=True)
+
+    assert mock_duckdb.connect.return_value.close.called
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_new_database(mock_local_store: Mock, mock_embedding_store: Mock, mock_duckdb: Mock, mock_exists: Mock, mock_is_current: Mock):
+    mock_exists.return_value = False
+    mock_is_current.return_value = False
+
+    # nothing has been synced yet, which is not an outdated database
+    with pytest.raises(ValueError, match="No bookmarks have been stored yet"):
+        BookmarkChain(use_llm=False)
+
+    assert mock_duckdb.connect.return_value.close.called
+    assert not mock_embedding_store.called
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_outdated_database(mock_local_store: Mock, mock_embedding_store: Mock, mock_duckdb: Mock, mock_is_current: Mock):
+    mock_is_current.return_value = False
+
+    with pytest.raises(ValueError, match="run 'bookworm sync' to upgrade it"):
+        BookmarkChain(use_llm=False)
+
+    assert mock_duckdb.connect.return_value.close.called
+    assert not mock_embedding_store.called
+
+
+@patch.dict(os.environ, {}, clear=True)
+@patch("bookworm_genai.commands.ask.stored_candidate_dimensions", return_value=256)
+@patch("bookworm_genai.commands.ask.quantized_search")
+@patch("bookworm_genai.commands.ask.similarity_search")
+@patch("bookworm_genai.commands.ask.has_fts_index", return_value=False)
+@patch("bookworm_genai.commands.ask.duckdb")
+@patch("bookworm_genai.commands.ask._get_query_embedding_store")
+@patch("bookworm_genai.commands.ask._get_local_store")
+def test_bookmark_chain_retrieve_quantized(
+    mock_local_store: Mock,
+    mock_embedding_store: Mock,
+    mock_duckdb: Mock,
+    mock_has_fts_index: Mock,
+    mock_similarity_search: Mock,
+    mock_quantized_search: Mock,
+    mock_stored_candidate_dimensions: Mock,
+    mock_is_quantized: Mock,
+):
+    mock_is_quantized.return_value = True
+
+    with BookmarkChain(use_llm=False) as bc:
+        docs = bc.retrieve("pandas")
+
+    assert docs == mock_quantized_search.return_value
+    assert mock_quantized_search.call_args == call(
+        mock_duckdb.connect.return_value, mock_embedding_store.return_value.embed_query.return_value, k=3, use_index=True, candidate_dimensions=256
+    )
+    assert not mock_similarity_search.called
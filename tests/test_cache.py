@@ -0,0 +1,286 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, call, patch
+
+import duckdb
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from bookworm_genai.cache import CachedEmbeddings, CachedQueryEmbeddings, TokenCountCache, _embedding_model, _text_hash, cached_text_hashes, normalize_query
+from bookworm_genai.embeddings import PartialEmbeddingsError
+
+
+@pytest.fixture
+def connection():
+    with duckdb.connect(":memory:") as conn:
+        yield conn
+
+
+def _service(model: str = "fake-embedding") -> Mock:
+    return Mock(wraps=DeterministicFakeEmbedding(size=4), model=model, dimensions=None)
+
+
+def _cache_size(conn: duckdb.DuckDBPyConnection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+
+def test_cached_embeddings_keeps_partial_embeddings(connection):
+    service = _service()
+    service.embed_documents.side_effect = PartialEmbeddingsError([[1.0, 0.0, 0.0, 0.0], None], ValueError("invalid input"))
+
+    with pytest.raises(PartialEmbeddingsError):
+        CachedEmbeddings(service, connection).embed_documents(["a", "b"])
+
+    assert _cache_size(connection) == 1
+
+    # only the text which could not be embedded is sent again
+    service.embed_documents.side_effect = None
+    CachedEmbeddings(service, connection).embed_documents(["a", "b"])
+
+    assert service.embed_documents.call_args_list[-1] == call(["b"])
+
+
+def test_cached_embeddings_hits_skip_service(connection):
+    service = _service()
+    embeddings = CachedEmbeddings(service, connection)
+
+    first = embeddings.embed_documents(["a", "b"])
+    second = embeddings.embed_documents(["b", "a", "c"])
+
+    # cached vectors are stored as FLOAT so compare with some tolerance
+    assert second[0] == pytest.approx(first[1])
+    assert second[1] == pytest.approx(first[0])
+    assert service.embed_documents.call_args_list == [call(["a", "b"]), call(["c"])]
+    assert _cache_size(connection) == 3
+
+
+def test_cached_embeddings_store_many(connection):
+    service = Mock(wraps=DeterministicFakeEmbedding(size=1_536), model="fake-embedding", dimensions=None)
+    embeddings = CachedEmbeddings(service, connection)
+
+    texts = [f"bookmark {i}" for i in range(1_000)]
+    vectors = embeddings.embed_documents(texts)
+
+    # the vectors are inserted from a registered DataFrame rather than passed as a parameter, which was about 10x slower
+    assert _cache_size(connection) == 1_000
+    assert embeddings.embed_documents(texts[-1:])[0] == pytest.approx(vectors[-1])
+    assert service.embed_documents.call_count == 1
+
+    # the staged rows are not left behind
+    assert connection.execute("SELECT view_name FROM duckdb_views() WHERE NOT internal").fetchall() == []
+
+
+def test_cached_embeddings_duplicate_texts_embedded_once(connection):
+    service = _service()
+    embeddings = CachedEmbeddings(service, connection)
+
+    vectors = embeddings.embed_documents(["a", "a", "b"])
+
+    assert service.embed_documents.call_args_list == [call(["a", "b"])]
+    assert vectors[0] == vectors[1]
+
+
+def test_cached_embeddings_survive_new_instance(connection):
+    CachedEmbeddings(_service(), connection).embed_documents(["a"])
+
+    service = _service()
+    CachedEmbeddings(service, connection).embed_documents(["a"])
+
+    assert not service.embed_documents.called
+
+
+def test_cached_embeddings_keyed_by_model(connection):
+    CachedEmbeddings(_service(), connection).embed_documents(["a"])
+
+    other_model = _service("text-embedding-3-small")
+    CachedEmbeddings(other_model, connection).embed_documents(["a"])
+
+    assert other_model.embed_documents.call_args_list == [call(["a"])]
+    assert _cache_size(connection) == 2
+
+
+def test_cached_embeddings_lru_eviction(connection):
+    service = _service()
+    embeddings = CachedEmbeddings(service, connection, max_size=2)
+
+    embeddings.embed_documents(["a"])
+    embeddings.embed_documents(["b"])
+    embeddings.embed_documents(["a"])  # touch "a" so that "b" is the least recently used
+    embeddings.embed_documents(["c"])
+
+    assert _cache_size(connection) == 2
+
+    service.reset_mock()
+    embeddings.embed_documents(["a", "c"])
+    assert not service.embed_documents.called
+
+    embeddings.embed_documents(["b"])
+    assert service.embed_documents.call_args_list == [call(["b"])]
+
+
+def test_cached_embeddings_query_not_cached(connection):
+    service = _service()
+    embeddings = CachedEmbeddings(service, connection)
+
+    embeddings.embed_query("a")
+
+    assert service.embed_query.call_args_list == [call("a")]
+    assert _cache_size(connection) == 0
+
+
+@pytest.mark.parametrize(
+    "embeddings, expected",
+    [
+        pytest.param(Mock(model="text-embedding-ada-002", dimensions=None), ("text-embedding-ada-002", 0), id="openai_default_dimensions"),
+        pytest.param(Mock(model="text-embedding-3-small", dimensions=512), ("text-embedding-3-small", 512), id="openai_dimensions"),
+        pytest.param(DeterministicFakeEmbedding(size=4), ("DeterministicFakeEmbedding", 0), id="no_model"),
+    ],
+)
+def test_embedding_model(embeddings, expected):
+    assert _embedding_model(embeddings) == expected
+
+
+def test_cached_query_embeddings(tmp_path):
+    service = _service()
+    embeddings = CachedQueryEmbeddings(service, str(tmp_path / "query_cache.sqlite"))
+
+    first = embeddings.embed_query("pandas columns")
+    second = embeddings.embed_query("  Pandas   COLUMNS ")
+
+    assert second == pytest.approx(first)
+    assert service.embed_query.call_args_list == [call("pandas columns")]
+    assert (embeddings.hits, embeddings.misses) == (1, 1)
+
+
+def test_cached_query_embeddings_batch(tmp_path):
+    service = _service()
+    embeddings = CachedQueryEmbeddings(service, str(tmp_path / "query_cache.sqlite"))
+
+    cached = embeddings.embed_query("pandas")
+    vectors = embeddings.embed_queries(["duckdb", "Pandas", "numpy", "DuckDB "])
+
+    # the queries which are not cached are embedded in a single batch, each only once
+    assert service.embed_documents.call_args_list == [call(["duckdb", "numpy"])]
+    assert vectors[1] == pytest.approx(cached)
+    assert vectors[3] == vectors[0]
+    assert (embeddings.hits, embeddings.misses) == (1, 3)
+
+    assert embeddings.embed_query("numpy") == pytest.approx(vectors[2])
+
+
+def test_cached_query_embeddings_across_threads(tmp_path):
+    service = _service()
+    embeddings = CachedQueryEmbeddings(service, str(tmp_path / "query_cache.sqlite"))
+
+    # a long running process (bookworm serve) embeds each query on whichever worker thread the chain runs it
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first = executor.submit(embeddings.embed_query, "pandas").result()
+
+    assert embeddings.embed_query("pandas") == pytest.approx(first)
+    assert service.embed_query.call_count == 1
+
+
+def test_cached_query_embeddings_persisted(tmp_path):
+    path = str(tmp_path / "query_cache.sqlite")
+
+    CachedQueryEmbeddings(_service(), path).embed_query("pandas")
+
+    service = _service()
+    embeddings = CachedQueryEmbeddings(service, path)
+    embeddings.embed_query("pandas")
+
+    assert not service.embed_query.called
+
+    # a different model does not share the cached queries
+    other_model = _service("text-embedding-3-small")
+    CachedQueryEmbeddings(other_model, path).embed_query("pandas")
+    assert other_model.embed_query.call_args_list == [call("pandas")]
+
+
+def test_cached_query_embeddings_ttl(tmp_path):
+    service = _service()
+    embeddings = CachedQueryEmbeddings(service, str(tmp_path / "query_cache.sqlite"), ttl_seconds=60)
+
+    with patch("bookworm_genai.cache.time.time", return_value=1_000):
+        embeddings.embed_query("pandas")
+
+    with patch("bookworm_genai.cache.time.time", return_value=1_030):
+        embeddings.embed_query("pandas")
+
+    with patch("bookworm_genai.cache.time.time", return_value=1_100):
+        embeddings.embed_query("pandas")
+
+    assert service.embed_query.call_count == 2
+
+
+def test_cached_query_embeddings_max_size(tmp_path):
+    service = _service()
+    embeddings = CachedQueryEmbeddings(service, str(tmp_path / "query_cache.sqlite"), max_size=2)
+
+    for query in ["a", "b", "c"]:
+        embeddings.embed_query(query)
+
+    service.reset_mock()
+    embeddings.embed_query("b")
+    embeddings.embed_query("c")
+    assert not service.embed_query.called
+
+    embeddings.embed_query("a")
+    assert service.embed_query.call_args_list == [call("a")]
+
+
+def test_cached_query_embeddings_unavailable(tmp_path):
+    service = _service()
+    embeddings = CachedQueryEmbeddings(service, str(tmp_path / "missing" / "query_cache.sqlite"))
+
+    assert embeddings.embed_query("pandas") == service.embed_query("pandas")
+    assert embeddings.embed_documents(["pandas"]) == service.embed_documents(["pandas"])
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("pandas", "pandas"),
+        ("Pandas Columns", "pandas columns"),
+        ("  pandas \t columns\n", "pandas columns"),
+    ],
+)
+def test_normalize_query(query: str, expected: str):
+    assert normalize_query(query) == expected
+
+
+def test_cached_text_hashes(connection):
+    assert cached_text_hashes(connection, _service(), [_text_hash("a")]) == set()
+
+    CachedEmbeddings(_service(), connection).embed_documents(["a", "b"])
+
+    assert cached_text_hashes(connection, _service(), [_text_hash("a"), _text_hash("c")]) == {_text_hash("a")}
+    assert cached_text_hashes(connection, _service("other-embedding"), [_text_hash("a")]) == set()
+
+
+def test_token_count_cache(tmp_path):
+    cache = TokenCountCache(str(tmp_path / "token_cache.sqlite"))
+
+    assert cache.lookup("cl100k_base", ["a", "b"]) == {}
+
+    cache.store("cl100k_base", {"a": 3, "b": 5})
+
+    assert cache.lookup("cl100k_base", ["a", "c"]) == {"a": 3}
+    assert cache.lookup("o200k_base", ["a"]) == {}
+
+
+def test_token_count_cache_evicts_oldest(tmp_path):
+    cache = TokenCountCache(str(tmp_path / "token_cache.sqlite"), max_size=2)
+
+    with patch("bookworm_genai.cache.time") as mock_time:
+        for now, text_hash in enumerate(["a", "b", "c"]):
+            mock_time.time.return_value = now
+            cache.store("cl100k_base", {text_hash: 1})
+
+    assert cache.lookup("cl100k_base", ["a", "b", "c"]) == {"b": 1, "c": 1}
+
+
+def test_token_count_cache_unavailable(tmp_path):
+    cache = TokenCountCache(str(tmp_path / "missing" / "token_cache.sqlite"))
+
+    cache.store("cl100k_base", {"a": 3})
+    assert cache.lookup("cl100k_base", ["a"]) == {}
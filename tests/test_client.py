@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import urllib.request
+from unittest.mock import Mock, patch, call
+
+import pytest
+
+from bookworm_genai import client
+from bookworm_genai.commands.serve import BookmarkServer
+
+
+@pytest.fixture
+def server():
+    service = Mock()
+    service.is_paused.return_value = False
+
+    with BookmarkServer(("127.0.0.1", 0), service) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        host, port = server.server_address[:2]
+        with patch("bookworm_genai.client.server_address", return_value=f"http://{host}:{port}"):
+            yield server
+
+        server.shutdown()
+        thread.join()
+
+
+def test_ask(server: BookmarkServer):
+    server.service.ask.return_value = [{"title": "bookworm", "url": "https://github.com/kiran94/bookworm"}]
+
+    bookmarks = client.ask("bookmark search", top_n=5, exact=True, use_llm=False, keyword_only=True)
+
+    assert bookmarks == [{"title": "bookworm", "url": "https://github.com/kiran94/bookworm"}]
+    assert server.service.ask.call_args_list == [call("bookmark search", top_n=5, exact=True, use_llm=False, keyword_only=True)]
+
+
+def test_ask_error(server: BookmarkServer):
+    server.service.ask.side_effect = ValueError("The keyword index is not available")
+
+    with pytest.raises(ValueError, match="The keyword index is not available"):
+        client.ask("bookmark search", keyword_only=True)
+
+
+def test_ask_paused(server: BookmarkServer):
+    server.service.is_paused.return_value = True
+
+    with pytest.raises(ValueError, match="being synced"):
+        client.ask("bookmark search")
+
+    assert not server.service.ask.called
+
+
+@patch("bookworm_genai.client.server_address", return_value=None)
+def test_ask_no_server(mock_server_address: Mock):
+    assert client.ask("bookmark search") is None
+
+
+@patch("bookworm_genai.client.server_address", return_value="http://127.0.0.1:1")
+def test_ask_server_unreachable(mock_server_address: Mock):
+    # the daemon is gone but left its file behind, the query is answered locally
+    assert client.ask("bookmark search") is None
+
+
+def test_paused_server(server: BookmarkServer):
+    with client.paused_server():
+        assert server.service.pause.call_args_list == [call(os.getpid())]
+        assert not server.service.resume.called
+
+    assert server.service.resume.called
+
+    # the database is opened again after the response to resume, the server answers one request at a time so it has once the
+    # next request is answered
+    urllib.request.urlopen(f"{client.server_address()}/health").close()
+    assert server.service.warm.called, "the database is opened again once the sync finished"
+
+
+def test_paused_server_resumes_on_error(server: BookmarkServer):
+    with pytest.raises(RuntimeError):
+        with client.paused_server():
+            raise RuntimeError("sync failed")
+
+    assert server.service.resume.called
+
+
+@patch("bookworm_genai.client.server_address", return_value=None)
+def test_paused_server_no_server(mock_server_address: Mock):
+    with client.paused_server():
+        pass
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        pytest.param({"host": "127.0.0.1", "port": 8765}, "http://127.0.0.1:8765", id="running"),
+        pytest.param({"host": "::1", "port": 8765}, "http://[::1]:8765", id="ipv6"),
+        pytest.param(None, None, id="not_running"),
+        pytest.param("not json", None, id="corrupt"),
+    ],
+)
+@patch("bookworm_genai.client._get_server_file")
+def test_server_address(mock_get_server_file: Mock, tmp_path, content, expected):
+    path = tmp_path / "server.json"
+    mock_get_server_file.return_value = str(path)
+
+    if isinstance(content, dict):
+        path.write_text(json.dumps(content))
+    elif content is not None:
+        path.write_text(content)
+
+    assert client.server_address() == expected
+
+
+@patch("bookworm_genai.client._get_server_file")
+def test_ask_ipv6(mock_get_server_file: Mock, tmp_path):
+    path = tmp_path / "server.json"
+    mock_get_server_file.return_value = str(path)
+
+    service = Mock()
+    service.is_paused.return_value = False
+    service.ask.return_value = [{"title": "bookworm"}]
+
+    with BookmarkServer(("::1", 0), service) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        try:
+            path.write_text(json.dumps({"host": "::1", "port": server.server_address[1]}))
+
+            assert client.ask("bookmark search") == [{"title": "bookworm"}]
+        finally:
+            server.shutdown()
+            thread.join()
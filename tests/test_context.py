@@ -0,0 +1,65 @@
+import os
+import json
+from unittest.mock import patch
+
+from langchain_core.documents import Document
+
+from bookworm_genai.context import format_context, get_context_tokens
+
+
+def _document(title: str, url: str) -> Document:
+    # as returned by a search, with the title and url columns of the bookmark
+    return Document(
+        page_content=json.dumps({"name": title, "url": url, "guid": "1234", "date_added": "13300000000000000"}),
+        metadata={"browser": "chrome", "title": title, "url": url},
+    )
+
+
+def test_format_context():
+    docs = [_document("pandas", "https://pandas.pydata.org/docs"), _document("numpy", "http://numpy.org")]
+
+    context, count = format_context(docs, max_tokens=100)
+
+    assert context == "[0] pandas | https://pandas.pydata.org/docs | pandas.pydata.org\n[1] numpy | http://numpy.org | numpy.org"
+    assert count == 2
+
+
+def test_format_context_budget():
+    docs = [_document(f"bookmark {index}", f"https://example.com/{index}") for index in range(10)]
+
+    # each line is 13 tokens
+    context, count = format_context(docs, max_tokens=30)
+
+    assert count == 2
+    assert context.splitlines() == ["[0] bookmark 0 | https://example.com/0 | example.com", "[1] bookmark 1 | https://example.com/1 | example.com"]
+
+    assert format_context(docs, max_tokens=0) == ("", 0)
+
+
+def test_format_context_shortens():
+    docs = [_document("a  very\nlong " + "title " * 50, "https://example.com/" + "a" * 500)]
+
+    context, _ = format_context(docs, max_tokens=1_000)
+
+    title, url, domain = context.removeprefix("[0] ").split(" | ")
+    assert title.startswith("a very long title")
+    assert len(title) == 100 and title.endswith("…")
+    assert len(url) == 120 and url.endswith("…")
+    assert domain == "example.com"
+
+
+def test_format_context_unknown_content():
+    docs = [Document(page_content="not a bookmark"), _document("", "http://[broken")]
+
+    context, count = format_context(docs, max_tokens=100)
+
+    assert context == "[0]  |  | \n[1]  | http://[broken | "
+    assert count == 2
+
+
+@patch.dict(os.environ, {}, clear=True)
+def test_get_context_tokens():
+    assert get_context_tokens() == 2_000
+
+    with patch.dict(os.environ, {"BOOKWORM_CONTEXT_TOKENS": "500"}):
+        assert get_context_tokens() == 500
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+from langchain_core.documents import Document
+
+from bookworm_genai.dedup import deduplicate, normalize_url
+
+
+def _doc(url: str, browser: str, source: str) -> Document:
+    return Document(page_content=json.dumps({"name": url, "url": url}), metadata={"browser": browser, "source": source})
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        pytest.param("https://example.com/page", "https://example.com/page", id="unchanged"),
+        pytest.param("http://example.com/page", "https://example.com/page", id="scheme"),
+        pytest.param("https://EXAMPLE.com/page", "https://example.com/page", id="host_case"),
+        pytest.param("https://example.com:443/page", "https://example.com/page", id="default_port"),
+        pytest.param("https://example.com:8080/page", "https://example.com:8080/page", id="custom_port"),
+        pytest.param("https://example.com/page/", "https://example.com/page", id="trailing_slash"),
+        pytest.param("https://example.com/", "https://example.com", id="root_trailing_slash"),
+        pytest.param("https://example.com/page#section", "https://example.com/page", id="fragment"),
+        pytest.param("https://example.com/page?utm_source=x&utm_medium=y&fbclid=z", "https://example.com/page", id="tracking_parameters"),
+        pytest.param("https://example.com/page?b=2&utm_source=x&a=1", "https://example.com/page?a=1&b=2", id="sorted_parameters"),
+        pytest.param("  https://example.com/page  ", "https://example.com/page", id="whitespace"),
+        pytest.param("javascript:alert(1)", "javascript:alert(1)", id="non_http"),
+        pytest.param("place:sort=8&maxResults=10", "place:sort=8&maxResults=10", id="firefox_place"),
+    ],
+)
+def test_normalize_url(url: str, expected: str):
+    assert normalize_url(url) == expected
+
+
+def test_deduplicate():
+    docs = [
+        _doc("https://example.com/", "brave", "/brave/Bookmarks"),
+        _doc("https://other.com", "brave", "/brave/Bookmarks"),
+        _doc("http://example.com?utm_source=newsletter", "chrome", "/chrome/Bookmarks"),
+        _doc("https://example.com#top", "firefox", "/firefox/places.sqlite"),
+    ]
+
+    result = deduplicate(docs)
+
+    assert result == [docs[0], docs[1]]
+
+    assert docs[0].metadata == {
+        "browser": "brave",
+        "source": "/brave/Bookmarks",
+        "browsers": ["brave", "chrome", "firefox"],
+        "sources": ["/brave/Bookmarks", "/chrome/Bookmarks", "/firefox/places.sqlite"],
+    }
+    assert docs[1].metadata == {"browser": "brave", "source": "/brave/Bookmarks", "browsers": ["brave"], "sources": ["/brave/Bookmarks"]}
+
+
+@pytest.mark.parametrize(
+    "page_content",
+    [
+        pytest.param("", id="empty"),
+        pytest.param("not json", id="not_json"),
+        pytest.param("[1, 2]", id="not_object"),
+        pytest.param('{"name": "folder"}', id="no_url"),
+    ],
+)
+def test_deduplicate_without_url(page_content: str):
+    docs = [Document(page_content=page_content, metadata={"browser": "chrome"}), Document(page_content=page_content, metadata={"browser": "brave"})]
+
+    assert deduplicate(docs) == docs
+    assert docs[0].metadata == {"browser": "chrome"}
@@ -0,0 +1,215 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+import httpx
+import openai
+import pytest
+
+from bookworm_genai.embeddings import ConcurrentEmbeddings, PartialEmbeddingsError, _AdaptiveLimiter, _backoff, _is_retryable, _make_batches
+
+
+class _RateLimitError(Exception):
+    status_code = 429
+
+
+class _AuthenticationError(Exception):
+    status_code = 401
+
+
+def _fake_embed(texts: list[str]) -> list[list[float]]:
+    return [[float(len(text))] for text in texts]
+
+
+@pytest.mark.parametrize(
+    "texts, max_tokens, max_size, expected",
+    [
+        pytest.param([], 10, 10, [], id="empty"),
+        pytest.param(["a"] * 5, 100, 2, [(0, 2), (2, 4), (4, 5)], id="max_size"),
+        pytest.param(["a" * 20] * 4, 12, 100, [(0, 2), (2, 4)], id="max_tokens"),
+        pytest.param(["a" * 100, "a"], 5, 100, [(0, 1), (1, 2)], id="oversized_text"),
+    ],
+)
+def test_make_batches(texts: list[str], max_tokens: int, max_size: int, expected: list[tuple[int, int]]):
+    assert _make_batches(texts, max_tokens, max_size) == expected
+
+
+def test_concurrent_embeddings_order_preserved():
+    service = Mock()
+    service.aembed_documents = AsyncMock(side_effect=_fake_embed)
+
+    embeddings = ConcurrentEmbeddings(service, max_batch_size=2, show_progress=False)
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+    assert embeddings.embed_documents(texts) == _fake_embed(texts)
+    assert service.aembed_documents.call_count == 3
+
+
+@patch("bookworm_genai.embeddings._backoff", return_value=0)
+def test_concurrent_embeddings_retries_only_failed_batch(mock_backoff: Mock):
+    failures = {"ccc": 2}
+
+    async def embed(texts: list[str]) -> list[list[float]]:
+        if failures.get(texts[0]):
+            failures[texts[0]] -= 1
+            raise _RateLimitError()
+        return _fake_embed(texts)
+
+    service = Mock()
+    service.aembed_documents = AsyncMock(side_effect=embed)
+
+    embeddings = ConcurrentEmbeddings(service, max_batch_size=2, show_progress=False)
+    texts = ["a", "bb", "ccc", "dddd"]
+
+    assert embeddings.embed_documents(texts) == _fake_embed(texts)
+
+    batches = [args[0] for args, _ in service.aembed_documents.call_args_list]
+    assert batches.count(["a", "bb"]) == 1
+    assert batches.count(["ccc", "dddd"]) == 3
+
+
+@patch("bookworm_genai.embeddings._backoff", return_value=0)
+def test_concurrent_embeddings_gives_up(mock_backoff: Mock):
+    service = Mock()
+    service.aembed_documents = AsyncMock(side_effect=_RateLimitError())
+
+    embeddings = ConcurrentEmbeddings(service, max_retries=2, show_progress=False)
+
+    with pytest.raises(_RateLimitError):
+        embeddings.embed_documents(["a"])
+
+    assert service.aembed_documents.call_count == 3
+
+
+def test_concurrent_embeddings_client_error_not_retried():
+    service = Mock()
+    service.aembed_documents = AsyncMock(side_effect=_AuthenticationError())
+
+    embeddings = ConcurrentEmbeddings(service, show_progress=False)
+
+    with pytest.raises(_AuthenticationError):
+        embeddings.embed_documents(["a"])
+
+    assert service.aembed_documents.call_count == 1
+
+
+def test_concurrent_embeddings_programming_error_not_retried():
+    service = Mock()
+    service.aembed_documents = AsyncMock(side_effect=TypeError("unexpected keyword argument"))
+
+    with pytest.raises(TypeError):
+        ConcurrentEmbeddings(service, show_progress=False).embed_documents(["a"])
+
+    assert service.aembed_documents.call_count == 1
+
+
+def test_concurrent_embeddings_keeps_embedded_batches():
+    async def embed(texts: list[str]) -> list[list[float]]:
+        if "ccc" in texts:
+            raise _AuthenticationError()
+        return _fake_embed(texts)
+
+    service = Mock()
+    service.aembed_documents = AsyncMock(side_effect=embed)
+
+    embeddings = ConcurrentEmbeddings(service, max_batch_size=2, show_progress=False)
+
+    with pytest.raises(PartialEmbeddingsError, match="2 of 6 documents could not be embedded") as error:
+        embeddings.embed_documents(["a", "bb", "ccc", "dddd", "e", "ff"])
+
+    # the batches before and after the one which failed were still embedded
+    assert error.value.vectors == [[1.0], [2.0], None, None, [1.0], [2.0]]
+    assert isinstance(error.value.__cause__, _AuthenticationError)
+
+
+@patch("bookworm_genai.embeddings._backoff", return_value=0)
+def test_concurrent_embeddings_concurrency_carried_across_calls(mock_backoff: Mock):
+    failures = {"a": 1}
+
+    async def embed(texts: list[str]) -> list[list[float]]:
+        if failures.get(texts[0]):
+            failures[texts[0]] -= 1
+            raise _RateLimitError()
+        return _fake_embed(texts)
+
+    service = Mock()
+    service.aembed_documents = AsyncMock(side_effect=embed)
+
+    embeddings = ConcurrentEmbeddings(service, max_concurrency=8, show_progress=False)
+
+    embeddings.embed_documents(["a"])
+    assert embeddings._concurrency < 8, "a rate limit should lower the concurrency used by the next call"
+
+    embeddings.embed_documents(["b"])
+    embeddings.close()
+
+    assert embeddings._progress is None
+
+
+def test_concurrent_embeddings_exposes_service_attributes():
+    embeddings = ConcurrentEmbeddings(Mock(model="text-embedding-ada-002"))
+
+    assert embeddings.model == "text-embedding-ada-002"
+    assert embeddings.embed_documents([]) == []
+
+
+def test_adaptive_limiter():
+    async def run():
+        limiter = _AdaptiveLimiter(max_concurrency=8)
+
+        limiter.decrease(pause=0)
+        assert limiter.limit == 4
+
+        limiter.decrease(pause=0)
+        limiter.decrease(pause=0)
+        limiter.decrease(pause=0)
+        assert limiter.limit == 1
+
+        # additive increase after a full window of successes
+        limiter.increase()
+        assert limiter.limit == 2
+
+        limiter.increase()
+        assert limiter.limit == 2
+        limiter.increase()
+        assert limiter.limit == 3
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "status_code, expected",
+    [(None, False), (408, True), (429, True), (500, True), (503, True), (400, False), (401, False), (404, False), (409, False)],
+)
+def test_is_retryable(status_code, expected):
+    error = Exception()
+    error.status_code = status_code
+
+    assert _is_retryable(error) == expected
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        pytest.param(openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com")), True, id="connection"),
+        pytest.param(openai.APITimeoutError(request=httpx.Request("POST", "https://api.openai.com")), True, id="timeout"),
+        pytest.param(httpx.ConnectError("connection refused"), True, id="transport"),
+        pytest.param(ConnectionResetError(), True, id="reset"),
+        pytest.param(asyncio.TimeoutError(), True, id="asyncio_timeout"),
+        pytest.param(TypeError("unexpected keyword argument"), False, id="programming_error"),
+        pytest.param(ValueError("invalid input"), False, id="value_error"),
+    ],
+)
+def test_is_retryable_errors(error: Exception, expected: bool):
+    assert _is_retryable(error) == expected
+
+
+def test_backoff_uses_retry_after():
+    error = _RateLimitError()
+    error.response = Mock(headers={"retry-after": "7"})
+
+    assert _backoff(0, error) == 7.0
+
+
+def test_backoff_bounded():
+    for attempt in range(10):
+        assert 0 <= _backoff(attempt, Exception(), base=1.0, cap=5.0) <= 5.0
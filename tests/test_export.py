@@ -1,27 +1,116 @@
+import json
 from unittest.mock import Mock, patch, call
 
+import duckdb
 import pandas as pd
+import pytest
 
+from bookworm_genai import schema
 from bookworm_genai.commands.export import export
 
 
+@pytest.fixture(autouse=True)
+def mock_paused_server():
+    with patch("bookworm_genai.commands.export.paused_server") as mock:
+        yield mock
+
+
+@pytest.fixture
+def local_store(tmp_path):
+    path = str(tmp_path / "bookmarks.duckdb")
+
+    with duckdb.connect(path) as conn:
+        schema.ensure_table(conn)
+        schema.insert(
+            conn,
+            ["1", "2"],
+            ['{"name": "my_bookmark", "url": "https://bookmark.com"}', '{"name": "it\'s, \\"quoted\\"", "url": "https://other.com"}'],
+            [[1.0, 0.5], [0.0, 0.25]],
+            [{"source": "my_source", "browser": "chrome"}, {"source": "places.sqlite", "browser": "firefox"}],
+        )
+
+    with patch("bookworm_genai.commands.export._get_local_store", return_value=path):
+        yield path
+
+
+EXPECTED = pd.DataFrame(
+    data={
+        "name": ["my_bookmark", 'it\'s, "quoted"'],
+        "url": ["https://bookmark.com", "https://other.com"],
+        "browser": ["chrome", "firefox"],
+        "source": ["my_source", "places.sqlite"],
+    }
+)
+
+
+def test_export_csv(local_store, tmp_path):
+    output = str(tmp_path / "bookmark's.csv")
+
+    assert export(output) == 2
+
+    result = pd.read_csv(output).sort_values("url", ignore_index=True)
+    pd.testing.assert_frame_equal(EXPECTED, result)
+
+
+def test_export_parquet(local_store, tmp_path):
+    output = str(tmp_path / "bookmarks.parquet")
+
+    assert export(output, format="parquet") == 2
+
+    result = duckdb.sql(f"SELECT * FROM '{output}' ORDER BY url").df()
+    pd.testing.assert_frame_equal(EXPECTED, result)
+
+
+def test_export_jsonl_with_embeddings(local_store, tmp_path):
+    output = tmp_path / "bookmarks.jsonl"
+
+    assert export(str(output), format="jsonl", include_embeddings=True) == 2
+
+    rows = sorted((json.loads(line) for line in output.read_text().splitlines()), key=lambda row: row["url"])
+    assert rows[0] == {"name": "my_bookmark", "url": "https://bookmark.com", "browser": "chrome", "source": "my_source", "embedding": [1.0, 0.5]}
+
+
+def test_export_excludes_embeddings(local_store, tmp_path):
+    output = tmp_path / "bookmarks.jsonl"
+
+    export(str(output), format="jsonl")
+
+    assert all("embedding" not in json.loads(line) for line in output.read_text().splitlines())
+
+
+def test_export_unknown_format(local_store, tmp_path):
+    with pytest.raises(ValueError, match="Unknown export format 'xml'"):
+        export(str(tmp_path / "bookmarks.xml"), format="xml")
+
+
 @patch("bookworm_genai.commands.export._get_local_store")
 @patch("bookworm_genai.commands.export.duckdb")
-def test_export(mock_duckdb: Mock, mock_get_local_store: Mock):
-    df = pd.DataFrame(
-        data={
-            "id": ["id"],
-            "text": ['{"name": "my_bookmark", "url": "https://bookmark.com"}'],
-            "embedding": [1],
-            "metadata": ['{"source": "my_source", "browser": "chrome"}'],
-        }
-    )
-
-    mock_duckdb.connect.return_value.__enter__.return_value.execute.return_value.df.return_value = df
+def test_export_read_only(mock_duckdb: Mock, mock_get_local_store: Mock):
+    mock_duckdb.connect.return_value.__enter__.return_value.execute.return_value.fetchone.return_value = (0,)
 
-    result = export()
+    with patch("bookworm_genai.commands.export.schema.exists", return_value=True), patch("bookworm_genai.commands.export.schema.is_current", return_value=True):
+        export("bookmarks.csv")
 
     assert mock_duckdb.connect.call_args_list == [call(mock_get_local_store.return_value, read_only=True)]
 
-    expected_df = pd.DataFrame(data={"name": "my_bookmark", "url": "https://bookmark.com", "browser": "chrome", "source": "my_source"}, index=[0])
-    pd.testing.assert_frame_equal(expected_df, result)
+
+@patch("bookworm_genai.commands.export._get_local_store")
+def test_export_outdated_database(mock_get_local_store: Mock, tmp_path):
+    mock_get_local_store.return_value = str(tmp_path / "bookmarks.duckdb")
+
+    with duckdb.connect(mock_get_local_store.return_value) as conn:
+        conn.execute("CREATE TABLE embeddings (id VARCHAR PRIMARY KEY, text VARCHAR, embedding FLOAT[], metadata VARCHAR)")
+
+    with pytest.raises(ValueError, match="run 'bookworm sync' to upgrade it"):
+        export(str(tmp_path / "bookmarks.csv"))
+
+
+@patch("bookworm_genai.commands.export._get_local_store")
+def test_export_new_database(mock_get_local_store: Mock, tmp_path):
+    mock_get_local_store.return_value = str(tmp_path / "bookmarks.duckdb")
+
+    # nothing has been synced yet
+    duckdb.connect(mock_get_local_store.return_value).close()
+
+    with pytest.raises(ValueError, match="No bookmarks have been stored yet"):
+        export(str(tmp_path / "bookmarks.csv"))
@@ -0,0 +1,46 @@
+import json
+import subprocess
+import sys
+
+# the entry point imports in ~0.15s on a laptop, the budget leaves plenty of room for slower (CI) machines
+IMPORT_BUDGET_US = 750_000
+
+# packages that are slow to import and are only needed once a command runs
+HEAVY_PACKAGES = ["duckdb", "jq", "langchain_community", "langchain_core", "langchain_openai", "numpy", "openai", "pandas", "sqlalchemy", "tiktoken"]
+
+
+def _imported_packages(module: str) -> list[str]:
+    script = f"import json, sys, {module}; print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}})))"
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+
+    return json.loads(result.stdout)
+
+
+def _import_time(module: str) -> int:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative)
+
+    raise AssertionError(f"{module} was not imported")
+
+
+def test_main_does_not_import_heavy_packages():
+    imported = _imported_packages("bookworm_genai.__main__")
+
+    assert [package for package in HEAVY_PACKAGES if package in imported] == []
+
+
+def test_export_does_not_import_langchain():
+    imported = _imported_packages("bookworm_genai.commands.export")
+
+    assert [package for package in imported if package.startswith("langchain")] == []
+
+
+def test_main_import_time_budget():
+    # the best of a few runs so that a busy machine does not fail the test
+    import_time = min(_import_time("bookworm_genai.__main__") for _ in range(3))
+
+    assert import_time < IMPORT_BUDGET_US, f"importing bookworm_genai.__main__ took {import_time / 1_000:.0f}ms"
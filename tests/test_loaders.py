@@ -0,0 +1,213 @@
+import json
+import shutil
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from langchain_community.document_loaders.sql_database import SQLDatabaseLoader
+from langchain_community.utilities.sql_database import SQLDatabase
+from langchain_core.documents import Document
+
+from bookworm_genai.loaders import BookmarkDelta, ChromiumBookmarkLoader, FirefoxBookmarkLoader, _snapshot_places
+from bookworm_genai.utils import sql_loader_firefox_sql_query, sql_loader_page_content_mapper
+
+
+def _url(name: str) -> dict:
+    return {"type": "url", "name": name, "url": f"https://{name}.com"}
+
+
+def _folder(name: str, children: list[dict]) -> dict:
+    return {"type": "folder", "name": name, "children": children}
+
+
+def test_chromium_bookmark_loader(tmp_path):
+    bookmarks = {
+        "roots": {
+            "bookmark_bar": _folder("Bookmarks bar", [_url("a"), _folder("Dev", [_url("b"), _folder("Python", [_url("c")])]), _url("d")]),
+            "other": _folder("Other bookmarks", [_url("e")]),
+            "synced": _folder("Mobile bookmarks", [_url("f")]),
+        }
+    }
+
+    path = tmp_path / "Bookmarks"
+    path.write_text(json.dumps(bookmarks))
+
+    docs = list(ChromiumBookmarkLoader(file_path=str(path)).lazy_load())
+
+    assert docs == [
+        Document(page_content=json.dumps(_url("a")), metadata={"source": str(path), "seq_num": 1, "folder": "Bookmarks bar"}),
+        Document(page_content=json.dumps(_url("b")), metadata={"source": str(path), "seq_num": 2, "folder": "Bookmarks bar/Dev"}),
+        Document(page_content=json.dumps(_url("c")), metadata={"source": str(path), "seq_num": 3, "folder": "Bookmarks bar/Dev/Python"}),
+        Document(page_content=json.dumps(_url("d")), metadata={"source": str(path), "seq_num": 4, "folder": "Bookmarks bar"}),
+        Document(page_content=json.dumps(_url("e")), metadata={"source": str(path), "seq_num": 5, "folder": "Other bookmarks"}),
+    ]
+
+
+def test_chromium_bookmark_loader_missing_roots(tmp_path):
+    path = tmp_path / "Bookmarks"
+    path.write_text(json.dumps({"roots": {"bookmark_bar": _folder("Bookmarks bar", [])}}))
+
+    assert list(ChromiumBookmarkLoader(file_path=str(path)).lazy_load()) == []
+
+
+@pytest.fixture
+def places(tmp_path) -> str:
+    path = str(tmp_path / "places.sqlite")
+
+    with closing(sqlite3.connect(path)) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE moz_places (id INTEGER PRIMARY KEY, url TEXT, title TEXT);
+            CREATE TABLE moz_bookmarks (id INTEGER PRIMARY KEY, type INTEGER, fk INTEGER, parent INTEGER, title TEXT, dateAdded INTEGER, lastModified INTEGER);
+
+            INSERT INTO moz_places VALUES (1, 'https://example.com', 'example'), (2, 'https://github.com', 'github'), (3, 'https://history.com', 'history');
+            INSERT INTO moz_bookmarks VALUES
+                (1, 2, NULL, 0, 'menu', 1, 1),
+                (2, 1, 1, 1, 'Example', 1700000000000000, 1700000000000001),
+                (3, 1, 2, 1, 'GitHub', 1700000000000002, 1700000000000003),
+                (4, 1, 2, 1, NULL, 1700000000000004, 1700000000000005);
+            """
+        )
+        conn.commit()
+
+    return path
+
+
+def test_firefox_bookmark_loader(places: str):
+    docs = list(FirefoxBookmarkLoader(file_path=places, batch_size=1).lazy_load())
+
+    assert docs == [
+        Document(
+            page_content=json.dumps(
+                {
+                    "id": "1",
+                    "url": "https://example.com",
+                    "dateAdded": "1700000000000000",
+                    "lastModified": "1700000000000001",
+                    "source": places,
+                    "name": "Example",
+                }
+            ),
+            metadata={"source": places},
+        ),
+        Document(
+            page_content=json.dumps(
+                {
+                    "id": "2",
+                    "url": "https://github.com",
+                    "dateAdded": "1700000000000002",
+                    "lastModified": "1700000000000003",
+                    "source": places,
+                    "name": "GitHub",
+                }
+            ),
+            metadata={"source": places},
+        ),
+    ]
+
+
+def test_firefox_bookmark_loader_matches_sql_database_loader(places: str):
+    # the previous loader, documents must be identical so that stored bookmarks are not embedded again
+    query = sql_loader_firefox_sql_query().replace("?", f"'{places}'")
+    previous = SQLDatabaseLoader(
+        db=SQLDatabase.from_uri(f"sqlite:///{places}"),
+        query=query,
+        source_columns=["source"],
+        page_content_mapper=lambda row: sql_loader_page_content_mapper(row),
+    )
+
+    assert list(FirefoxBookmarkLoader(file_path=places).lazy_load()) == list(previous.lazy_load())
+
+
+def test_firefox_bookmark_loader_locked(places: str):
+    # Firefox holds an exclusive lock on the database while it is running
+    with closing(sqlite3.connect(places)) as lock:
+        lock.execute("PRAGMA locking_mode = EXCLUSIVE")
+        lock.execute("BEGIN EXCLUSIVE")
+
+        with patch("bookworm_genai.loaders._snapshot_places", wraps=_snapshot_places) as mock_snapshot:
+            docs = list(FirefoxBookmarkLoader(file_path=places).lazy_load())
+
+    assert mock_snapshot.called
+    assert [json.loads(doc.page_content)["name"] for doc in docs] == ["Example", "GitHub"]
+
+
+def test_firefox_bookmark_loader_locked_wal(places: str):
+    with closing(sqlite3.connect(places)) as firefox:
+        firefox.execute("PRAGMA journal_mode = WAL")
+        firefox.execute("PRAGMA wal_autocheckpoint = 0")
+        firefox.execute("PRAGMA locking_mode = EXCLUSIVE")
+
+        # a bookmark Firefox has only written into the write-ahead log, the database file does not hold it yet
+        firefox.execute("INSERT INTO moz_places VALUES (4, 'https://duckdb.org', 'duckdb')")
+        firefox.execute("INSERT INTO moz_bookmarks VALUES (5, 1, 4, 1, 'DuckDB', 1700000000000006, 1700000000000007)")
+        firefox.commit()
+
+        with patch("bookworm_genai.loaders._snapshot_places", wraps=_snapshot_places) as mock_snapshot:
+            with patch("bookworm_genai.loaders.shutil.copyfile") as mock_copyfile:
+                docs = list(FirefoxBookmarkLoader(file_path=places).lazy_load())
+
+        assert mock_snapshot.called
+        assert not mock_copyfile.called, "the database is read in place rather than copied"
+        assert [json.loads(doc.page_content)["name"] for doc in docs] == ["Example", "GitHub", "DuckDB"]
+
+        # the database and its log are left as they were, Firefox still writes to them
+        assert sorted(path.name for path in Path(places).parent.iterdir()) == ["places.sqlite", "places.sqlite-wal"]
+        firefox.execute("INSERT INTO moz_places VALUES (5, 'https://python.org', 'python')")
+        firefox.commit()
+
+    assert sorted(path.name for path in Path(places).parent.iterdir()) == ["places.sqlite"]
+
+
+@patch("bookworm_genai.loaders.LOCK_FREE_VFS", "unknown-vfs")
+def test_firefox_bookmark_loader_locked_wal_copy(places: str):
+    with closing(sqlite3.connect(places)) as firefox:
+        firefox.execute("PRAGMA journal_mode = WAL")
+        firefox.execute("PRAGMA wal_autocheckpoint = 0")
+        firefox.execute("PRAGMA locking_mode = EXCLUSIVE")
+
+        firefox.execute("INSERT INTO moz_places VALUES (4, 'https://duckdb.org', 'duckdb')")
+        firefox.execute("INSERT INTO moz_bookmarks VALUES (5, 1, 4, 1, 'DuckDB', 1700000000000006, 1700000000000007)")
+        firefox.commit()
+
+        # e.g on Windows, which has no lock free VFS, the database is copied along with its log
+        with patch("bookworm_genai.loaders.shutil.copyfile", wraps=shutil.copyfile) as mock_copyfile:
+            docs = list(FirefoxBookmarkLoader(file_path=places).lazy_load())
+
+    assert mock_copyfile.call_count == 2
+    assert [json.loads(doc.page_content)["name"] for doc in docs] == ["Example", "GitHub", "DuckDB"]
+
+
+def test_firefox_bookmark_loader_glob(places: str, tmp_path):
+    docs = list(FirefoxBookmarkLoader(file_path=str(tmp_path / "*.sqlite")).lazy_load())
+
+    # the source is the expression from the configuration rather than the file it resolved to
+    assert {doc.metadata["source"] for doc in docs} == {str(tmp_path / "*.sqlite")}
+
+
+def test_firefox_bookmark_loader_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(FirefoxBookmarkLoader(file_path=str(tmp_path / "*" / "places.sqlite")).lazy_load())
+
+
+def test_firefox_bookmark_loader_delta(places: str):
+    loader = FirefoxBookmarkLoader(file_path=places)
+    list(loader.lazy_load())
+
+    assert loader.delta == BookmarkDelta(watermark=1700000000000005)
+
+    with closing(sqlite3.connect(places)) as conn:
+        # rename a bookmark and remove another one
+        conn.execute("UPDATE moz_bookmarks SET title = 'Example Domain', lastModified = 1700000000000010 WHERE id = 2")
+        conn.execute("DELETE FROM moz_bookmarks WHERE id = 3")
+        conn.commit()
+
+    loader = FirefoxBookmarkLoader(file_path=places, since=loader.delta.watermark)
+    docs = list(loader.lazy_load())
+
+    assert [json.loads(doc.page_content)["name"] for doc in docs] == ["Example Domain"]
+
+    # every place still bookmarked is listed so that removed bookmarks can be found
+    assert loader.delta == BookmarkDelta(watermark=1700000000000010, ids=["1"], changed=["1"])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from bookworm_genai.local_embeddings import HashingEmbeddings, _normalize
+
+
+def _bookmark(name: str, url: str) -> str:
+    return f'{{"guid": "0b5c9c1e-1d3f", "id": "42", "name": "{name}", "type": "url", "url": "{url}"}}'
+
+
+def test_hashing_embeddings_normalized():
+    embeddings = HashingEmbeddings(dimensions=64)
+
+    vectors = np.array(embeddings.embed_documents(["pandas documentation", "Rust book", ""]))
+
+    assert vectors.shape == (3, 64)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), [1.0, 1.0, 0.0])
+
+
+def test_hashing_embeddings_deterministic():
+    texts = [_bookmark("pandas documentation", "https://pandas.pydata.org/docs/"), "Rust book"]
+
+    # a text is embedded the same regardless of the batch it is in (or the instance embedding it)
+    assert HashingEmbeddings().embed_documents(texts)[1] == HashingEmbeddings().embed_documents(texts[1:])[0]
+    assert HashingEmbeddings().embed_query(texts[0]) == HashingEmbeddings().embed_documents(texts)[0]
+
+
+def test_hashing_embeddings_similarity():
+    embeddings = HashingEmbeddings()
+
+    documents = np.array(
+        embeddings.embed_documents(
+            [
+                _bookmark("pandas documentation", "https://pandas.pydata.org/docs/"),
+                _bookmark("The Rust Programming Language", "https://doc.rust-lang.org/book/"),
+                _bookmark("DuckDB full text search", "https://duckdb.org/docs/extensions/full_text_search"),
+            ]
+        )
+    )
+
+    for query, expected in [("panda docs", 0), ("rust language", 1), ("duckdb search", 2)]:
+        scores = documents @ np.array(embeddings.embed_query(query))
+        assert int(np.argmax(scores)) == expected, query
+
+
+def test_hashing_embeddings_dimensions():
+    with pytest.raises(ValueError, match="power of 2"):
+        HashingEmbeddings(dimensions=100)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        pytest.param('{"name": "Pandas Docs", "url": "https://pandas.pydata.org", "guid": "abc"}', "pandas docs https pandas pydata org", id="bookmark"),
+        pytest.param('{"name": null, "url": "https://example.com"}', "https example com", id="bookmark_without_name"),
+        pytest.param('{"query": "pandas"}', "query pandas", id="other_json"),
+        pytest.param("Héllo,  WORLD_snake", "héllo world snake", id="text"),
+    ],
+)
+def test_normalize(text: str, expected: str):
+    assert _normalize(text) == expected
@@ -1,3 +1,4 @@
+import logging
 from unittest.mock import Mock, patch, call
 
 import pytest
@@ -5,6 +6,19 @@ import pytest
 from bookworm_genai.__main__ import main
 
 
+@pytest.fixture(autouse=True)
+def mock_ask_server():
+    # no 'bookworm serve' is running unless a test says otherwise
+    with patch("bookworm_genai.client.ask", return_value=None) as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_paused_server():
+    with patch("bookworm_genai.client.paused_server") as mock:
+        yield mock
+
+
 @patch("bookworm_genai.__main__.sys")
 def test_main_no_arguments(mock_sys: Mock):
     mock_sys.argv = ["script"]
@@ -12,19 +26,19 @@ def test_main_no_arguments(mock_sys: Mock):
         main()
 
 
-@patch("bookworm_genai.__main__.browsers")
-@patch("bookworm_genai.__main__.sync")
+@patch("bookworm_genai.integrations.browsers")
+@patch("bookworm_genai.commands.sync.sync")
 @patch("bookworm_genai.__main__.sys")
 def test_main_sync(mock_sys: Mock, mock_sync: Mock, mock_browsers: Mock):
     mock_sys.argv = ["script", "sync"]
 
     main()
 
-    assert mock_sync.call_args_list == [call(mock_browsers, estimate_cost=False, browser_filter=[])]
+    assert mock_sync.call_args_list == [call(mock_browsers, estimate_cost=False, browser_filter=[], force=False)]
 
 
 @patch("builtins.input")
-@patch("bookworm_genai.__main__.BookmarkChain")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
 @patch("bookworm_genai.__main__.sys")
 def test_main_ask(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock):
     mock_sys.argv = ["script", "ask"]
@@ -48,7 +62,7 @@ def test_main_ask(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock):
 
 
 @patch("builtins.input")
-@patch("bookworm_genai.__main__.BookmarkChain")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
 @patch("bookworm_genai.__main__.sys")
 def test_main_ask_query(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock):
     query = "dummy search query"
@@ -73,7 +87,7 @@ def test_main_ask_query(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: M
 
 
 @patch("builtins.input")
-@patch("bookworm_genai.__main__.BookmarkChain")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
 @patch("bookworm_genai.__main__.sys")
 def test_main_ask_not_valid(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock):
     mock_sys.argv = ["script", "ask"]
@@ -90,7 +104,7 @@ def test_main_ask_not_valid(mock_sys: Mock, mock_bookmark_chain: Mock, mock_inpu
 
 
 @patch("builtins.input")
-@patch("bookworm_genai.__main__.BookmarkChain")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
 @patch("bookworm_genai.__main__.sys")
 def test_main_ask_no_results(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock, caplog):
     mock_sys.argv = ["script", "ask"]
@@ -106,7 +120,7 @@ def test_main_ask_no_results(mock_sys: Mock, mock_bookmark_chain: Mock, mock_inp
 
 
 @patch("builtins.input")
-@patch("bookworm_genai.__main__.BookmarkChain")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
 @patch("bookworm_genai.__main__.sys")
 def test_main_ask_invalid_input(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock):
     mock_sys.argv = ["script", "ask"]
@@ -136,18 +150,198 @@ def test_main_ask_invalid_input(mock_sys: Mock, mock_bookmark_chain: Mock, mock_
 @pytest.mark.parametrize(
     "arguments, expected_call",
     [
-        pytest.param([], [call("bookmarks.csv", index=False)], id="no_output_override"),
-        pytest.param(["--output", "hello.csv"], [call("hello.csv", index=False)], id="output_override"),
+        pytest.param([], [call("bookmarks.csv", format="csv", include_embeddings=False)], id="no_output_override"),
+        pytest.param(["--output", "hello.csv"], [call("hello.csv", format="csv", include_embeddings=False)], id="output_override"),
+        pytest.param(["--format", "parquet"], [call("bookmarks.parquet", format="parquet", include_embeddings=False)], id="parquet"),
+        pytest.param(["--format", "jsonl", "--include-embeddings"], [call("bookmarks.jsonl", format="jsonl", include_embeddings=True)], id="jsonl_embeddings"),
     ],
 )
-@patch("bookworm_genai.__main__.export")
+@patch("bookworm_genai.commands.export.export")
 @patch("bookworm_genai.__main__.sys")
 def test_main_export(mock_sys: Mock, mock_export: Mock, arguments: list[str], expected_call):
     mock_sys.argv = ["script", "export", *arguments]
 
-    mock_bookmarks = Mock()
-    mock_export.return_value = mock_bookmarks
+    main()
+
+    assert mock_export.call_args_list == expected_call
+
+
+@pytest.mark.parametrize(
+    "arguments, expected_call",
+    [
+        pytest.param([], call(vector_store_search_n=3, exact_search=False, use_llm=True, keyword_only=False), id="default"),
+        pytest.param(["--exact", "-n", "5"], call(vector_store_search_n=5, exact_search=True, use_llm=True, keyword_only=False), id="exact"),
+        pytest.param(["--no-llm"], call(vector_store_search_n=3, exact_search=False, use_llm=False, keyword_only=False), id="no_llm"),
+        pytest.param(["--keyword"], call(vector_store_search_n=3, exact_search=False, use_llm=True, keyword_only=True), id="keyword"),
+    ],
+)
+@patch("builtins.input")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+@patch("bookworm_genai.__main__.sys")
+def test_main_ask_search_arguments(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock, arguments: list[str], expected_call):
+    mock_sys.argv = ["script", "ask", "-q", "query", *arguments]
+
+    mock_bookmark_chain.return_value.__enter__.return_value.is_valid.return_value = False
+
+    main()
+
+    assert mock_bookmark_chain.call_args == expected_call
+
+
+@patch("builtins.input")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+@patch("bookworm_genai.__main__.sys")
+def test_main_ask_no_llm(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock):
+    mock_sys.argv = ["script", "ask", "-q", "query", "--no-llm"]
+    mock_input.side_effect = ["0"]
+
+    bc = Mock()
+    bc.is_valid.return_value = True
+    bc.search.return_value = Mock(bookmarks=[Mock(title="first", url="http://google.com", source="/file/hello.txt", score=0.9)])
+
+    mock_bookmark_chain.return_value.__enter__.return_value = bc
+
+    main()
+
+    assert bc.search.call_args_list == [call("query")]
+    assert not bc.ask.called
+    assert bc.search.return_value.bookmarks[0].open.called
+
+
+@patch("bookworm_genai.models.subprocess")
+@patch("builtins.input")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+@patch("bookworm_genai.__main__.sys")
+def test_main_ask_server(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock, mock_subprocess: Mock, mock_ask_server: Mock, caplog):
+    mock_sys.argv = ["script", "ask", "-q", "query", "-n", "5", "--no-llm"]
+    mock_input.side_effect = ["0"]
+
+    mock_ask_server.return_value = [
+        {"title": "first", "url": "http://google.com", "source": "/file/hello.txt", "browser": "chrome", "score": 0.0325, "score_type": "fused"}
+    ]
+
+    caplog.set_level(logging.INFO, logger="bookworm_genai.__main__")
+    main()
+
+    # the fused score of a hybrid search is labelled as such, it is not a similarity
+    assert "[dim]fused 0.033[/]" in caplog.text
+
+    assert mock_ask_server.call_args_list == [call("query", top_n=5, exact=False, use_llm=False, keyword_only=False)]
+    assert not mock_bookmark_chain.called, "the running server answers the query"
+    assert mock_subprocess.Popen.called, "the bookmark returned by the server is opened"
+
+
+@patch("builtins.input")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+@patch("bookworm_genai.__main__.sys")
+def test_main_ask_no_server(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock, mock_ask_server: Mock):
+    mock_sys.argv = ["script", "ask", "-q", "query", "--no-server"]
+
+    mock_bookmark_chain.return_value.__enter__.return_value.is_valid.return_value = False
+
+    main()
+
+    assert not mock_ask_server.called
+    assert mock_bookmark_chain.called
+
+
+@pytest.mark.parametrize(
+    "arguments, expected_call",
+    [
+        pytest.param([], [call(host="127.0.0.1", port=0)], id="default"),
+        pytest.param(["--host", "0.0.0.0", "--port", "8765"], [call(host="0.0.0.0", port=8765)], id="address"),
+    ],
+)
+@patch("bookworm_genai.commands.serve.serve")
+@patch("bookworm_genai.__main__.sys")
+def test_main_serve(mock_sys: Mock, mock_serve: Mock, arguments: list[str], expected_call):
+    mock_sys.argv = ["script", "serve", *arguments]
+
+    main()
+
+    assert mock_serve.call_args_list == expected_call
+
+
+@pytest.mark.parametrize(
+    "arguments, expected_call",
+    [
+        pytest.param(["--profile"], call(None, "chrome-trace"), id="profile"),
+        pytest.param(["--profile-output", "trace.json"], call("trace.json", "chrome-trace"), id="output"),
+        pytest.param(["--profile-output", "sync.prof", "--profile-format", "cprofile"], call("sync.prof", "cprofile"), id="format"),
+    ],
+)
+@patch("bookworm_genai.profiling.profile")
+@patch("bookworm_genai.integrations.browsers")
+@patch("bookworm_genai.commands.sync.sync")
+@patch("bookworm_genai.__main__.sys")
+def test_main_profile(mock_sys: Mock, mock_sync: Mock, mock_browsers: Mock, mock_profile: Mock, arguments: list[str], expected_call):
+    mock_sys.argv = ["script", *arguments, "sync"]
+
+    main()
+
+    assert mock_profile.call_args == expected_call
+    assert mock_sync.called
+
+
+@patch("bookworm_genai.profiling.profile")
+@patch("builtins.input")
+@patch("bookworm_genai.commands.ask.BookmarkChain")
+@patch("bookworm_genai.__main__.sys")
+def test_main_profile_ask(mock_sys: Mock, mock_bookmark_chain: Mock, mock_input: Mock, mock_profile: Mock):
+    mock_sys.argv = ["script", "--profile", "ask"]
+    mock_input.side_effect = ["pandas column", "0"]
+
+    bc = mock_bookmark_chain.return_value.__enter__.return_value
+    bc.is_valid.return_value = True
+    bc.ask.return_value = Mock(bookmarks=[Mock(title="first", url="http://google.com", source="/file/hello.txt")])
+
+    manager = Mock()
+    manager.attach_mock(mock_input, "input")
+    manager.attach_mock(mock_profile.return_value.__enter__, "start")
+    manager.attach_mock(mock_profile.return_value.__exit__, "stop")
+
+    main()
+
+    # the profile stops before waiting for the bookmark to open
+    assert [name for name, _, _ in manager.mock_calls] == ["input", "start", "stop", "input"]
+    assert bc.ask.return_value.bookmarks[0].open.called
+
+
+@patch("bookworm_genai.profiling.profile")
+@patch("bookworm_genai.integrations.browsers")
+@patch("bookworm_genai.commands.sync.sync")
+@patch("bookworm_genai.__main__.sys")
+def test_main_no_profile(mock_sys: Mock, mock_sync: Mock, mock_browsers: Mock, mock_profile: Mock):
+    mock_sys.argv = ["script", "sync"]
+
+    main()
+
+    assert not mock_profile.called
+
+
+@patch("builtins.input")
+@patch("bookworm_genai.commands.ask.answer_queries")
+@patch("bookworm_genai.__main__.sys")
+def test_main_ask_batch(mock_sys: Mock, mock_answer_queries: Mock, mock_input: Mock, tmp_path):
+    queries = tmp_path / "queries.txt"
+    queries.write_text("pandas column\n\n  duckdb  \n")
+
+    mock_sys.argv = ["script", "ask", "--batch", str(queries), "--output", "out.jsonl", "-n", "5", "--concurrency", "8"]
+
+    main()
+
+    assert mock_answer_queries.call_args_list == [call(["pandas column", "duckdb"], "out.jsonl", top_n=5, use_llm=True, keyword_only=False, max_concurrency=8)]
+
+    # nothing is asked for, so it can run from scripts
+    assert not mock_input.called
+
+
+@patch("bookworm_genai.commands.ask.answer_queries")
+@patch("bookworm_genai.__main__.sys")
+def test_main_ask_batch_stdin(mock_sys: Mock, mock_answer_queries: Mock):
+    mock_sys.argv = ["script", "ask", "--batch", "-", "--no-llm"]
+    mock_sys.stdin.readlines.return_value = ["pandas\n", "numpy\n"]
 
     main()
 
-    assert mock_bookmarks.to_csv.call_args_list == expected_call
+    assert mock_answer_queries.call_args_list == [call(["pandas", "numpy"], "results.jsonl", top_n=3, use_llm=False, keyword_only=False, max_concurrency=4)]
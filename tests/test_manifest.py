@@ -0,0 +1,121 @@
+import os
+
+import duckdb
+import pytest
+
+from bookworm_genai.manifest import ensure_table, fingerprint, invalidate, is_unchanged, record, watermark
+
+
+@pytest.fixture
+def conn():
+    with duckdb.connect() as conn:
+        ensure_table(conn)
+        yield conn
+
+
+@pytest.fixture
+def source(tmp_path) -> str:
+    path = tmp_path / "Bookmarks"
+    path.write_text('{"roots": {}}')
+    return str(path)
+
+
+def _hashed(path: str):
+    source = fingerprint(path)
+    source.compute_hash()
+    return source
+
+
+def _touch(path: str, offset: int):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + offset))
+
+
+def test_fingerprint(source: str, tmp_path):
+    result = fingerprint(str(tmp_path / "*"))
+
+    assert result.path == source
+    assert result.size == len('{"roots": {}}')
+    assert result.mtime_ns == os.stat(source).st_mtime_ns
+
+
+def test_fingerprint_missing(tmp_path):
+    assert fingerprint(str(tmp_path / "missing")) is None
+
+
+def test_fingerprint_includes_sidecar(tmp_path):
+    path = tmp_path / "places.sqlite"
+    path.write_bytes(b"database")
+    before = fingerprint(str(path))
+    before_hash = before.compute_hash()
+
+    # changes which are still in SQLite's write ahead log are part of the source
+    (tmp_path / "places.sqlite-wal").write_bytes(b"pending")
+    after = fingerprint(str(path))
+
+    assert after.size == before.size + len(b"pending")
+    assert after.compute_hash() != before_hash
+
+
+def test_is_unchanged(conn, source: str):
+    assert not is_unchanged(conn, "chrome", fingerprint(source)), "a source which was never synced has changed"
+
+    record(conn, "chrome", fingerprint(source))
+
+    assert is_unchanged(conn, "chrome", fingerprint(source))
+    assert not is_unchanged(conn, "brave", fingerprint(source))
+
+
+def test_is_unchanged_touched(conn, source: str):
+    record(conn, "chrome", _hashed(source))
+    _touch(source, 1_000_000_000)
+
+    touched = fingerprint(source)
+    assert is_unchanged(conn, "chrome", touched), "a touched source has the same content"
+
+    # the new time is remembered so the source is not hashed again
+    (mtime_ns,) = conn.execute("SELECT mtime_ns FROM sync_manifest WHERE browser = 'chrome'").fetchone()
+    assert mtime_ns == touched.mtime_ns
+
+
+def test_is_unchanged_modified(conn, source: str):
+    record(conn, "chrome", _hashed(source))
+
+    with open(source, "w") as f:
+        f.write('{"roots": {"a": 1}}')
+
+    assert not is_unchanged(conn, "chrome", fingerprint(source))
+
+    # same size but different content
+    record(conn, "chrome", _hashed(source))
+    with open(source, "w") as f:
+        f.write('{"roots": {"b": 1}}')
+    _touch(source, 1_000_000_000)
+
+    assert not is_unchanged(conn, "chrome", fingerprint(source))
+
+
+def test_invalidate(conn, source: str):
+    record(conn, "chrome", fingerprint(source))
+    record(conn, "brave", fingerprint(source))
+
+    invalidate(conn, ["chrome"])
+
+    assert not is_unchanged(conn, "chrome", fingerprint(source))
+    assert is_unchanged(conn, "brave", fingerprint(source))
+
+
+def test_is_unchanged_touched_without_hash(conn, source: str):
+    # sources loaded as deltas are not hashed, so any change in time means they are loaded
+    record(conn, "firefox", fingerprint(source), watermark=10)
+    _touch(source, 1_000_000_000)
+
+    assert not is_unchanged(conn, "firefox", fingerprint(source))
+
+
+def test_watermark(conn, source: str):
+    assert watermark(conn, "firefox") is None
+
+    record(conn, "firefox", fingerprint(source), watermark=1700000000000000)
+
+    assert watermark(conn, "firefox") == 1700000000000000
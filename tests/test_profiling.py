@@ -0,0 +1,125 @@
+import json
+import pstats
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+from bookworm_genai import profiling
+
+
+@pytest.fixture(autouse=True)
+def reset_profiler():
+    yield
+    profiling.disable()
+
+
+def test_span_disabled():
+    with profiling.span("embed") as span:
+        span.add_tokens(10)
+
+    assert not profiling.is_enabled()
+
+
+@patch("bookworm_genai.profiling.time")
+def test_span(mock_time):
+    mock_time.perf_counter.side_effect = [0.0, 1.0, 1.5, 2.0, 4.0]
+    profiler = profiling.enable()
+
+    with profiling.span("embed") as span:
+        span.add_tokens(10)
+
+    with profiling.span("embed") as span:
+        span.add_tokens(5)
+
+    assert list(profiler.stats) == ["embed"]
+    assert profiler.stats["embed"].calls == 2
+    assert profiler.stats["embed"].seconds == 2.5
+    assert profiler.stats["embed"].tokens == 15
+
+    assert [(event["name"], event["ts"], event["dur"], event["args"]) for event in profiler.events] == [
+        ("embed", 1_000_000, 500_000, {"tokens": 10}),
+        ("embed", 2_000_000, 2_000_000, {"tokens": 5}),
+    ]
+
+
+def test_span_error():
+    profiler = profiling.enable()
+
+    with pytest.raises(ValueError):
+        with profiling.span("insert"):
+            raise ValueError("failed")
+
+    assert profiler.stats["insert"].calls == 1
+
+
+def test_record():
+    profiling.record("llm", 1.0, 2.0, tokens=100)
+
+    profiler = profiling.enable()
+    profiling.record("llm", 1.0, 2.0, tokens=100)
+
+    assert profiler.stats["llm"] == profiling.SpanStats(calls=1, seconds=1.0, tokens=100)
+
+
+def test_iterate():
+    profiler = profiling.enable()
+
+    assert list(profiling.iterate("load", iter([1, 2, 3]))) == [1, 2, 3]
+
+    # the last call finds the iterator exhausted
+    assert profiler.stats["load"].calls == 4
+
+
+def test_profile(tmp_path, capsys):
+    output = str(tmp_path / "trace.json")
+
+    with profiling.profile(output) as profiler:
+        with profiling.span("search"):
+            pass
+
+    assert not profiling.is_enabled()
+    assert profiler.stats["search"].calls == 1
+
+    with open(output) as f:
+        trace = json.load(f)
+
+    assert [event["name"] for event in trace["traceEvents"]] == ["search"]
+    assert "search" in capsys.readouterr().err
+
+
+def test_profile_no_output(capsys):
+    with profiling.profile():
+        with profiling.span("search"):
+            pass
+
+    assert "search" in capsys.readouterr().err
+
+
+def test_profile_cprofile(tmp_path):
+    output = str(tmp_path / "profile.prof")
+
+    with profiling.profile(output, "cprofile"):
+        sorted([3, 2, 1])
+
+    stats = pstats.Stats(output)
+    assert any(function == "<built-in method builtins.sorted>" for _, _, function in stats.stats)
+
+
+def test_profile_tracemalloc(tmp_path):
+    output = str(tmp_path / "profile.tracemalloc")
+
+    with profiling.profile(output, "tracemalloc"):
+        allocated = [str(i) for i in range(1_000)]
+
+    assert allocated
+    assert not tracemalloc.is_tracing()
+    assert tracemalloc.Snapshot.load(output).statistics("filename")
+
+
+def test_profile_unknown_format():
+    with pytest.raises(ValueError, match="Unknown profile format"):
+        with profiling.profile("profile.out", "flamegraph"):
+            pass  # pragma: no cover
+
+    assert not profiling.is_enabled()
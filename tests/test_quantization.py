@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from bookworm_genai.quantization import candidate_dimensions, quantize, reduce_dimensions
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+
+
+def test_quantize():
+    vectors = np.random.default_rng(42).normal(size=(10, 600))
+
+    candidates, codes = quantize(vectors.tolist(), dimensions=64)
+
+    assert candidates.shape == (10, 64)
+    assert candidates.dtype == np.float32
+    assert np.allclose(np.linalg.norm(candidates, axis=1), 1.0)
+    assert np.allclose(_cosine(candidates, vectors[:, :64]), 1.0)
+
+    # every embedding uses the whole int8 range and barely moves
+    assert codes.shape == (10, 600)
+    assert codes.dtype == np.int8
+    assert (np.abs(codes).max(axis=1) == 127).all()
+    assert (_cosine(codes.astype(np.float32), vectors) > 0.999).all()
+
+
+def test_quantize_full_dimensions():
+    vectors = np.random.default_rng(42).normal(size=(10, 600))
+
+    # the embeddings of the model cannot be truncated, the index is built over the full embeddings instead
+    candidates, codes = quantize(vectors.tolist(), dimensions=None)
+
+    assert candidates is None
+    assert codes.shape == (10, 600)
+
+
+@pytest.mark.parametrize(
+    "model, expected",
+    [
+        pytest.param("text-embedding-3-small", 256, id="3-small"),
+        pytest.param("text-embedding-3-large", 256, id="3-large"),
+        pytest.param("text-embedding-ada-002", None, id="ada-002"),
+        pytest.param(None, None, id="unknown"),
+    ],
+)
+def test_candidate_dimensions(model, expected):
+    assert candidate_dimensions(model) == expected
+
+
+def test_quantize_zero_vector():
+    candidates, codes = quantize([[0.0] * 8], dimensions=4)
+
+    assert candidates.tolist() == [[0.0] * 4]
+    assert codes.tolist() == [[0] * 8]
+
+
+def test_reduce_dimensions():
+    # a single vector (e.g a query) or a vector which is already smaller than the dimensions
+    assert reduce_dimensions([3.0, 4.0, 12.0], dimensions=2).tolist() == [0.6000000238418579, 0.800000011920929]
+    assert reduce_dimensions([3.0, 4.0], dimensions=256).tolist() == [0.6000000238418579, 0.800000011920929]
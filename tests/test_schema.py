@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import duckdb
+import numpy as np
+import pytest
+
+from bookworm_genai.schema import BOOKMARK_COLUMNS, ensure_table, exists, insert, is_current
+
+
+@pytest.fixture
+def conn():
+    with duckdb.connect(":memory:") as conn:
+        yield conn
+
+
+def test_ensure_table(conn):
+    assert not exists(conn)
+    assert not is_current(conn)
+
+    ensure_table(conn)
+    assert exists(conn)
+    assert is_current(conn)
+
+    # nothing to do the second time
+    ensure_table(conn)
+    assert is_current(conn)
+
+
+def test_ensure_table_migrates(conn):
+    # the layout created by langchain's DuckDBVectorStore, with the keyword index of an older version
+    conn.execute("CREATE TABLE embeddings (id VARCHAR PRIMARY KEY, text VARCHAR, embedding FLOAT[], metadata VARCHAR)")
+    conn.executemany(
+        "INSERT INTO embeddings VALUES (?, ?, [1.0], ?)",
+        [
+            ("1", '{"name": "DuckDB", "url": "https://duckdb.org", "date_added": "13370000000000000"}', '{"browser": "chrome", "browsers": ["chrome"]}'),
+            (
+                "2",
+                '{"name": "Pandas", "url": "https://pandas.pydata.org", "dateAdded": 1725526400000000}',
+                '{"browser": "firefox", "embedding_backend": "local"}',
+            ),
+            ("3", "not a bookmark", "{}"),
+        ],
+    )
+    conn.execute("CREATE TABLE bookmark_text AS SELECT id, text AS title FROM embeddings")
+
+    assert exists(conn)
+    assert not is_current(conn)
+
+    ensure_table(conn)
+
+    assert is_current(conn)
+
+    rows = conn.execute("SELECT id, url, title, browser, date_added, embedding_backend, browsers FROM embeddings ORDER BY id").fetchall()
+    assert rows == [
+        ("1", "https://duckdb.org", "DuckDB", "chrome", datetime(2024, 9, 5, 8, 53, 20), "openai", ["chrome"]),
+        ("2", "https://pandas.pydata.org", "Pandas", "firefox", datetime(2024, 9, 5, 8, 53, 20), "local", []),
+        ("3", None, "not a bookmark", None, None, "openai", []),
+    ]
+
+    # the keyword index is built over the columns of the table instead
+    assert conn.execute("SELECT table_name FROM duckdb_tables() WHERE table_name = 'bookmark_text'").fetchall() == []
+
+
+def test_insert(conn):
+    ensure_table(conn)
+
+    insert(conn, ["1"], ['{"name": "DuckDB", "url": "https://duckdb.org"}'], [[1.0, 0.0]], [{"browser": "chrome", "browsers": ["chrome", "brave"]}])
+
+    row = conn.execute(f"SELECT embedding, metadata, {', '.join(BOOKMARK_COLUMNS)} FROM embeddings").fetchone()
+    columns = dict(zip(["embedding", "metadata", *BOOKMARK_COLUMNS], row))
+
+    assert columns["embedding"] == [1.0, 0.0]
+    assert columns["metadata"] == '{"browser": "chrome", "browsers": ["chrome", "brave"]}'
+    assert columns["url"] == "https://duckdb.org"
+    assert columns["browsers"] == ["chrome", "brave"]
+    assert columns["sources"] == []
+    assert columns["date_added"] is None
+
+
+def test_insert_many(conn):
+    ensure_table(conn)
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((1_000, 1_536), dtype=np.float32)
+
+    # embeddings are read from a registered DataFrame rather than passed as a parameter, which was about 10x slower
+    insert(conn, [str(i) for i in range(1_000)], ["{}"] * 1_000, embeddings, [{"browser": "chrome"}] * 1_000)
+
+    assert conn.execute("SELECT count(*) FROM embeddings").fetchone() == (1_000,)
+    assert conn.execute("SELECT embedding FROM embeddings WHERE id = '999'").fetchone()[0] == pytest.approx(embeddings[999].tolist())
+
+    # the staged rows are not left behind
+    assert conn.execute("SELECT view_name FROM duckdb_views() WHERE NOT internal").fetchall() == []
@@ -0,0 +1,263 @@
+import os
+import random
+from unittest.mock import patch
+
+import duckdb
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from bookworm_genai import schema
+from bookworm_genai.quantization import quantize
+
+from bookworm_genai.search import (
+    batch_similarity_search,
+    create_fts_index,
+    create_index,
+    drop_index,
+    has_fts_index,
+    has_index,
+    keyword_search,
+    load_fts,
+    load_vss,
+    quantized_search,
+    reciprocal_rank_fusion,
+    set_ef_search,
+    similarity_search,
+    stored_candidate_dimensions,
+)
+
+
+def _vector(rng: random.Random, dimensions: int = 8) -> list[float]:
+    return [rng.uniform(-1, 1) for _ in range(dimensions)]
+
+
+@pytest.fixture
+def connection():
+    rng = random.Random(42)
+
+    with duckdb.connect(":memory:") as conn:
+        conn.execute("CREATE TABLE embeddings (id VARCHAR PRIMARY KEY, text VARCHAR, embedding FLOAT[], metadata VARCHAR, title VARCHAR, url VARCHAR)")
+        conn.executemany(
+            "INSERT INTO embeddings VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    str(index),
+                    f"bookmark {index}",
+                    _vector(rng),
+                    f'{{"browser": "chrome", "index": {index}}}',
+                    f"bookmark {index}",
+                    f"https://example.com/{index}",
+                )
+                for index in range(200)
+            ],
+        )
+        yield conn
+
+
+requires_vss = pytest.mark.skipif(not load_vss(duckdb.connect(":memory:")), reason="DuckDB vss extension is not available")
+requires_fts = pytest.mark.skipif(not load_fts(duckdb.connect(":memory:")), reason="DuckDB fts extension is not available")
+
+
+def test_similarity_search_exact(connection):
+    query = connection.execute("SELECT embedding FROM embeddings WHERE id = '7'").fetchone()[0]
+
+    docs = similarity_search(connection, query, k=3, use_index=False)
+
+    assert len(docs) == 3
+    assert docs[0].page_content == "bookmark 7"
+    assert docs[0].metadata["browser"] == "chrome"
+    assert docs[0].metadata["title"] == "bookmark 7"
+    assert docs[0].metadata["url"] == "https://example.com/7"
+    assert docs[0].metadata["_similarity_score"] == pytest.approx(1.0)
+
+    scores = [doc.metadata["_similarity_score"] for doc in docs]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_batch_similarity_search(connection):
+    queries = [row[0] for row in connection.execute("SELECT embedding FROM embeddings WHERE id IN ('3', '7', '11') ORDER BY id").fetchall()]
+
+    results = batch_similarity_search(connection, queries, k=3)
+
+    assert len(results) == 3
+    for query, docs in zip(queries, results):
+        expected = similarity_search(connection, query, k=3, use_index=False)
+
+        assert [doc.page_content for doc in docs] == [doc.page_content for doc in expected]
+        assert [doc.metadata for doc in docs] == [doc.metadata for doc in expected]
+
+
+def test_batch_similarity_search_no_queries(connection):
+    assert batch_similarity_search(connection, [], k=3) == []
+
+
+@requires_vss
+def test_create_index(connection):
+    assert not has_index(connection)
+    assert create_index(connection)
+    assert has_index(connection)
+
+    # the embedding column is converted to a fixed size array which the index requires
+    column_type = connection.execute("SELECT data_type FROM information_schema.columns WHERE column_name = 'embedding'").fetchone()[0]
+    assert column_type == "FLOAT[8]"
+
+    # building the index again replaces it
+    assert create_index(connection)
+
+    drop_index(connection)
+    assert not has_index(connection)
+
+
+@requires_vss
+def test_similarity_search_index_matches_exact(connection):
+    create_index(connection)
+
+    rng = random.Random(7)
+    for _ in range(10):
+        query = _vector(rng)
+
+        exact = [doc.page_content for doc in similarity_search(connection, query, k=5, use_index=False)]
+        indexed = [doc.page_content for doc in similarity_search(connection, query, k=5, use_index=True)]
+
+        # on a corpus this small the HNSW graph finds the exact neighbours
+        assert indexed == exact
+
+
+@requires_vss
+@pytest.mark.parametrize(
+    "environ, expected",
+    [
+        pytest.param({}, 512, id="default"),
+        pytest.param({"BOOKWORM_HNSW_EF_SEARCH": "100"}, 100, id="configured"),
+    ],
+)
+def test_set_ef_search(connection, environ: dict, expected: int):
+    load_vss(connection)
+
+    with patch.dict(os.environ, environ, clear=True):
+        set_ef_search(connection)
+
+    assert connection.execute("SELECT current_setting('hnsw_ef_search')").fetchone()[0] == expected
+
+
+@pytest.fixture(params=[256, None], ids=["truncated", "full"])
+def quantized_connection(request):
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(200, 300))
+
+    with duckdb.connect(":memory:") as conn:
+        schema.ensure_table(conn)
+
+        candidates, codes = quantize(vectors.tolist(), dimensions=request.param)
+        schema.insert(
+            conn, [str(index) for index in range(200)], [f"bookmark {index}" for index in range(200)], vectors, [{"browser": "chrome"}] * 200, codes, candidates
+        )
+
+        yield conn, vectors, request.param
+
+
+def _cosine_similarities(vectors: np.ndarray, index: int) -> np.ndarray:
+    return (vectors @ vectors[index]) / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(vectors[index]))
+
+
+def test_quantized_search_exact(quantized_connection):
+    conn, vectors, _ = quantized_connection
+
+    docs = quantized_search(conn, vectors[7].tolist(), k=3, use_index=False)
+
+    # the candidates are rescored against the float32 embeddings, so the scores are those of a float32 search
+    similarities = _cosine_similarities(vectors, 7)
+    expected = np.argsort(-similarities)[:3]
+
+    assert [doc.page_content for doc in docs] == [f"bookmark {index}" for index in expected]
+    assert [doc.metadata["_similarity_score"] for doc in docs] == pytest.approx(similarities[expected].tolist(), abs=1e-6)
+
+
+@requires_vss
+def test_quantized_search_index(quantized_connection):
+    conn, vectors, dimensions = quantized_connection
+    create_index(conn)
+
+    assert stored_candidate_dimensions(conn) == dimensions
+
+    # the index is built over the first dimensions when the model allows it, otherwise over the full embeddings
+    column = "embedding" if dimensions is None else "embedding_candidate"
+    column_type = conn.execute("SELECT data_type FROM information_schema.columns WHERE column_name = ?", [column]).fetchone()[0]
+    assert column_type == f"FLOAT[{dimensions or 300}]"
+
+    for index in range(10):
+        indexed = quantized_search(conn, vectors[index].tolist(), k=3, use_index=True, candidate_dimensions=dimensions)
+
+        # rescoring the candidates ranks them by the full embedding
+        assert indexed[0].page_content == f"bookmark {index}"
+        assert [doc.page_content for doc in indexed] == [doc.page_content for doc in quantized_search(conn, vectors[index].tolist(), k=3, use_index=False)]
+
+
+@requires_vss
+def test_batch_similarity_search_quantized(quantized_connection):
+    conn, vectors, _ = quantized_connection
+    create_index(conn)
+
+    results = batch_similarity_search(conn, vectors[:5].tolist(), k=3, quantized=True)
+
+    for index, docs in enumerate(results):
+        expected = quantized_search(conn, vectors[index].tolist(), k=3, use_index=False)
+
+        assert [doc.page_content for doc in docs] == [doc.page_content for doc in expected]
+        assert [doc.metadata["_similarity_score"] for doc in docs] == pytest.approx([doc.metadata["_similarity_score"] for doc in expected])
+
+
+def test_create_index_empty_table():
+    with duckdb.connect(":memory:") as conn:
+        conn.execute("CREATE TABLE embeddings (id VARCHAR PRIMARY KEY, text VARCHAR, embedding FLOAT[], metadata VARCHAR)")
+
+        assert not create_index(conn)
+        assert not has_index(conn)
+
+
+@requires_fts
+def test_keyword_search():
+    with duckdb.connect(":memory:") as conn:
+        schema.ensure_table(conn)
+        schema.insert(
+            conn,
+            ["1", "2", "3"],
+            [
+                '{"name": "Pandas documentation", "url": "https://pandas.pydata.org/docs/"}',
+                '{"name": "Login is broken", "url": "https://jira.example.com/browse/PROJ-1234"}',
+                "a bookmark which is not json",
+            ],
+            [[1.0]] * 3,
+            [{"browser": "chrome"}, {"browser": "firefox"}, {"browser": "brave"}],
+        )
+
+        assert not has_fts_index(conn)
+        assert create_fts_index(conn)
+        assert has_fts_index(conn)
+
+        # words are stemmed, digits are kept and both the title and the url are matched
+        assert [doc.page_content for doc in keyword_search(conn, "documents", k=3)] == [
+            '{"name": "Pandas documentation", "url": "https://pandas.pydata.org/docs/"}'
+        ]
+        assert [doc.metadata["browser"] for doc in keyword_search(conn, "proj-1234", k=3)] == ["firefox"]
+        assert [doc.metadata["browser"] for doc in keyword_search(conn, "pydata", k=3)] == ["chrome"]
+        assert [doc.metadata["browser"] for doc in keyword_search(conn, "json bookmark", k=3)] == ["brave"]
+
+        assert keyword_search(conn, "proj-1234", k=3)[0].metadata["_keyword_score"] > 0
+        assert keyword_search(conn, "rust", k=3) == []
+
+
+def test_reciprocal_rank_fusion():
+    def _doc(content: str, browser: str = "chrome", **scores) -> Document:
+        return Document(page_content=content, metadata={"browser": browser, **scores})
+
+    similar = [_doc("a", _similarity_score=0.9), _doc("b", _similarity_score=0.8), _doc("c", _similarity_score=0.7)]
+    keyword = [_doc("c", _keyword_score=5.0), _doc("d", _keyword_score=4.0), _doc("a", browser="firefox", _keyword_score=3.0)]
+
+    docs = reciprocal_rank_fusion([similar, keyword], k=3)
+
+    # c is found by both searches, the same content from another browser is a different document and ties keep the order of the rankings
+    assert [(doc.page_content, doc.metadata["browser"]) for doc in docs] == [("c", "chrome"), ("a", "chrome"), ("b", "chrome")]
+    assert docs[0].metadata == {"browser": "chrome", "_similarity_score": 0.7, "_keyword_score": 5.0, "_rrf_score": pytest.approx(1 / 63 + 1 / 61)}
+    assert docs[1].metadata["_rrf_score"] == pytest.approx(1 / 61)
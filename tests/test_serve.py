@@ -0,0 +1,142 @@
+import json
+import os
+from unittest.mock import MagicMock, Mock, patch, call
+
+import pytest
+
+from bookworm_genai.commands.serve import BookmarkService, _remove_server_file, _write_server_file, serve
+
+
+@patch("bookworm_genai.commands.serve.BookmarkChain")
+def test_service_reuses_chains(mock_bookmark_chain: Mock):
+    chain = mock_bookmark_chain.return_value
+    chain.is_valid.return_value = True
+    chain.ask.return_value.bookmarks = [Mock(**{"dict.return_value": {"title": "bookworm"}})]
+
+    service = BookmarkService()
+
+    assert service.ask("first query") == [{"title": "bookworm"}]
+    assert service.ask("second query") == [{"title": "bookworm"}]
+    service.ask("third query", top_n=5, use_llm=False)
+
+    # the chain (and its connection) is opened once for each configuration it is asked with
+    assert mock_bookmark_chain.call_args_list == [
+        call(vector_store_search_n=3, exact_search=False, use_llm=True, keyword_only=False),
+        call(vector_store_search_n=5, exact_search=False, use_llm=False, keyword_only=False),
+    ]
+    assert chain.ask.call_args_list == [call("first query"), call("second query")]
+    assert chain.search.call_args_list == [call("third query")]
+
+
+@patch("bookworm_genai.commands.serve.MAX_CHAINS", 2)
+@patch("bookworm_genai.commands.serve.BookmarkChain")
+def test_service_closes_least_recently_used_chain(mock_bookmark_chain: Mock):
+    first, second, third = (MagicMock(**{"ask.return_value.bookmarks": []}) for _ in range(3))
+    mock_bookmark_chain.side_effect = [first, second, third]
+
+    service = BookmarkService()
+    service.ask("query", top_n=1)
+    service.ask("query", top_n=2)
+    service.ask("query", top_n=1)
+    service.ask("query", top_n=3)
+
+    assert mock_bookmark_chain.call_count == 3
+    assert not first.__exit__.called
+    assert second.__exit__.called, "the least recently asked chain is closed"
+
+
+@pytest.mark.parametrize("top_n", [0, -1, "3", 2.5, True, None])
+@patch("bookworm_genai.commands.serve.BookmarkChain")
+def test_service_invalid_top_n(mock_bookmark_chain: Mock, top_n):
+    with pytest.raises(ValueError, match="top_n must be a positive number"):
+        BookmarkService().ask("query", top_n=top_n)
+
+    assert not mock_bookmark_chain.called
+
+
+@patch("bookworm_genai.commands.serve.BookmarkChain")
+def test_service_not_valid(mock_bookmark_chain: Mock):
+    mock_bookmark_chain.return_value.is_valid.return_value = False
+
+    assert BookmarkService().ask("query") == []
+    assert not mock_bookmark_chain.return_value.ask.called
+
+
+@patch("bookworm_genai.commands.serve.BookmarkChain")
+def test_service_pause(mock_bookmark_chain: Mock):
+    service = BookmarkService()
+    service.warm()
+
+    service.pause(os.getpid())
+
+    assert service.is_paused()
+    assert mock_bookmark_chain.return_value.__exit__.called, "the database is closed while paused"
+
+    service.resume()
+    service.ask("query")
+
+    assert not service.is_paused()
+    assert mock_bookmark_chain.call_count == 2, "the database is opened again after the pause"
+
+
+@patch("bookworm_genai.commands.serve._is_running", return_value=False)
+def test_service_pause_process_gone(mock_is_running: Mock):
+    service = BookmarkService()
+    service.pause(123456)
+
+    # the syncing process exited without resuming (e.g it was killed)
+    assert not service.is_paused()
+
+
+@patch("bookworm_genai.commands.serve.BookmarkChain")
+def test_service_warm_failure(mock_bookmark_chain: Mock):
+    mock_bookmark_chain.side_effect = ValueError("The bookmark database was created by an older version")
+
+    # the daemon still starts, the error is raised by the first query instead
+    BookmarkService().warm()
+
+    with pytest.raises(ValueError, match="older version"):
+        BookmarkService().ask("query")
+
+
+@patch("bookworm_genai.commands.serve._get_server_file")
+def test_server_file(mock_get_server_file: Mock, tmp_path):
+    path = tmp_path / "server.json"
+    mock_get_server_file.return_value = str(path)
+
+    _write_server_file("127.0.0.1", 8765)
+    assert json.loads(path.read_text()) == {"host": "127.0.0.1", "port": 8765, "pid": os.getpid()}
+
+    # a daemon started since owns the file
+    _remove_server_file(9999)
+    assert path.exists()
+
+    _remove_server_file(8765)
+    assert not path.exists()
+
+
+@pytest.mark.parametrize("host", ["0.0.0.0", "192.168.1.10", "::", "example.com"])
+@patch("bookworm_genai.commands.serve.BookmarkServer")
+@patch("bookworm_genai.commands.serve.BookmarkService")
+def test_serve_rejects_non_loopback(mock_bookmark_service: Mock, mock_bookmark_server: Mock, host: str):
+    with pytest.raises(ValueError, match="not a loopback address"):
+        serve(host=host)
+
+    assert not mock_bookmark_service.called
+    assert not mock_bookmark_server.called
+
+
+@pytest.mark.parametrize("host", ["127.0.0.1", "127.0.0.2", "::1", "localhost"])
+@patch("bookworm_genai.commands.serve._remove_server_file")
+@patch("bookworm_genai.commands.serve._write_server_file")
+@patch("bookworm_genai.commands.serve.BookmarkServer")
+@patch("bookworm_genai.commands.serve.BookmarkService")
+def test_serve_loopback(mock_bookmark_service: Mock, mock_bookmark_server: Mock, mock_write_server_file: Mock, mock_remove_server_file: Mock, host: str):
+    server = mock_bookmark_server.return_value.__enter__.return_value
+    server.server_address = (host, 8765)
+    server.serve_forever.side_effect = KeyboardInterrupt
+
+    serve(host=host)
+
+    assert mock_bookmark_server.call_args[0][0] == (host, 0)
+    assert mock_write_server_file.call_args_list == [call(host, 8765)]
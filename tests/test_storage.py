@@ -1,48 +1,574 @@
 import os
+import json
+import hashlib
+from datetime import datetime
 from unittest.mock import patch, Mock, call
 
+import duckdb
 import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
 
-from bookworm_genai.storage import store_documents
+from bookworm_genai.cache import CachedQueryEmbeddings
+from bookworm_genai.embeddings import ConcurrentEmbeddings
+from bookworm_genai.loaders import BookmarkDelta
+from bookworm_genai.manifest import fingerprint
+from bookworm_genai.search import has_index, keyword_search, load_fts
+from bookworm_genai.local_embeddings import LOCAL_EMBEDDING_MODEL, HashingEmbeddings
+from bookworm_genai.storage import (
+    EmbeddingBackend,
+    EmbeddingStorage,
+    store_documents,
+    StoreResult,
+    SyncSession,
+    _document_id,
+    _get_embedding_backend,
+    _get_embedding_storage,
+    _get_query_embedding_store,
+    _is_quantized,
+    unsent_documents,
+)
+
+
+def _doc(content: str, browser: str = "chrome") -> Document:
+    return Document(page_content=content, metadata={"browser": browser})
+
+
+def _bookmark(url: str, browser: str = "chrome", source: str = "") -> Document:
+    return Document(page_content=f'{{"name": "{url}", "url": "{url}"}}', metadata={"browser": browser, "source": source or f"/{browser}/Bookmarks"})
+
+
+def _fake_embeddings() -> Mock:
+    return Mock(wraps=DeterministicFakeEmbedding(size=4), model="fake-embedding", dimensions=None)
+
+
+def _stored(path: str, column: str = "text") -> list:
+    with duckdb.connect(path) as conn:
+        return sorted(row[0] for row in conn.execute(f"SELECT {column} FROM embeddings").fetchall())
+
+
+@pytest.fixture
+def local_store(tmp_path):
+    path = str(tmp_path / "bookmarks.duckdb")
+
+    with patch("bookworm_genai.storage._get_local_store", return_value=path):
+        yield path
+
+
+@pytest.fixture
+def embeddings():
+    embeddings = _fake_embeddings()
+
+    with patch("bookworm_genai.storage._get_embedding_store", return_value=embeddings):
+        yield embeddings
 
 
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+@patch("bookworm_genai.storage.ConcurrentEmbeddings", side_effect=lambda e: ConcurrentEmbeddings(e, show_progress=False))
 @patch("bookworm_genai.storage.OpenAIEmbeddings")
-@patch("bookworm_genai.storage.DuckDBVectorStore")
-@patch("bookworm_genai.storage.duckdb")
-@patch("bookworm_genai.storage.PlatformDirs")
-@patch("bookworm_genai.storage.os.makedirs")
+@patch("bookworm_genai.paths.PlatformDirs")
+@patch("bookworm_genai.paths.os.makedirs")
 def test_store_documents(
     mock_os_makedirs: Mock,
     mock_platform_dirs: Mock,
-    mock_duckdb: Mock,
-    mock_duckdb_vector: Mock,
     mock_openai_embeddings: Mock,
+    mock_concurrent_embeddings: Mock,
+    tmp_path,
 ):
-    docs = [Mock(), Mock()]
+    mock_platform_dirs.return_value.user_data_dir = str(tmp_path)
+    mock_openai_embeddings.return_value = _fake_embeddings()
 
-    mock_user_data_dir = "/test"
-    mock_platform_dirs.return_value.user_data_dir = mock_user_data_dir
-
-    store_documents(docs)
+    result = store_documents([_doc("first"), _doc("second")])
 
     assert mock_platform_dirs.call_args_list == [call("bookworm", "bookworm")]
-    assert mock_duckdb.connect.call_args_list == [call(f"{mock_user_data_dir}/bookmarks.duckdb")]
-    assert mock_os_makedirs.call_args_list == [call(mock_user_data_dir, exist_ok=True)]
+    assert mock_os_makedirs.call_args_list == [call(str(tmp_path), exist_ok=True)]
+
+    # the embeddings service is wrapped so that cache misses are embedded concurrently
+    assert mock_concurrent_embeddings.call_args_list == [call(mock_openai_embeddings.return_value)]
+    assert mock_openai_embeddings.return_value.aembed_documents.call_args_list == [call(["first", "second"])]
 
-    mock_duckb_connection = mock_duckdb.connect.return_value.__enter__.return_value
-    assert mock_duckb_connection.execute.call_args_list == [call("DROP TABLE IF EXISTS embeddings")]
-    assert mock_duckdb_vector.from_documents.call_args_list == [call(docs, mock_openai_embeddings.return_value, connection=mock_duckb_connection)]
+    assert result == StoreResult(added=2, removed=0, unchanged=0)
+    assert _stored(str(tmp_path / "bookmarks.duckdb")) == ["first", "second"]
 
 
 @patch.dict(os.environ, {}, clear=True)
-@patch("bookworm_genai.storage.PlatformDirs")
-@patch("bookworm_genai.storage.os.makedirs")
-def test_no_proper_embedding_environment(
-    mock_os_makedirs: Mock,
-    mock_platform_dirs: Mock,
-):
-    docs = [Mock(), Mock()]
+def test_no_proper_embedding_environment(local_store):
+    docs = [_doc("first"), _doc("second")]
 
     with pytest.raises(ValueError, match="Embeddings service could not be configured"):
         store_documents(docs)
+
+
+def test_store_documents_incremental(local_store, embeddings):
+    first = store_documents([_doc("first"), _doc("second"), _doc("third", browser="firefox")])
+    assert first == StoreResult(added=3, removed=0, unchanged=0)
+
+    # "second" was removed and "fourth" was added in chrome, firefox was not part of this sync
+    second = store_documents([_doc("first"), _doc("fourth")], browsers=["chrome"])
+    assert second == StoreResult(added=1, removed=1, unchanged=1)
+
+    assert embeddings.aembed_documents.call_args_list == [call(["first", "second", "third"]), call(["fourth"])]
+    assert _stored(local_store) == ["first", "fourth", "third"]
+
+
+def test_store_documents_nothing_changed(local_store):
+    docs = [_doc("first"), _doc("second")]
+
+    with patch("bookworm_genai.storage._get_embedding_store", return_value=_fake_embeddings()):
+        store_documents(docs)
+
+    with patch("bookworm_genai.storage._get_embedding_store") as mock_embedding_store:
+        result = store_documents(docs)
+
+    assert result == StoreResult(added=0, removed=0, unchanged=2)
+    assert not mock_embedding_store.called
+
+
+def test_store_documents_bookmark_opened(local_store, embeddings):
+    def chromium(date_last_used: str, folder: str = "Databases") -> Document:
+        content = {"name": "DuckDB", "url": "https://duckdb.org", "date_last_used": date_last_used, "meta_info": {"last_visited_desktop": date_last_used}}
+        return Document(page_content=json.dumps(content), metadata={"browser": "chrome", "source": "/chrome/Bookmarks", "folder": folder})
+
+    store_documents([chromium("0")])
+
+    # opening the bookmark only changes when it was last used, it is not embedded again
+    assert store_documents([chromium("13370000000000000")]) == StoreResult(added=0, removed=0, unchanged=1)
+    assert embeddings.aembed_documents.call_count == 1
+
+    # moving it to another folder is a change
+    assert store_documents([chromium("13370000000000000", folder="Tools")]) == StoreResult(added=1, removed=1, unchanged=0)
+
+
+def test_unsent_documents(local_store, embeddings):
+    stored = _bookmark("https://example.com")
+    other_browser = _bookmark("https://brave.com", browser="brave")
+    removed = _bookmark("https://removed.com")
+
+    store_documents([stored, other_browser, removed])
+
+    # removed from the store but its embedding is still cached
+    store_documents([stored, other_browser])
+
+    new = _bookmark("https://new.com")
+    docs = [stored, _bookmark("https://brave.com"), removed, new]
+
+    assert unsent_documents(docs, ["chrome"], embeddings) == [new]
+
+    # brave is synced as well, so its stored copy of the url would be replaced by chrome's copy (with a cached embedding)
+    assert unsent_documents(docs, ["brave", "chrome"], embeddings) == [new]
+
+    assert unsent_documents(docs, ["chrome"], _fake_embeddings()) == [new]
+    assert unsent_documents(docs, ["chrome"], Mock(model="other-embedding", dimensions=None)) == [removed, new]
+
+
+def test_unsent_documents_no_store(local_store, embeddings):
+    docs = [_bookmark("https://example.com")]
+
+    assert unsent_documents(docs, ["chrome"], embeddings) == docs
+    assert not os.path.exists(local_store)
+
+
+def test_store_documents_chunks_committed(local_store, embeddings):
+    docs = [_doc(f"bookmark {index}") for index in range(5)]
+
+    def _docs():
+        yield from docs[:3]
+        raise RuntimeError("browser went away")
+
+    # chunks which were committed before the failure are kept (and do not need embedding again)
+    with pytest.raises(RuntimeError):
+        store_documents(_docs(), chunk_size=2)
+
+    assert _stored(local_store) == ["bookmark 0", "bookmark 1"]
+
+    result = store_documents(docs, chunk_size=2)
+
+    assert result == StoreResult(added=3, removed=0, unchanged=2)
+    assert embeddings.aembed_documents.call_args_list == [call(["bookmark 0", "bookmark 1"]), call(["bookmark 2", "bookmark 3"]), call(["bookmark 4"])]
+
+
+def test_store_documents_deduplicates(local_store, embeddings):
+    docs = [
+        _bookmark("https://example.com/", browser="brave"),
+        _bookmark("https://other.com", browser="brave"),
+        _bookmark("http://example.com?utm_source=newsletter", browser="chrome"),
+        _bookmark("https://example.com#top", browser="firefox", source="/firefox/places.sqlite"),
+    ]
+
+    # a chunk size of 1 ensures duplicates are detected across chunks
+    result = store_documents(docs, chunk_size=1)
+
+    assert result == StoreResult(added=2, removed=0, unchanged=0)
+    assert embeddings.aembed_documents.call_args_list == [call([docs[0].page_content]), call([docs[1].page_content])]
+
+    with duckdb.connect(local_store) as conn:
+        provenance = conn.execute("SELECT browsers, sources FROM embeddings ORDER BY url").fetchall()
+
+    assert provenance == [
+        (["brave", "chrome", "firefox"], ["/brave/Bookmarks", "/chrome/Bookmarks", "/firefox/places.sqlite"]),
+        (["brave"], ["/brave/Bookmarks"]),
+    ]
+
+
+def test_store_documents_typed_columns(local_store, embeddings):
+    content = {"name": "DuckDB", "url": "https://duckdb.org", "date_added": "13370000000000000"}
+    doc = Document(page_content=json.dumps(content), metadata={"browser": "chrome", "source": "/chrome/Bookmarks", "folder": "Databases"})
+
+    store_documents([doc])
+
+    with duckdb.connect(local_store) as conn:
+        row = conn.execute("SELECT url, title, browser, source, folder, normalized_url, date_added, content_hash, embedding_backend FROM embeddings").fetchone()
+
+    assert row == (
+        "https://duckdb.org",
+        "DuckDB",
+        "chrome",
+        "/chrome/Bookmarks",
+        "Databases",
+        "https://duckdb.org",
+        datetime(2024, 9, 5, 8, 53, 20),
+        hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest(),
+        "openai",
+    )
+
+
+def test_store_documents_migrates(local_store, embeddings):
+    doc = _bookmark("https://example.com")
+    metadata = {**doc.metadata, "normalized_url": "https://example.com", "browsers": ["chrome"], "sources": ["/chrome/Bookmarks"]}
+
+    # a store created by an older version, which only had the layout of langchain's DuckDBVectorStore
+    with duckdb.connect(local_store) as conn:
+        conn.execute("CREATE TABLE embeddings (id VARCHAR PRIMARY KEY, text VARCHAR, embedding FLOAT[], metadata VARCHAR)")
+        conn.execute("INSERT INTO embeddings VALUES (?, ?, [0.1, 0.2, 0.3, 0.4], ?)", [_document_id(doc), doc.page_content, json.dumps(metadata)])
+
+    result = store_documents([_bookmark("https://example.com"), _bookmark("https://other.com")])
+
+    # the stored bookmark is kept (not embedded again) and its columns are derived from the stored text and metadata
+    assert result == StoreResult(added=1, removed=0, unchanged=1)
+    assert embeddings.aembed_documents.call_args_list == [call([_bookmark("https://other.com").page_content])]
+    assert _stored(local_store, "url") == ["https://example.com", "https://other.com"]
+    assert _stored(local_store, "browsers") == [["chrome"], ["chrome"]]
+
+    with duckdb.connect(local_store) as conn:
+        assert has_index(conn)
+
+
+def test_store_documents_refreshes_provenance(local_store, embeddings):
+    store_documents([_bookmark("https://example.com", browser="chrome")])
+
+    # the same url now also exists in firefox, the stored document only needs its metadata updated
+    result = store_documents([_bookmark("https://example.com", browser="chrome"), _bookmark("https://example.com", browser="firefox")])
+
+    assert result == StoreResult(added=0, removed=0, unchanged=1)
+    assert embeddings.aembed_documents.call_count == 1
+    assert _stored(local_store, "browsers") == [["chrome", "firefox"]]
+    assert _stored(local_store, "sources") == [["/chrome/Bookmarks", "/firefox/Bookmarks"]]
+
+
+def test_store_documents_scoped_keeps_other_browsers(local_store, embeddings):
+    store_documents([_bookmark("https://example.com", browser="brave"), _bookmark("https://example.com", browser="chrome")])
+
+    # brave was not loaded (e.g its bookmarks did not change) so chrome's copy of the url is not stored again
+    result = store_documents([_bookmark("https://example.com", browser="chrome"), _bookmark("https://other.com", browser="chrome")], browsers=["chrome"])
+
+    assert result == StoreResult(added=1, removed=0, unchanged=1)
+    assert embeddings.aembed_documents.call_count == 2
+    assert _stored(local_store, "browser") == ["brave", "chrome"]
+
+
+def test_store_documents_scoped_keeps_provenance(local_store, embeddings):
+    store_documents([_bookmark("https://example.com", browser="chrome"), _bookmark("https://example.com", browser="brave")])
+
+    # brave was skipped (e.g its bookmarks did not change), it still holds the url which chrome stores
+    result = store_documents([_bookmark("https://example.com", browser="chrome"), _bookmark("https://other.com", browser="chrome")], browsers=["chrome"])
+
+    assert result == StoreResult(added=1, removed=0, unchanged=1)
+    assert _stored(local_store, "browsers") == [["chrome"], ["chrome", "brave"]]
+    assert _stored(local_store, "sources") == [["/chrome/Bookmarks"], ["/chrome/Bookmarks", "/brave/Bookmarks"]]
+
+
+def test_store_documents_scoped_deferred_provenance(local_store, embeddings):
+    store_documents([_bookmark("https://example.com", browser="brave")])
+
+    # chrome's copy of the url is deferred to the one stored by brave, which records that chrome also holds it
+    result = store_documents([_bookmark("https://example.com", browser="chrome")], browsers=["chrome"])
+
+    assert result == StoreResult(added=0, removed=0, unchanged=1)
+    assert _stored(local_store, "browser") == ["brave"]
+    assert _stored(local_store, "browsers") == [["brave", "chrome"]]
+
+    # chrome removed the url, brave still holds it
+    result = store_documents([_bookmark("https://other.com", browser="chrome")], browsers=["chrome"])
+
+    assert result == StoreResult(added=1, removed=0, unchanged=0)
+    assert _stored(local_store, "browsers") == [["brave"], ["chrome"]]
+    assert _stored(local_store, "sources") == [["/brave/Bookmarks"], ["/chrome/Bookmarks"]]
+
+
+def test_store_documents_hands_over_removed_documents(local_store, embeddings, tmp_path):
+    source = tmp_path / "Bookmarks"
+    source.write_text("{}")
+
+    with SyncSession() as session:
+        session.add([_bookmark("https://example.com", browser="chrome"), _bookmark("https://example.com", browser="brave")])
+        session.finish(sources={"chrome": fingerprint(str(source)), "brave": fingerprint(str(source))})
+
+    # chrome held the stored copy of a url which brave (which was skipped) also has
+    with SyncSession() as session:
+        session.scope(["chrome"])
+        result = session.finish(browsers=["chrome"], sources={"chrome": fingerprint(str(source))})
+
+        # brave is loaded again on the next sync to store its own copy
+        assert session.is_unchanged("chrome", fingerprint(str(source)))
+        assert not session.is_unchanged("brave", fingerprint(str(source)))
+
+    # the bookmark is handed over to brave rather than removed until brave is synced again
+    assert result == StoreResult(added=0, removed=0, unchanged=0)
+    assert _stored(local_store, "url") == ["https://example.com"]
+    assert _stored(local_store, "browser") == ["brave"]
+    assert _stored(local_store, "source") == ["/brave/Bookmarks"]
+    assert _stored(local_store, "browsers") == [["brave"]]
+    assert embeddings.aembed_documents.call_count == 1
+
+    # once brave is synced its own copy replaces the one it was handed
+    result = store_documents([_bookmark("https://example.com", browser="brave")], browsers=["brave"])
+
+    assert result == StoreResult(added=1, removed=1, unchanged=0)
+    assert _stored(local_store, "browser") == ["brave"]
+    assert _stored(local_store, "browsers") == [["brave"]]
+
+
+def test_store_documents_delta(local_store, embeddings, tmp_path):
+    def _firefox(place_id: str, name: str) -> Document:
+        content = json.dumps({"id": place_id, "url": f"https://{place_id}.com", "name": name})
+        return Document(page_content=content, metadata={"browser": "firefox", "source": "places.sqlite"})
+
+    source = fingerprint(str(tmp_path))
+
+    with SyncSession() as session:
+        session.add([_firefox("1", "one"), _firefox("2", "two"), _firefox("3", "three")])
+        session.finish(browsers=["firefox"], sources={"firefox": source}, deltas={"firefox": BookmarkDelta(watermark=10)})
+
+        assert session.watermark("firefox") == 10
+
+    # only the changes since the watermark are loaded: 1 was renamed, 2 is unchanged and 3 was removed
+    with SyncSession() as session:
+        session.scope([])
+        session.add([_firefox("1", "one renamed")])
+        result = session.finish(browsers=[], sources={"firefox": source}, deltas={"firefox": BookmarkDelta(watermark=20, ids=["1", "2"], changed=["1"])})
+
+        assert session.watermark("firefox") == 20
+
+    assert result == StoreResult(added=1, removed=2, unchanged=0)
+    assert embeddings.aembed_documents.call_args_list[-1] == call([_firefox("1", "one renamed").page_content])
+    assert _stored(local_store, "text->>'$.name'") == ["one renamed", "two"]
+
+
+def test_store_documents_builds_index(local_store, embeddings):
+    store_documents([_doc("first"), _doc("second")])
+
+    with duckdb.connect(local_store) as conn:
+        from bookworm_genai.search import load_vss
+
+        if not load_vss(conn):
+            pytest.skip("DuckDB vss extension is not available")
+
+        assert has_index(conn)
+
+
+def test_store_documents_builds_keyword_index(local_store, embeddings):
+    store_documents([_bookmark("https://pandas.pydata.org"), _bookmark("https://duckdb.org")])
+
+    with duckdb.connect(local_store) as conn:
+        if not load_fts(conn):
+            pytest.skip("DuckDB fts extension is not available")
+
+        assert [doc.page_content for doc in keyword_search(conn, "pydata", k=3)] == [_bookmark("https://pandas.pydata.org").page_content]
+
+    # the index follows the bookmarks as they change
+    store_documents([_bookmark("https://duckdb.org"), _bookmark("https://pola.rs")])
+
+    with duckdb.connect(local_store) as conn:
+        load_fts(conn)
+
+        assert keyword_search(conn, "pydata", k=3) == []
+        assert [doc.page_content for doc in keyword_search(conn, "pola", k=3)] == [_bookmark("https://pola.rs").page_content]
+
+
+def test_sync_session_empty(local_store):
+    with SyncSession() as session:
+        result = session.finish(browsers=["chrome"])
+
+    assert result == StoreResult(added=0, removed=0, unchanged=0)
+
+
+@patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+@patch("bookworm_genai.paths.PlatformDirs")
+@patch("bookworm_genai.paths.os.makedirs")
+def test_get_query_embedding_store(mock_os_makedirs: Mock, mock_platform_dirs: Mock):
+    mock_platform_dirs.return_value.user_data_dir = "/test"
+
+    embeddings = _get_query_embedding_store()
+
+    assert isinstance(embeddings, CachedQueryEmbeddings)
+    assert embeddings._path == "/test/query_cache.sqlite"
+
+
+@patch.dict(os.environ, {"BOOKWORM_EMBEDDING_BACKEND": "local"}, clear=True)
+def test_store_documents_local_backend(local_store):
+    # no OPENAI_API_KEY is needed
+    result = store_documents([_bookmark("https://pandas.pydata.org"), _bookmark("https://duckdb.org")])
+
+    assert result == StoreResult(added=2, removed=0, unchanged=0)
+    assert _stored(local_store, "len(embedding)") == [512, 512]
+    assert _stored(local_store, "embedding_backend") == ["local", "local"]
+
+
+def test_store_documents_backend_changed(local_store, embeddings):
+    docs = [_bookmark("https://pandas.pydata.org", browser="chrome"), _bookmark("https://duckdb.org", browser="firefox")]
+
+    source = fingerprint(__file__)
+
+    with SyncSession() as session:
+        session.add(docs)
+        session.finish(sources={"firefox": source})
+
+    assert _stored(local_store, "embedding_backend") == ["openai", "openai"]
+
+    # the vectors of different backends cannot be compared, so everything is embedded again even if only chrome is synced
+    with patch.dict(os.environ, {"BOOKWORM_EMBEDDING_BACKEND": "local"}):
+        with SyncSession() as session:
+            assert not session.is_unchanged("firefox", source)
+
+            session.scope(["chrome"])
+            session.add(docs[:1])
+            result = session.finish(["chrome"])
+
+    assert result == StoreResult(added=1, removed=0, unchanged=0)
+    assert _stored(local_store, "embedding_backend") == ["local"]
+    assert embeddings.aembed_documents.call_count == 1
+
+
+def test_store_documents_backend_changed_dimensions(local_store, embeddings):
+    with SyncSession() as session:
+        session.add([_bookmark("https://pandas.pydata.org")])
+        session.finish()
+
+    # the index fixed the size of the embedding column to the size of the first backend's vectors
+    with patch.dict(os.environ, {"BOOKWORM_EMBEDDING_BACKEND": "local"}):
+        with patch("bookworm_genai.storage._get_embedding_store", return_value=DeterministicFakeEmbedding(size=8)):
+            with SyncSession() as session:
+                session.add([_bookmark("https://pandas.pydata.org")])
+                result = session.finish()
+
+    assert result == StoreResult(added=1, removed=0, unchanged=0)
+    assert _stored(local_store, "len(embedding)") == [8]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        pytest.param(None, EmbeddingBackend.OPENAI, id="default"),
+        pytest.param("openai", EmbeddingBackend.OPENAI, id="openai"),
+        pytest.param("LOCAL", EmbeddingBackend.LOCAL, id="local"),
+    ],
+)
+def test_get_embedding_backend(value: str, expected: EmbeddingBackend):
+    with patch.dict(os.environ, {"BOOKWORM_EMBEDDING_BACKEND": value} if value else {}, clear=True):
+        assert _get_embedding_backend() == expected
+
+
+def test_store_documents_int8_storage(local_store):
+    embeddings = Mock(wraps=DeterministicFakeEmbedding(size=300), model="text-embedding-3-small", dimensions=None)
+
+    with patch("bookworm_genai.storage._get_embedding_store", return_value=embeddings):
+        store_documents([_bookmark("https://pandas.pydata.org"), _bookmark("https://duckdb.org")])
+
+        assert _stored(local_store, "len(embedding)") == [300, 300]
+        assert _stored(local_store, "embedding_storage") == ["float32", "float32"]
+
+        # the embeddings are stored again as int8 (served from the embedding cache rather than the embeddings service)
+        with patch.dict(os.environ, {"BOOKWORM_EMBEDDING_STORAGE": "int8"}):
+            result = store_documents([_bookmark("https://pandas.pydata.org"), _bookmark("https://duckdb.org")])
+
+    assert result == StoreResult(added=2, removed=0, unchanged=0)
+    assert embeddings.aembed_documents.call_count == 1
+
+    # the float32 embeddings are kept to rescore the candidates, which are found by their first dimensions
+    assert _stored(local_store, "len(embedding)") == [300, 300]
+    assert _stored(local_store, "len(embedding_int8)") == [300, 300]
+    assert _stored(local_store, "len(embedding_candidate)") == [256, 256]
+    assert _stored(local_store, "embedding_storage") == ["int8", "int8"]
+
+    with duckdb.connect(local_store) as conn:
+        assert has_index(conn)
+        assert _is_quantized(conn)
+
+
+@pytest.mark.parametrize("model", ["text-embedding-ada-002", LOCAL_EMBEDDING_MODEL])
+@patch.dict(os.environ, {"BOOKWORM_EMBEDDING_STORAGE": "int8"})
+def test_store_documents_int8_storage_not_truncatable(local_store, caplog, model: str):
+    embeddings = Mock(wraps=DeterministicFakeEmbedding(size=300), model=model, dimensions=None)
+
+    with patch("bookworm_genai.storage._get_embedding_store", return_value=embeddings):
+        store_documents([_bookmark("https://pandas.pydata.org")])
+
+    # the int8 embeddings would be stored alongside an index over the float32 ones and only make the database larger
+    assert f"the embeddings of {model} are stored as float32" in caplog.text
+    assert _stored(local_store, "embedding_storage") == ["float32"]
+    assert _stored(local_store, "embedding_int8") == [None]
+
+
+def test_store_documents_int8_storage_size(tmp_path):
+    embeddings = Mock(wraps=DeterministicFakeEmbedding(size=1536), model="text-embedding-3-small", dimensions=None)
+    bookmarks = [_bookmark(f"https://example.com/{index}") for index in range(500)]
+    sizes = {}
+
+    for storage in EmbeddingStorage:
+        path = str(tmp_path / f"{storage.value}.duckdb")
+
+        with patch("bookworm_genai.storage._get_local_store", return_value=path), patch("bookworm_genai.storage._get_embedding_store", return_value=embeddings):
+            with patch.dict(os.environ, {"BOOKWORM_EMBEDDING_STORAGE": storage.value}):
+                store_documents(bookmarks)
+
+        sizes[storage] = os.path.getsize(path)
+
+    # the index is built over the first 256 dimensions rather than every one of the float32 embeddings
+    assert sizes[EmbeddingStorage.INT8] < sizes[EmbeddingStorage.FLOAT32] * 0.9
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        pytest.param(None, EmbeddingStorage.FLOAT32, id="default"),
+        pytest.param("INT8", EmbeddingStorage.INT8, id="int8"),
+    ],
+)
+def test_get_embedding_storage(value: str, expected: EmbeddingStorage):
+    with patch.dict(os.environ, {"BOOKWORM_EMBEDDING_STORAGE": value} if value else {}, clear=True):
+        assert _get_embedding_storage() == expected
+
+
+@patch.dict(os.environ, {"BOOKWORM_EMBEDDING_STORAGE": "float16"}, clear=True)
+def test_get_embedding_storage_unknown():
+    with pytest.raises(ValueError, match="Unknown embedding storage 'float16'"):
+        _get_embedding_storage()
+
+
+@patch.dict(os.environ, {"BOOKWORM_EMBEDDING_BACKEND": "onnx"}, clear=True)
+def test_get_embedding_backend_unknown():
+    with pytest.raises(ValueError, match="Unknown embedding backend 'onnx'"):
+        _get_embedding_backend()
+
+
+@patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+def test_get_query_embedding_store_stored_backend(local_store, tmp_path):
+    with patch.dict(os.environ, {"BOOKWORM_EMBEDDING_BACKEND": "local"}):
+        store_documents([_bookmark("https://pandas.pydata.org")])
+
+    # queries are embedded by the backend which embedded the stored bookmarks rather than the configured one
+    with patch("bookworm_genai.storage._get_query_cache_store", return_value=str(tmp_path / "query_cache.sqlite")):
+        with duckdb.connect(local_store) as conn:
+            embeddings = _get_query_embedding_store(conn)
+
+    assert isinstance(embeddings._embeddings, HashingEmbeddings)
@@ -1,15 +1,27 @@
+import logging
 import os
+import json
 from getpass import getuser
 import sys
+import threading
 from unittest.mock import patch, Mock, call, ANY
 
 import pytest
+from langchain_core.documents import Document
 
 from bookworm_genai import __version__
 from bookworm_genai.commands.sync import _estimate_cost, sync
 from bookworm_genai.integrations import Browser, browsers
+from bookworm_genai.loaders import BookmarkDelta
 from bookworm_genai.metadata import Metadata
-from bookworm_genai.utils import sql_loader_firefox_sql_query
+from bookworm_genai.utils import sql_loader_firefox_copy_path
+
+
+@pytest.fixture(autouse=True)
+def mock_paused_server():
+    # no 'bookworm serve' is running unless a test says otherwise
+    with patch("bookworm_genai.commands.sync.paused_server") as mock:
+        yield mock
 
 
 def _mock_browsers_config(platform: str = "linux", mocked_documents: list[any] = ["DOC1", "DOC2"]):
@@ -25,13 +37,12 @@ def _mock_browsers_config(platform: str = "linux", mocked_documents: list[any] =
             except KeyError:
                 continue
 
-            if "db" in config[platform]["bookmark_loader_kwargs"]:
-                mock_sqlite = Mock()
-                mock_sqlite.return_value.return_value._engine.url = "mocked_database_connection"
+    return new_browsers
 
-                config[platform]["bookmark_loader_kwargs"]["db"] = mock_sqlite
 
-    return new_browsers
+def _stored_documents(mock_sync_session: Mock) -> list:
+    session = mock_sync_session.return_value.__enter__.return_value
+    return [doc for (chunk,), _ in session.add.call_args_list for doc in chunk]
 
 
 def _collect_browser_calls(platform: str, browsers: dict) -> tuple[list[str], list[call]]:
@@ -44,11 +55,6 @@ def _collect_browser_calls(platform: str, browsers: dict) -> tuple[list[str], li
 
         if "file_path" in config[platform]["bookmark_loader_kwargs"]:
             collected_file_paths.append(config[platform]["bookmark_loader_kwargs"]["file_path"])
-        elif "db" in config[platform]["bookmark_loader_kwargs"]:
-            path = config[platform]["bookmark_loader_kwargs"]["db"]
-            if callable(path):
-                path = path(path)
-                collected_file_paths.append(path._engine.url)
 
         collected_loader_calls.extend(config[platform]["bookmark_loader"].call_args_list)
 
@@ -60,9 +66,9 @@ def _collect_browser_calls(platform: str, browsers: dict) -> tuple[list[str], li
 @patch("bookworm_genai.commands.sync.glob")
 @patch("bookworm_genai.commands.sync.shutil")
 @patch("bookworm_genai.commands.sync.os.makedirs")
-@patch("bookworm_genai.commands.sync.store_documents")
+@patch("bookworm_genai.commands.sync.SyncSession")
 @patch("bookworm_genai.commands.sync.sys")
-def test_sync_linux(mock_sys: Mock, mock_store_documents: Mock, mock_makedirs: Mock, mock_shutil: Mock, mock_glob: Mock):
+def test_sync_linux(mock_sys: Mock, mock_sync_session: Mock, mock_makedirs: Mock, mock_shutil: Mock, mock_glob: Mock):
     platform = "linux"
 
     mock_sys.platform = platform
@@ -77,33 +83,32 @@ def test_sync_linux(mock_sys: Mock, mock_store_documents: Mock, mock_makedirs: M
     assert collected_file_paths == [
         f"/home/{user}/.config/BraveSoftware/Brave-Browser/Default/Bookmarks",
         f"/home/{user}/.config/google-chrome/Default/Bookmarks",
-        "mocked_database_connection",
+        f"/home/{user}/.mozilla/firefox/*.default-release/places.sqlite",
     ]
 
     assert collected_loader_calls == [
         call(
             file_path=ANY,
-            jq_schema='\n  [.roots.bookmark_bar.children, .roots.other.children] |\n  flatten |\n  .. |\n  objects |\n  select(.type == "url")\n',
-            text_content=False,
         ),
         call(
             file_path=ANY,
-            jq_schema='\n  [.roots.bookmark_bar.children, .roots.other.children] |\n  flatten |\n  .. |\n  objects |\n  select(.type == "url")\n',
-            text_content=False,
         ),
-        call(db=ANY, query=sql_loader_firefox_sql_query(), source_columns=["source"], page_content_mapper=ANY),
+        call(file_path=ANY),
     ]
 
-    assert mock_store_documents.call_count == 1, "store_documents should be called once"
+    assert mock_sync_session.call_count == 1, "a single sync session should be opened"
 
-    args, _ = mock_store_documents.call_args_list[0]
-    assert len(args) == 1, "store_documents should be called with one argument"
+    session = mock_sync_session.return_value.__enter__.return_value
+    assert session.finish.call_args_list == [
+        call(browsers=["brave", "chrome", "firefox"], sources={}, deltas={})
+    ], "the sync should be scoped to the browsers that were synced"
 
-    stored_documents = args[0]
-    assert len(stored_documents) == 6, "store_documents should be called with 6 documents. 2 per browser"
+    stored_documents = _stored_documents(mock_sync_session)
+    assert len(stored_documents) == 6, "the sync session should be given 6 documents. 2 per browser"
 
-    assert mock_makedirs.call_args_list == [call("/tmp/bookworm", exist_ok=True)]
-    assert mock_shutil.copy.call_args_list == [call(mock_glob.glob.return_value[0], "/tmp/bookworm/firefox.sqlite")]
+    # firefox is read in place rather than copied
+    assert not mock_makedirs.called
+    assert not mock_shutil.copy.called
 
 
 @pytest.mark.skipif(sys.platform != "darwin", reason="this test is only for macos")
@@ -111,9 +116,9 @@ def test_sync_linux(mock_sys: Mock, mock_store_documents: Mock, mock_makedirs: M
 @patch("bookworm_genai.commands.sync.glob")
 @patch("bookworm_genai.commands.sync.shutil")
 @patch("bookworm_genai.commands.sync.os.makedirs")
-@patch("bookworm_genai.commands.sync.store_documents")
+@patch("bookworm_genai.commands.sync.SyncSession")
 @patch("bookworm_genai.commands.sync.sys")
-def test_sync_macos(mock_sys: Mock, mock_store_documents: Mock, mock_makedirs: Mock, mock_shutil: Mock, mock_glob: Mock):
+def test_sync_macos(mock_sys: Mock, mock_sync_session: Mock, mock_makedirs: Mock, mock_shutil: Mock, mock_glob: Mock):
     platform = "darwin"
 
     mock_sys.platform = platform
@@ -130,30 +135,26 @@ def test_sync_macos(mock_sys: Mock, mock_store_documents: Mock, mock_makedirs: M
         # chrome
         f"/Users/{user}/Library/Application Support/Google/Chrome/Default/Bookmarks",
         # firefox
-        "mocked_database_connection",
+        sql_loader_firefox_copy_path(),
     ]
     assert collected_loader_calls == [
         # brave
         call(
             file_path=f"/Users/{user}/Library/Application Support/BraveSoftware/Brave-Browser/Default/Bookmarks",
-            jq_schema='\n  [.roots.bookmark_bar.children, .roots.other.children] |\n  flatten |\n  .. |\n  objects |\n  select(.type == "url")\n',
-            text_content=False,
         ),
         # chrome
         call(
             file_path=f"/Users/{user}/Library/Application Support/Google/Chrome/Default/Bookmarks",
-            jq_schema='\n  [.roots.bookmark_bar.children, .roots.other.children] |\n  flatten |\n  .. |\n  objects |\n  select(.type == "url")\n',
-            text_content=False,
         ),
         # firefox
-        call(db=ANY, query=sql_loader_firefox_sql_query(), source_columns=["source"], page_content_mapper=ANY),
+        call(file_path=sql_loader_firefox_copy_path()),
     ]
 
 
-@patch("bookworm_genai.commands.sync.store_documents")
+@patch("bookworm_genai.commands.sync.SyncSession")
 @patch.dict(browsers, _mock_browsers_config(), clear=True)
 @patch("bookworm_genai.commands.sync.sys")
-def test_sync_platform_unsupported(mock_sys: Mock, mock_store_documents: Mock, caplog):
+def test_sync_platform_unsupported(mock_sys: Mock, mock_sync_session: Mock, caplog):
     platform = "unsupported"
 
     mock_sys.platform = platform
@@ -161,7 +162,7 @@ def test_sync_platform_unsupported(mock_sys: Mock, mock_store_documents: Mock, c
     browsers = _mock_browsers_config()
     sync(browsers)
 
-    assert not mock_store_documents.called
+    assert not mock_sync_session.called
 
     logs = [log.message for log in caplog.records if log.levelname == "WARNING"]
     logs.sort()
@@ -175,28 +176,30 @@ def test_sync_platform_unsupported(mock_sys: Mock, mock_store_documents: Mock, c
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
 @patch.dict(browsers, _mock_browsers_config(), clear=True)
 @patch("builtins.input")
-@patch("bookworm_genai.commands.sync.tiktoken")
+@patch("bookworm_genai.commands.sync.count_tokens")
+@patch("bookworm_genai.commands.sync.unsent_documents")
 @patch("bookworm_genai.commands.sync.glob")
 @patch("bookworm_genai.commands.sync.shutil")
 @patch("bookworm_genai.commands.sync.os.makedirs")
-@patch("bookworm_genai.commands.sync.store_documents")
+@patch("bookworm_genai.commands.sync.SyncSession")
 @patch("bookworm_genai.commands.sync.sys")
 def test_sync_estimate_cost(
     mock_sys: Mock,
-    mock_store_documents: Mock,
+    mock_sync_session: Mock,
     mock_makedirs: Mock,
     mock_shutil: Mock,
     mock_glob: Mock,
-    mock_tiktoken: Mock,
+    mock_unsent_documents: Mock,
+    mock_count_tokens: Mock,
     mocked_input: Mock,
     caplog,
 ):
     platform = "linux"
     mock_sys.platform = platform
 
-    mock_encoding = Mock()
-    mock_encoding.encode.return_value = "mocked_page_content" * 100  # The multiplier just simulates a larger document
-    mock_tiktoken.encoding_for_model.return_value = mock_encoding
+    # every document is sent, 1900 tokens each
+    mock_unsent_documents.side_effect = lambda docs, browsers, embeddings: docs
+    mock_count_tokens.return_value = 5700
 
     # At the time of writing ada v2 is priced at $0.100 per 1M tokens
     # so this is what we are using for this unit test
@@ -210,40 +213,67 @@ def test_sync_estimate_cost(
     browsers = _mock_browsers_config(mocked_documents=mocked_documents)
     cost = sync(browsers, estimate_cost=True)
 
-    assert not mock_store_documents.called
-    assert mock_encoding.encode.call_args_list == [
-        call("mocked_page_content"),
-        call("mocked_page_content"),
-        call("mocked_page_content"),
-    ]
+    assert not mock_sync_session.called
+
+    (_, estimated_browsers, embeddings), _ = mock_unsent_documents.call_args
+    assert estimated_browsers == ["brave", "chrome", "firefox"]
+    assert embeddings.model == "text-embedding-ada-002"
+
+    assert mock_count_tokens.call_args == call(["mocked_page_content", "mocked_page_content", "mocked_page_content"], "text-embedding-ada-002")
 
     assert cost == 0.0005700000000000001
 
 
+@patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
+@patch("bookworm_genai.commands.sync.count_tokens")
+@patch("bookworm_genai.commands.sync.unsent_documents")
+def test_sync_estimate_cost_unsent_only(mock_unsent_documents: Mock, mock_count_tokens: Mock, caplog):
+    docs = [Document(page_content="stored"), Document(page_content="new")]
+
+    mock_unsent_documents.return_value = docs[1:]
+    mock_count_tokens.return_value = 1000
+
+    with caplog.at_level(logging.INFO):
+        cost = _estimate_cost(docs, cost_per_million=0.100, browsers=["chrome"])
+
+    assert mock_count_tokens.call_args == call(["new"], "text-embedding-ada-002")
+    assert cost == 0.0001
+    assert "1 of 2 bookmarks would be embedded, the others are stored or cached already" in caplog.messages
+
+
 @patch.dict(os.environ, {"OPENAI_API_KEY": "secret"}, clear=True)
 @patch("builtins.input")
-@patch("bookworm_genai.commands.sync.tiktoken")
-def test_sync_estimate_cost_non_interactive(mock_tiktoken: Mock, mock_input: Mock):
+@patch("bookworm_genai.commands.sync.count_tokens")
+@patch("bookworm_genai.commands.sync.unsent_documents")
+def test_sync_estimate_cost_non_interactive(mock_unsent_documents: Mock, mock_count_tokens: Mock, mock_input: Mock):
     mocked_documents = [
         Mock(page_content="mocked_page_content"),
     ]
 
-    mock_encoding = Mock()
-    mock_encoding.encode.return_value = "mocked_page_content" * 100  # The multiplier just simulates a larger document
-    mock_tiktoken.encoding_for_model.return_value = mock_encoding
+    mock_count_tokens.return_value = 1900
 
     cost = _estimate_cost(mocked_documents, cost_per_million=0.100)
 
     assert cost == 0.00019
     assert not mock_input.called
 
+    # without the browsers being synced every document is priced
+    assert not mock_unsent_documents.called
+
+
+@patch.dict(os.environ, {"BOOKWORM_EMBEDDING_BACKEND": "local"}, clear=True)
+@patch("bookworm_genai.commands.sync.count_tokens")
+def test_sync_estimate_cost_local(mock_count_tokens: Mock):
+    assert _estimate_cost([Mock(page_content="mocked_page_content")]) == 0.0
+    assert not mock_count_tokens.called
+
 
 @patch("bookworm_genai.commands.sync.glob")
 @patch("bookworm_genai.commands.sync.shutil")
 @patch("bookworm_genai.commands.sync.os.makedirs")
-@patch("bookworm_genai.commands.sync.store_documents")
+@patch("bookworm_genai.commands.sync.SyncSession")
 @patch("bookworm_genai.commands.sync.sys")
-def test_sync_browser_filter(mock_sys: Mock, mock_store_documents: Mock, mock_makedirs: Mock, mock_shutil: Mock, mock_glob: Mock):
+def test_sync_browser_filter(mock_sys: Mock, mock_sync_session: Mock, mock_makedirs: Mock, mock_shutil: Mock, mock_glob: Mock):
     browser_filter = [Browser.CHROME.value]
 
     platform = "darwin"
@@ -256,11 +286,11 @@ def test_sync_browser_filter(mock_sys: Mock, mock_store_documents: Mock, mock_ma
     assert not browsers[Browser.FIREFOX][platform]["bookmark_loader"].called
 
 
-@patch("bookworm_genai.commands.sync.store_documents")
+@patch("bookworm_genai.commands.sync.SyncSession")
 @patch("bookworm_genai.commands.sync.os")
 @patch("bookworm_genai.commands.sync.shutil")
 @patch("bookworm_genai.commands.sync.glob")
-def test_sync_copy_source_missing(mock_glob: Mock, mock_shutil: Mock, mock_os: Mock, mock_store_documents: Mock):
+def test_sync_copy_source_missing(mock_glob: Mock, mock_shutil: Mock, mock_os: Mock, mock_sync_session: Mock):
     path_to_missing_file = "/path/to/missing/file"
 
     mock_docs_loader = Mock()
@@ -295,15 +325,212 @@ def test_sync_copy_source_missing(mock_glob: Mock, mock_shutil: Mock, mock_os: M
     mock_glob.glob.assert_called_once_with(path_to_missing_file)
 
     # ensures that even if the first browser fails, the second one still extracts docs and submits to storage
-    assert mock_store_documents.call_count == 1
-    assert len(mock_store_documents.call_args_list[0]) == 2
+    assert mock_sync_session.call_count == 1
+    assert len(_stored_documents(mock_sync_session)) == 2
 
 
-@patch("bookworm_genai.commands.sync.store_documents")
-def test_sync_metadata_attached(store_document: Mock):
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_metadata_attached(mock_sync_session: Mock):
     document_mock = Mock("DOC1", metadata={}, page_content="")
     mock_browsers = _mock_browsers_config(sys.platform, [document_mock])
 
     sync(mock_browsers, browser_filter=Browser.CHROME)
 
     assert document_mock.metadata == {Metadata.Browser.value: Browser.CHROME.value, Metadata.BookwormVersion.value: __version__}
+
+
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_estimate_cost_deduplicates_across_browsers(mock_sync_session: Mock):
+    def _loader(browser: str) -> Mock:
+        loader = Mock()
+        loader.return_value.lazy_load.return_value = [
+            Document(page_content=json.dumps({"name": "bookworm", "url": "https://github.com/kiran94/bookworm/"}), metadata={"source": browser}),
+        ]
+        return loader
+
+    browsers = {
+        Browser.BRAVE: {sys.platform: {"bookmark_loader": _loader("brave"), "bookmark_loader_kwargs": {}}},
+        Browser.CHROME: {sys.platform: {"bookmark_loader": _loader("chrome"), "bookmark_loader_kwargs": {}}},
+    }
+
+    with patch("bookworm_genai.commands.sync._estimate_cost") as mock_estimate_cost:
+        sync(browsers, estimate_cost=True)
+
+    (estimated_documents,), _ = mock_estimate_cost.call_args
+    assert len(estimated_documents) == 1
+    assert estimated_documents[0].metadata["browsers"] == ["brave", "chrome"]
+    assert not mock_sync_session.called
+
+
+@patch("bookworm_genai.commands.sync.DEFAULT_CHUNK_SIZE", 2)
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_streams_chunks(mock_sync_session: Mock):
+    loader = Mock()
+    loader.return_value.lazy_load.return_value = iter([Document(page_content=str(index)) for index in range(5)])
+
+    sync({Browser.CHROME: {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {}}}})
+
+    session = mock_sync_session.return_value.__enter__.return_value
+    assert [[doc.page_content for doc in chunk] for (chunk,), _ in session.add.call_args_list] == [["0", "1"], ["2", "3"], ["4"]]
+    assert session.finish.call_args_list == [call(browsers=["chrome"], sources={}, deltas={})]
+
+
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_browser_failure_isolated(mock_sync_session: Mock, caplog):
+    broken_loader = Mock()
+    broken_loader.return_value.lazy_load.side_effect = OSError("database is locked")
+
+    loader = Mock()
+    loader.return_value.lazy_load.return_value = [Document(page_content="DOC1"), Document(page_content="DOC2")]
+
+    browsers = {
+        Browser.FIREFOX: {sys.platform: {"bookmark_loader": broken_loader, "bookmark_loader_kwargs": {}}},
+        Browser.CHROME: {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {}}},
+    }
+
+    sync(browsers)
+
+    assert [doc.page_content for doc in _stored_documents(mock_sync_session)] == ["DOC1", "DOC2"]
+
+    # the broken browser is left out so that its stored bookmarks are kept
+    session = mock_sync_session.return_value.__enter__.return_value
+    assert session.finish.call_args_list == [call(browsers=["chrome"], sources={}, deltas={})]
+
+    logs = [log.message for log in caplog.records if log.levelname == "WARNING"]
+    assert logs == ["🔄 browser firefox skipped as it failed to load: database is locked"]
+
+
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_browsers_loaded_concurrently(mock_sync_session: Mock):
+    # each loader waits for the other, which can only succeed if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def _loader(content: str) -> Mock:
+        def lazy_load():
+            barrier.wait()
+            yield Document(page_content=content)
+
+        loader = Mock()
+        loader.return_value.lazy_load.side_effect = lazy_load
+        return loader
+
+    browsers = {
+        Browser.BRAVE: {sys.platform: {"bookmark_loader": _loader("DOC1"), "bookmark_loader_kwargs": {}}},
+        Browser.CHROME: {sys.platform: {"bookmark_loader": _loader("DOC2"), "bookmark_loader_kwargs": {}}},
+    }
+
+    sync(browsers)
+
+    # browsers are still stored in the order of the manifest
+    assert [doc.page_content for doc in _stored_documents(mock_sync_session)] == ["DOC1", "DOC2"]
+
+    session = mock_sync_session.return_value.__enter__.return_value
+    assert session.finish.call_args_list == [call(browsers=["brave", "chrome"], sources={}, deltas={})]
+
+
+@patch("bookworm_genai.commands.sync.LOAD_QUEUE_SIZE", 1)
+@patch("bookworm_genai.commands.sync.DEFAULT_CHUNK_SIZE", 1)
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_storage_failure_stops_loaders(mock_sync_session: Mock):
+    mock_sync_session.return_value.__enter__.return_value.add.side_effect = RuntimeError("disk full")
+
+    loader = Mock()
+    loader.return_value.lazy_load.return_value = [Document(page_content=str(index)) for index in range(10)]
+
+    with pytest.raises(RuntimeError, match="disk full"):
+        sync({Browser.CHROME: {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {}}}})
+
+
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_skips_unchanged_browsers(mock_sync_session: Mock, tmp_path):
+    session = mock_sync_session.return_value.__enter__.return_value
+    session.is_unchanged.side_effect = lambda browser, source: browser == "brave"
+
+    def _browser(name: str) -> dict:
+        path = tmp_path / name
+        path.write_text("{}")
+
+        loader = Mock()
+        loader.return_value.lazy_load.return_value = [Document(page_content=name)]
+        return {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {"file_path": str(path)}}}
+
+    browsers = {Browser.BRAVE: _browser("brave"), Browser.CHROME: _browser("chrome")}
+
+    sync(browsers)
+
+    assert not browsers[Browser.BRAVE][sys.platform]["bookmark_loader"].called
+    assert session.scope.call_args_list == [call(["chrome"])]
+    assert [doc.page_content for doc in _stored_documents(mock_sync_session)] == ["chrome"]
+
+    # the source of chrome is recorded so that it is skipped next time if it does not change
+    (finish_call,) = session.finish.call_args_list
+    assert finish_call.kwargs["browsers"] == ["chrome"]
+    assert finish_call.kwargs["sources"]["chrome"].path == str(tmp_path / "chrome")
+
+
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_nothing_changed(mock_sync_session: Mock, tmp_path):
+    session = mock_sync_session.return_value.__enter__.return_value
+    session.is_unchanged.return_value = True
+
+    (tmp_path / "Bookmarks").write_text("{}")
+    loader = Mock()
+
+    sync({Browser.CHROME: {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {"file_path": str(tmp_path / "Bookmarks")}}}})
+
+    assert not loader.called
+    assert not session.add.called
+    assert not session.finish.called
+
+    # indexes which are missing (e.g the store was created by an older version) are still built
+    assert session.build_indexes.called
+
+    # unless forced
+    sync({Browser.CHROME: {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {"file_path": str(tmp_path / "Bookmarks")}}}}, force=True)
+
+    assert loader.called
+    assert session.finish.called
+
+
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_loads_delta(mock_sync_session: Mock, tmp_path):
+    session = mock_sync_session.return_value.__enter__.return_value
+    session.is_unchanged.return_value = False
+    session.watermark.return_value = 10
+
+    (tmp_path / "places.sqlite").write_text("")
+    delta = BookmarkDelta(watermark=20, ids=["1"], changed=["1"])
+
+    loader = Mock(supports_delta=True)
+    loader.return_value.lazy_load.return_value = [Document(page_content="DOC1")]
+    loader.return_value.delta = delta
+
+    sync({Browser.FIREFOX: {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {"file_path": str(tmp_path / "places.sqlite")}}}})
+
+    assert loader.call_args_list == [call(file_path=str(tmp_path / "places.sqlite"), since=10)]
+
+    # only the changes of firefox were loaded, so its other stored bookmarks are kept
+    assert session.scope.call_args_list == [call([])]
+
+    (finish_call,) = session.finish.call_args_list
+    assert finish_call.kwargs["browsers"] == []
+    assert finish_call.kwargs["deltas"] == {"firefox": delta}
+    assert finish_call.kwargs["sources"]["firefox"].content_hash is None, "sources loaded as deltas are not hashed"
+
+
+@patch("bookworm_genai.commands.sync.SyncSession")
+def test_sync_pauses_server(mock_sync_session: Mock, mock_paused_server: Mock):
+    events: list[str] = []
+    mock_paused_server.return_value.__enter__.side_effect = lambda: events.append("pause")
+    mock_paused_server.return_value.__exit__.side_effect = lambda *args: events.append("resume")
+    session = Mock()
+    mock_sync_session.return_value.__enter__.side_effect = lambda: events.append("open") or session
+    mock_sync_session.return_value.__exit__.side_effect = lambda *args: events.append("commit")
+
+    loader = Mock()
+    loader.return_value.lazy_load.return_value = [Document(page_content="1")]
+
+    sync({Browser.CHROME: {sys.platform: {"bookmark_loader": loader, "bookmark_loader_kwargs": {}}}})
+
+    # a running 'bookworm serve' closes the database before the sync opens it and reloads it once the sync committed
+    assert events == ["pause", "open", "commit", "resume"]
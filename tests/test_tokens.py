@@ -0,0 +1,95 @@
+import os
+from unittest.mock import Mock, call, patch
+
+import pytest
+
+from bookworm_genai.tokens import count_tokens
+
+
+@pytest.fixture(autouse=True)
+def token_cache(tmp_path):
+    path = str(tmp_path / "token_cache.sqlite")
+
+    with patch("bookworm_genai.tokens._get_token_cache_store", return_value=path):
+        yield path
+
+
+@pytest.fixture(autouse=True)
+def encoding_cache(tmp_path):
+    with patch.dict(os.environ, {"TIKTOKEN_CACHE_DIR": str(tmp_path / "tiktoken")}):
+        yield
+
+
+@pytest.fixture
+def mock_encoding():
+    encoding = Mock()
+    encoding.name = "cl100k_base"
+    encoding.encode_ordinary_batch.side_effect = lambda texts, num_threads: [text.split() for text in texts]
+
+    with patch("bookworm_genai.tokens.tiktoken") as mock_tiktoken:
+        mock_tiktoken.encoding_for_model.return_value = encoding
+        yield encoding
+
+
+def test_count_tokens(mock_encoding: Mock):
+    assert count_tokens(["a b", "c d e", "a b"], "text-embedding-ada-002") == 7
+
+    # each text is only encoded once
+    (texts,), _ = mock_encoding.encode_ordinary_batch.call_args
+    assert texts == ["a b", "c d e"]
+
+
+def test_count_tokens_cached(mock_encoding: Mock):
+    assert count_tokens(["a b", "c d e"], "text-embedding-ada-002") == 5
+    assert count_tokens(["c d e", "f"], "text-embedding-ada-002") == 4
+
+    assert [texts for (texts,), _ in mock_encoding.encode_ordinary_batch.call_args_list] == [["a b", "c d e"], ["f"]]
+
+
+def test_count_tokens_cached_per_encoding(mock_encoding: Mock):
+    count_tokens(["a b"], "text-embedding-ada-002")
+
+    mock_encoding.name = "o200k_base"
+    count_tokens(["a b"], "text-embedding-ada-002")
+
+    assert mock_encoding.encode_ordinary_batch.call_count == 2
+
+
+@patch("bookworm_genai.tokens.tiktoken")
+def test_count_tokens_unknown_model(mock_tiktoken: Mock):
+    mock_tiktoken.encoding_for_model.side_effect = KeyError("unknown-model")
+    mock_tiktoken.get_encoding.return_value.name = "cl100k_base"
+    mock_tiktoken.get_encoding.return_value.encode_ordinary_batch.return_value = [[1, 2]]
+
+    assert count_tokens(["a b"], "unknown-model") == 2
+    assert mock_tiktoken.get_encoding.call_args == call("cl100k_base")
+
+
+@patch("bookworm_genai.tokens.tiktoken")
+def test_count_tokens_offline(mock_tiktoken: Mock, caplog):
+    # tiktoken raises the errors of requests when it cannot download the encoding, which are OSErrors
+    mock_tiktoken.encoding_for_model.side_effect = ConnectionError("network is unreachable")
+
+    assert count_tokens(["a" * 40, "b" * 7], "text-embedding-ada-002") == 11 + 2
+    assert "estimating tokens from the length of the text" in caplog.text
+
+
+@patch("bookworm_genai.tokens.tiktoken")
+def test_count_tokens_encoding_cache(mock_tiktoken: Mock, tmp_path):
+    cache_dirs = []
+
+    def encoding_for_model(model: str) -> Mock:
+        cache_dirs.append(os.environ.get("TIKTOKEN_CACHE_DIR"))
+        return Mock(encode_ordinary_batch=Mock(return_value=[]))
+
+    mock_tiktoken.encoding_for_model.side_effect = encoding_for_model
+
+    with patch.dict(os.environ, clear=True), patch("bookworm_genai.tokens._get_data_path", return_value=str(tmp_path / "data")) as mock_data_path:
+        count_tokens([], "text-embedding-ada-002")
+
+        # the encoding is downloaded into (and then loaded from) bookworm's data directory
+        assert cache_dirs == [str(tmp_path / "data")]
+        assert mock_data_path.call_args == call("tiktoken")
+
+        # the environment of the process is left as it was
+        assert "TIKTOKEN_CACHE_DIR" not in os.environ
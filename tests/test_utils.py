@@ -1,7 +1,7 @@
 from unittest.mock import Mock, patch
 
 import pytest
-from bookworm_genai.utils import sql_loader_firefox_copy_path, sql_loader_page_content_mapper
+from bookworm_genai.utils import chunked, sql_loader_firefox_copy_path, sql_loader_page_content_mapper
 
 
 def test_sql_loader_page_content_mapper():
@@ -37,3 +37,15 @@ def test_sql_loader_firefox_copy_path_unknown(mock_sys: Mock):
 
     with pytest.raises(NotImplementedError, match="Platform unknown is not supported"):
         sql_loader_firefox_copy_path()
+
+
+@pytest.mark.parametrize(
+    "items, size, expected",
+    [
+        pytest.param([], 2, [], id="empty"),
+        pytest.param([1, 2, 3, 4], 2, [[1, 2], [3, 4]], id="exact"),
+        pytest.param([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]], id="remainder"),
+    ],
+)
+def test_chunked(items: list[int], size: int, expected: list[list[int]]):
+    assert list(chunked(iter(items), size)) == expected